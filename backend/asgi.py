@@ -0,0 +1,91 @@
+"""ASGI entry point: /chat waits on Dialogflow on the event loop, every other route runs the Flask app.
+
+    uvicorn asgi:app --port 5000
+    gunicorn --config gunicorn.conf.py --worker-class uvicorn.workers.UvicornWorker asgi:app
+
+Under the threaded WSGI server every in-flight Dialogflow call holds a thread. Here a
+slow call is a pending coroutine, at most DIALOGFLOW_MAX_CONCURRENCY of them per worker.
+WhatsApp messages are still answered by the message queue's threads, which block on
+the synchronous client.
+"""
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+
+import main
+
+# Threads for the Flask routes, which still block while they run
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '8'))
+
+flask_app = WSGIMiddleware(main.app, workers=ASGI_WSGI_THREADS)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, payload, status):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            # As flask-cors does for the Flask routes
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def chat(scope, receive, send):
+    """POST /chat, answered like main.chat_with_agent"""
+    headers = dict(scope['headers'])
+    body = await read_body(receive)
+    data = None
+    if headers.get(b'content-type', b'').split(b';')[0].strip() == b'application/json':
+        try:
+            data = json.loads(body)
+        except ValueError:
+            pass
+    payload, status = await main.chat_with_agent_async(data)
+    await send_json(send, payload, status)
+
+
+def profiled(scope):
+    """An admin asked to profile this request, which the Flask route does (sampled profiles are Flask routes only)"""
+    token = dict(scope['headers']).get(b'x-admin-token')
+    return token is not None and main.admin_token_matches(token.decode('latin-1'))
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if main.STARTUP_WARMUP:
+                main.start_background_warmup()
+                try:
+                    main.get_async_session_client()
+                except Exception as e:
+                    main.logger.error("Failed to initialize Dialogflow CX async client: %s", e)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await main.close_async_session_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/chat' and scope['method'] == 'POST' and not profiled(scope):
+        await chat(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
@@ -0,0 +1,114 @@
+"""Benchmark accommodation queries: the old filter-and-sort scan against the price/rating index.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_accommodations
+"""
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import GoogleSheetsDataStore  # noqa: E402
+
+SIZES = [1000, 10000, 100000]
+AREAS = ['victoria_island', 'VI', 'lekki', 'Lekki Phase 1', 'ikeja', 'ikoyi', 'surulere', 'yaba']
+TYPES = ['hotel', 'shortlet', 'guesthouse']
+QUERIES = [
+    {},
+    {'area': 'lekki'},
+    {'area': 'lekki', 'max_budget': 30000},
+    {'accommodation_type': 'hotel', 'max_budget': 150000},
+    {'area': 'ikoyi', 'accommodation_type': 'shortlet', 'min_budget': 20000, 'max_budget': 40000},
+]
+
+
+def make_rows(count, seed=42):
+    """Synthetic accommodation rows with the messy prices and ratings seen in the sheet"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        price = rng.randint(8, 250) * 1000
+        rows.append({
+            'name': f"Place {i}",
+            'type': rng.choice(TYPES),
+            'area': rng.choice(AREAS),
+            'price_per_night': rng.choice([price, f"{price:,}", f"₦{price:,}", f"NGN {price}", 'Call for price']),
+            'currency': 'NGN',
+            'features': 'Pool, Gym, WiFi',
+            'rating': rng.choice([round(rng.uniform(2.5, 5.0), 1), f"{rng.uniform(2.5, 5.0):.1f}/5", '']),
+        })
+    return rows
+
+
+def legacy_get_accommodations(accommodations, store, filters):
+    """The previous implementation: filter every row, regex-parse, sort everything, slice"""
+    filtered = []
+    for accommodation in accommodations:
+        if filters.get('area'):
+            if store._normalize_area_value(accommodation.get('area')) != store._normalize_area_value(filters['area']):
+                continue
+        if filters.get('max_budget'):
+            price_str = str(accommodation.get('price_per_night', '0')).replace(',', '').replace('₦', '').replace('NGN', '').strip()
+            price_match = re.search(r'(\d+(?:\.\d+)?)', price_str)
+            if price_match and float(price_match.group(1)) > float(filters['max_budget']):
+                continue
+        if filters.get('min_budget'):
+            price_str = str(accommodation.get('price_per_night', '0')).replace(',', '').replace('₦', '').replace('NGN', '').strip()
+            price_match = re.search(r'(\d+(?:\.\d+)?)', price_str)
+            if price_match and float(price_match.group(1)) < float(filters['min_budget']):
+                continue
+        if filters.get('accommodation_type'):
+            if str(accommodation.get('type', '')).lower().strip() != str(filters['accommodation_type']).lower().strip():
+                continue
+        filtered.append(accommodation)
+
+    def get_rating(accommodation):
+        rating_match = re.search(r'(\d+(?:\.\d+)?)', str(accommodation.get('rating', '0')).strip())
+        return float(rating_match.group(1)) if rating_match else 0.0
+
+    filtered.sort(key=get_rating, reverse=True)
+    return filtered[:5]
+
+
+def time_per_call(func, min_seconds=0.5):
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    print(f"{'rows':>7} {'query':<60} {'legacy us':>11} {'indexed us':>11} {'speedup':>8}")
+
+    for size in SIZES:
+        rows = make_rows(size)
+        store = GoogleSheetsDataStore(client=object(), snapshot_path=None)
+
+        started = time.perf_counter()
+        store._store_snapshots({'accommodations': rows})
+        build_ms = (time.perf_counter() - started) * 1000
+
+        for filters in QUERIES:
+            legacy = legacy_get_accommodations(rows, store, filters)
+            indexed = store.get_accommodations(dict(filters))
+            assert [row['name'] for row in legacy] == [row['name'] for row in indexed], filters
+
+            legacy_us = time_per_call(lambda: legacy_get_accommodations(rows, store, filters)) * 1e6
+            indexed_us = time_per_call(lambda: store.get_accommodations(dict(filters))) * 1e6
+            print(f"{size:>7} {str(filters):<60} {legacy_us:>11.1f} {indexed_us:>11.1f} {legacy_us / indexed_us:>7.0f}x")
+
+        print(f"{size:>7} snapshot load incl. records and indexes: {build_ms:.1f} ms (once per refresh)")
+
+
+if __name__ == '__main__':
+    main()
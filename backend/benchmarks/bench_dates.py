@@ -0,0 +1,83 @@
+"""Benchmark parsing of an events date column: the strptime chain against DateColumnParser.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_dates
+"""
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import DateColumnParser  # noqa: E402
+
+ROWS = 100000
+LEGACY_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d %B %Y', '%B %d, %Y']
+
+
+def legacy_parse_date_from_string(date_str):
+    """The previous implementation: try every strptime format until one does not raise"""
+    if not date_str or str(date_str).lower().strip() in ['', 'tbd', 'n/a', 'none']:
+        return None
+    date_str = str(date_str).strip()
+    for date_format in LEGACY_FORMATS:
+        try:
+            return datetime.strptime(date_str, date_format)
+        except ValueError:
+            continue
+    logging.debug(f"Could not parse date: {date_str}")
+    return None
+
+
+def messy_column(rows, distinct_days, seed=3):
+    """Mostly ISO dates with a long tail of other formats, blanks and junk, as typed by hand"""
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    styles = [
+        ('%Y-%m-%d', 60), ('%d/%m/%Y', 12), ('%d %B %Y', 8), ('%B %d, %Y', 6), ('%d-%m-%Y', 4),
+        ('%Y/%m/%d', 2), ('TBD', 4), ('', 2), ('Coming soon', 2),
+    ]
+    population = [style for style, weight in styles for _ in range(weight)]
+    column = []
+    for _ in range(rows):
+        day = start + timedelta(days=rng.randrange(distinct_days))
+        style = rng.choice(population)
+        column.append(day.strftime(style) if '%' in style else style)
+    return column
+
+
+def seconds(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    print(f"{'column':<32} {'legacy ms':>10} {'learned ms':>11} {'speedup':>8} {'failures':>9}")
+
+    for label, distinct_days in (('100k rows, 3 seasons of dates', 3 * 365), ('100k rows, all distinct days', ROWS)):
+        column = messy_column(ROWS, distinct_days)
+
+        legacy = [legacy_parse_date_from_string(value) for value in column]
+        parser = DateColumnParser.learn(column)
+        learned = [parser.parse(value) for value in column]
+        assert legacy == learned
+
+        legacy_ms = seconds(lambda: [legacy_parse_date_from_string(value) for value in column]) * 1000
+
+        def learn_and_parse():
+            column_parser = DateColumnParser.learn(column)
+            for value in column:
+                column_parser.parse(value)
+
+        learned_ms = seconds(learn_and_parse) * 1000
+        print(f"{label:<32} {legacy_ms:>10.1f} {learned_ms:>11.1f} {legacy_ms / learned_ms:>7.1f}x {parser.failures:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark per-row area and event type normalization: rebuilt alias dicts against the compiled resolvers.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_normalization
+"""
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import AliasResolver, AREA_RESOLVER, EVENT_TYPE_RESOLVER, load_alias_config  # noqa: E402
+
+ROWS = 100000
+AREA_VALUES = ['victoria_island', 'VI', 'Lekki', 'lekki phase 1', 'Ikeja', 'GRA', 'Ikoyi', 'Banana Island',
+               'Surulere', 'Yaba', 'Ajah', 'Island']
+EVENT_TYPE_VALUES = ['concert', 'Concert', 'live music', 'beach party', 'Beach', 'club', 'Club Night', 'party',
+                     'brunch', 'day party', 'detty_december', 'comedy']
+
+
+def legacy_normalize_area_value(area_value):
+    """The previous implementation, rebuilding its mapping on every call"""
+    if not area_value:
+        return None
+    area_str = str(area_value).lower().strip()
+    area_mappings = {
+        'victoria_island': ['vi', 'victoria island', 'island', 'vic island', 'victoria_island'],
+        'lekki': ['lekki', 'lekki phase 1', 'phase 1', 'admiralty', 'lekki_phase_1'],
+        'ikeja': ['ikeja', 'mainland', 'gra', 'ikeja_gra'],
+        'ikoyi': ['ikoyi', 'old ikoyi', 'banana island', 'banana_island'],
+        'surulere': ['surulere', 'suru', 'national theatre area', 'national_theatre']
+    }
+    for canonical, variations in area_mappings.items():
+        if area_str in variations or area_str == canonical:
+            return canonical
+    return area_str
+
+
+def legacy_normalize_event_type(event_type_value):
+    """The previous implementation, rebuilding its mapping on every call"""
+    if not event_type_value:
+        return None
+    event_str = str(event_type_value).lower().strip().replace(' ', '_')
+    event_mappings = {
+        'concert': ['concert', 'music_show', 'show', 'live_music'],
+        'beach_party': ['beach_party', 'beach', 'pool_party'],
+        'club_night': ['club_night', 'club', 'party', 'turn_up'],
+        'brunch': ['brunch', 'day_party'],
+        'detty_december': ['detty_december', 'december_fest']
+    }
+    for canonical, variations in event_mappings.items():
+        if event_str in variations:
+            return canonical
+    return event_str
+
+
+def ns_per_row(func, values):
+    started = time.perf_counter()
+    for value in values:
+        func(value)
+    return (time.perf_counter() - started) / len(values) * 1e9
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(7)
+    areas = [rng.choice(AREA_VALUES) for _ in range(ROWS)]
+    event_types = [rng.choice(EVENT_TYPE_VALUES) for _ in range(ROWS)]
+    # Every value distinct, so the memo never hits
+    unique_areas = [f"{value} {i}" for i, value in enumerate(areas)]
+
+    area_aliases, event_type_aliases = load_alias_config()
+    uncached_area = AliasResolver(area_aliases, lambda value: value.lower().strip())._resolve
+    uncached_event_type = AliasResolver(event_type_aliases, lambda value: value.lower().strip().replace(' ', '_'))._resolve
+
+    for value in AREA_VALUES:
+        assert legacy_normalize_area_value(value) == AREA_RESOLVER.resolve(value), value
+    for value in EVENT_TYPE_VALUES:
+        assert legacy_normalize_event_type(value) == EVENT_TYPE_RESOLVER.resolve(value), value
+
+    print(f"{'normalization':<14} {'legacy ns/row':>14} {'compiled ns/row':>16} {'memoized ns/row':>16}")
+    print(f"{'area':<14} {ns_per_row(legacy_normalize_area_value, areas):>14.0f} "
+          f"{ns_per_row(uncached_area, areas):>16.0f} {ns_per_row(AREA_RESOLVER.resolve, areas):>16.0f}")
+    print(f"{'event type':<14} {ns_per_row(legacy_normalize_event_type, event_types):>14.0f} "
+          f"{ns_per_row(uncached_event_type, event_types):>16.0f} {ns_per_row(EVENT_TYPE_RESOLVER.resolve, event_types):>16.0f}")
+    print(f"{'area, unique':<14} {ns_per_row(legacy_normalize_area_value, unique_areas):>14.0f} "
+          f"{ns_per_row(uncached_area, unique_areas):>16.0f} {ns_per_row(AREA_RESOLVER.resolve, unique_areas):>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
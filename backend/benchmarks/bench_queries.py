@@ -0,0 +1,246 @@
+"""Benchmark the data-store query paths and response formatting against synthetic sheets.
+
+The sheets have the columns of sheets_templates.json and the messy values people type
+into them (dates in several formats or "TBD", prices with commas, currency signs or
+"Call for price"). They are loaded through the normal batched fetch from a fake gspread
+client, so no network or credentials are needed. Each case reports ops/sec and the
+memory allocated at peak while answering one query; save the results as JSON and
+compare a later run against them. Run from the backend directory:
+
+    python -m benchmarks.bench_queries [--sizes 100 10000 100000] [--seconds 0.5]
+    python -m benchmarks.bench_queries --output before.json
+    python -m benchmarks.bench_queries --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Keep the store from loading a snapshot file left by a local run
+os.environ['SHEET_SNAPSHOT_PATH'] = ''
+
+from main import (  # noqa: E402
+    SHEET_CONFIG, DateRangeParser, GoogleSheetsDataStore,
+    format_accommodation_response, format_events_response, format_outfit_response,
+)
+
+SIZES = [100, 10000, 100000]
+AREAS = ['victoria_island', 'VI', 'Victoria Island', 'lekki', 'Lekki Phase 1', 'ikeja', 'GRA', 'ikoyi',
+         'Banana Island', 'surulere', 'yaba', '']
+EVENT_TYPES = ['concert', 'Concert', 'beach_party', 'beach party', 'club_night', 'party', 'brunch',
+               'day party', 'detty_december', 'comedy', '']
+ACCOMMODATION_TYPES = ['hotel', 'Hotel', 'shortlet', 'guesthouse', ' hotel ']
+GENDERS = ['male', 'female', 'unisex', 'Female', '']
+DATE_QUERIES = ['events this weekend', 'what is on next week', 'parties in december', 'december 20th',
+                'anything on 20/12', 'tomorrow night', 'show me events']
+EVENT_QUERIES = [
+    {},
+    {'area': 'lekki'},
+    {'query_text': 'events this weekend'},
+    {'event_type': 'concert', 'query_text': 'concerts in december'},
+]
+ACCOMMODATION_QUERIES = [
+    {},
+    {'area': 'lekki', 'max_budget': 50000},
+    {'accommodation_type': 'hotel', 'min_budget': 20000, 'max_budget': 80000},
+]
+OUTFIT_QUERIES = [('concert', 'female'), ('beach_party', None)]
+
+
+def messy_date(rng, day):
+    style = rng.choice(['%Y-%m-%d'] * 6 + ['%d/%m/%Y', '%d %B %Y', '%B %d, %Y', '%d-%m-%Y', '%Y/%m/%d',
+                                           ' %Y-%m-%d ', 'TBD', '', 'Coming soon'])
+    return day.strftime(style) if '%' in style else style
+
+
+def messy_price(rng):
+    price = rng.randint(8, 250) * 1000
+    return rng.choice([str(price), f"{price:,}", f"₦{price:,}", f"NGN {price}", f"{price:,}.00", 'Call for price', ''])
+
+
+def make_sheets(count, seed=24):
+    """Worksheet title -> values (headers first) with `count` rows each, starting from the template rows"""
+    with open(os.path.join(BACKEND_DIR, 'sheets_templates.json')) as templates_file:
+        worksheets = {worksheet['name']: worksheet
+                      for worksheet in json.load(templates_file)['events_sheet_template']['worksheets']}
+
+    rng = random.Random(seed)
+    # Around today, so "this weekend" and "next week" find events
+    first_day = date.today() - timedelta(days=60)
+    messy = {
+        'Date': lambda: messy_date(rng, first_day + timedelta(days=rng.randrange(420))),
+        'Area': lambda: rng.choice(AREAS),
+        'Event Type': lambda: rng.choice(EVENT_TYPES),
+        'Type': lambda: rng.choice(ACCOMMODATION_TYPES),
+        'Price Per Night': lambda: messy_price(rng),
+        'Rating': lambda: rng.choice([f"{rng.uniform(2.5, 5.0):.1f}", f"{rng.uniform(2.5, 5.0):.1f}/5", '']),
+        'Gender': lambda: rng.choice(GENDERS),
+    }
+
+    sheets = {}
+    for title, worksheet in worksheets.items():
+        headers = worksheet['headers']
+        rows = [headers]
+        for i in range(count):
+            row = list(rng.choice(worksheet['sample_data']))
+            for column, header in enumerate(headers):
+                if header in messy:
+                    row[column] = messy[header]()
+            # Names and titles stay unique, as the response formatting shows them
+            row[0] = f"{row[0]} #{i}"
+            rows.append(row)
+        sheets[title] = rows
+    return sheets
+
+
+class FakeSheetsClient:
+    """Stands in for gspread: one spreadsheet holding `sheets`, answered the way the Sheets API does"""
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def open_by_key(self, key):
+        return self
+
+    def fetch_sheet_metadata(self, params=None):
+        titles = {sheet_type: title for title in self.sheets for sheet_type in SHEET_CONFIG
+                  if title.lower() == sheet_type}
+        return {'sheets': [{'properties': {'sheetId': int(SHEET_CONFIG[sheet_type]['gid']), 'title': title}}
+                           for sheet_type, title in titles.items()]}
+
+    def values_batch_get(self, ranges, params=None):
+        # The API returns every cell as a string and drops trailing empty cells
+        value_ranges = []
+        for sheet_range in ranges:
+            rows = self.sheets[sheet_range.strip("'")]
+            values = []
+            for row in rows:
+                cells = [str(value) for value in row]
+                while cells and cells[-1] == '':
+                    cells.pop()
+                values.append(cells)
+            value_ranges.append({'values': values})
+        return {'valueRanges': value_ranges}
+
+
+def measure(func, min_seconds):
+    """Ops/sec over at least `min_seconds`, and the peak memory (KiB) allocated by one call"""
+    func()
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            break
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ops_per_sec': calls / elapsed, 'us_per_op': elapsed / calls * 1e6, 'peak_alloc_kib': (peak - before) / 1024}
+
+
+def uncached_parse(query_text):
+    DateRangeParser._parse_normalized.cache_clear()
+    return DateRangeParser.parse_date_query(query_text)
+
+
+def store_cases(store):
+    for filters in EVENT_QUERIES:
+        yield f"get_events {json.dumps(filters)}", lambda filters=filters: store.get_events(dict(filters))
+    for filters in ACCOMMODATION_QUERIES:
+        yield f"get_accommodations {json.dumps(filters)}", lambda filters=filters: store.get_accommodations(dict(filters))
+    for event_type, gender in OUTFIT_QUERIES:
+        yield (f"get_outfit_suggestions {event_type} {gender}",
+               lambda event_type=event_type, gender=gender: store.get_outfit_suggestions(event_type, gender))
+
+
+def fixed_cases(store):
+    """Cases whose cost does not depend on the sheet size: date parsing, and formatting 5 results"""
+    for query_text in DATE_QUERIES:
+        yield f"parse_date_query {query_text!r}", lambda query_text=query_text: DateRangeParser.parse_date_query(query_text)
+        yield f"parse_date_query uncached {query_text!r}", lambda query_text=query_text: uncached_parse(query_text)
+
+    events_filters = {'area': 'lekki'}
+    events = store.get_events(dict(events_filters))
+    yield 'format_events_response', lambda: format_events_response(events, events_filters)
+    accommodations_filters = {'area': 'lekki', 'max_budget': 50000}
+    accommodations = store.get_accommodations(dict(accommodations_filters))
+    yield 'format_accommodation_response', lambda: format_accommodation_response(accommodations, accommodations_filters)
+    outfits = store.get_outfit_suggestions('concert', 'female')
+    yield 'format_outfit_response', lambda: format_outfit_response(outfits, 'concert')
+
+
+def run(sizes, min_seconds):
+    results = {}
+    print(f"{'rows':>7} {'case':<96} {'ops/sec':>11} {'us/op':>10} {'peak KiB':>9}")
+    for size in sizes:
+        store = GoogleSheetsDataStore(client=FakeSheetsClient(make_sheets(size)), snapshot_path=None)
+        started = time.perf_counter()
+        store.refresh_all()
+        load_us = (time.perf_counter() - started) * 1e6
+        results[f"load @{size}"] = {'rows': size, 'ops_per_sec': 1e6 / load_us, 'us_per_op': load_us, 'peak_alloc_kib': None}
+        print(f"{size:>7} {'load: fetch, records and indexes':<96} {'':>11} {load_us:>10.0f}")
+
+        cases = list(store_cases(store))
+        if size == sizes[0]:
+            cases += [(name, func) for name, func in fixed_cases(store)]
+        for name, func in cases:
+            result = measure(func, min_seconds)
+            rows = size if name.startswith('get_') else None
+            results[f"{name} @{rows}" if rows else name] = dict(result, rows=rows)
+            print(f"{rows or '':>7} {name:<96} {result['ops_per_sec']:>11.0f} {result['us_per_op']:>10.1f} "
+                  f"{result['peak_alloc_kib']:>9.1f}")
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    print(f"\nAgainst {baseline_path} (ops/sec change; below -10% is flagged)")
+    for case, result in results.items():
+        before = baseline.get(case)
+        if not before:
+            print(f"  {case:<104} new")
+            continue
+        change = result['ops_per_sec'] / before['ops_per_sec'] - 1
+        print(f"  {case:<104} {change:>+8.1%}{'  slower' if change < -0.1 else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--seconds', type=float, default=0.5, help='minimum timing per case')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run(args.sizes, args.seconds)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'run': {'time': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                        'machine': platform.machine(), 'cpus': os.cpu_count(), 'sizes': args.sizes},
+                'results': results,
+            }, output_file, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark webhook throughput: the Werkzeug dev server (`python main.py`) against gunicorn.
+
+Both servers answer from the same synthetic snapshot file, so no Google credentials
+are needed. Run from the backend directory:
+
+    python -m benchmarks.bench_serving [--seconds 10] [--clients 32]
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Keep this process from loading or refreshing a snapshot of its own
+os.environ['SHEET_SNAPSHOT_PATH'] = ''
+
+from main import GoogleSheetsDataStore  # noqa: E402
+
+ROW_MULTIPLIER = 200
+REQUESTS = [
+    {'intentInfo': {'displayName': 'events.inquiry'}, 'sessionInfo': {'parameters': {'area': 'lekki'}},
+     'text': 'events this week in lekki'},
+    {'intentInfo': {'displayName': 'events.inquiry'}, 'sessionInfo': {'parameters': {}},
+     'text': 'what is happening in december'},
+    {'intentInfo': {'displayName': 'accommodation.inquiry'},
+     'sessionInfo': {'parameters': {'area': 'victoria_island', 'max_budget': 60000}}, 'text': 'hotels in VI'},
+    {'intentInfo': {'displayName': 'outfit.inquiry'},
+     'sessionInfo': {'parameters': {'event_type': 'concert', 'gender': 'female'}}, 'text': 'concert outfits'},
+]
+SERVERS = [
+    ('dev server (python main.py)', [sys.executable, 'main.py'], 5000),
+    ('gunicorn (gunicorn.conf.py)', [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'main:app'], 5001),
+]
+
+
+def build_snapshot(path, seed=11):
+    """Write a snapshot file with the template rows repeated ROW_MULTIPLIER times"""
+    with open(os.path.join(BACKEND_DIR, 'sheets_templates.json')) as templates_file:
+        worksheets = json.load(templates_file)['events_sheet_template']['worksheets']
+
+    rng = random.Random(seed)
+    sheets = {}
+    for worksheet in worksheets:
+        values = [worksheet['headers']] + worksheet['sample_data'] * ROW_MULTIPLIER
+        rows = GoogleSheetsDataStore._rows_to_records(values)
+        rng.shuffle(rows)
+        sheets[worksheet['name'].lower()] = rows
+
+    store = GoogleSheetsDataStore(client=object(), snapshot_path=None)
+    store._store_snapshots(sheets)
+    store.save_snapshot_file(path)
+
+
+def wait_until_ready(port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health/ready", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def client_worker(port, seconds, threads):
+    """Send webhook requests from `threads` threads for `seconds`, returning the latencies"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(offset):
+        session = requests.Session()
+        latencies = []
+        deadline = time.perf_counter() + seconds
+        i = offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = session.post(f"http://127.0.0.1:{port}/webhook", json=REQUESTS[i % len(REQUESTS)], timeout=30)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            i += 1
+        return latencies
+
+    with ThreadPoolExecutor(threads) as pool:
+        return [latency for latencies in pool.map(run, range(threads)) for latency in latencies]
+
+
+def measure(port, seconds, clients):
+    processes = max(1, min(os.cpu_count() or 1, clients // 8))
+    per_process = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    with ProcessPoolExecutor(processes) as pool:
+        results = pool.map(client_worker, [port] * processes, [seconds] * processes, per_process)
+        latencies = sorted(latency for result in results for latency in result)
+    if not latencies:
+        return 0.0, None, None
+    return (len(latencies) / seconds,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000)
+
+
+def port_is_free(port):
+    with socket.socket() as probe:
+        return probe.connect_ex(('127.0.0.1', port)) != 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_path = os.path.join(temp_dir, 'sheets_snapshot.bin')
+        build_snapshot(snapshot_path)
+        env = dict(os.environ, SHEET_SNAPSHOT_PATH=snapshot_path, STARTUP_WARMUP='false')
+
+        print(f"{args.clients} concurrent clients, {args.seconds}s per server, {os.cpu_count()} CPUs")
+        print(f"{'server':<30} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+        for name, command, port in SERVERS:
+            if not port_is_free(port):
+                print(f"{name:<30} skipped, port {port} is in use")
+                continue
+
+            server = subprocess.Popen(command, cwd=BACKEND_DIR, env=dict(env, PORT=str(port)),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                      start_new_session=True)
+            try:
+                if not wait_until_ready(port):
+                    print(f"{name:<30} did not become ready")
+                    continue
+                throughput, p50, p99 = measure(port, args.seconds, args.clients)
+                print(f"{name:<30} {throughput:>10.0f} {p50 or 0:>10.1f} {p99 or 0:>10.1f}")
+            finally:
+                # The dev server's reloader runs the app in a child process, so stop the whole group
+                os.killpg(server.pid, signal.SIGTERM)
+                server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
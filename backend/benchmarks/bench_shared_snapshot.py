@@ -0,0 +1,188 @@
+"""Benchmark per-worker memory and Sheets refresh traffic with and without the shared mapped snapshot.
+
+Each scenario loads the sheets in a parent process and forks workers the way gunicorn's
+preload does. Workers run a query mix, a scan of every row and a full garbage
+collection, then report their unique (private) memory: every page a worker writes to,
+if only to bump a reference count, stops being shared. The mapped snapshot shares only
+the cell values and parsed columns; records and indexes are Python objects in every
+worker, so its per-worker memory still grows with the row count. Linux only, as it
+reads /proc/self/smaps_rollup. Run from the backend directory:
+
+    python -m benchmarks.bench_shared_snapshot
+"""
+import gc
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as service  # noqa: E402
+from benchmarks.bench_accommodations import make_rows as make_accommodation_rows  # noqa: E402
+from main import SHEET_CONFIG, GoogleSheetsDataStore  # noqa: E402
+
+SIZES = [10000, 50000, 200000]
+WORKERS = 4
+AREAS = ['victoria_island', 'VI', 'lekki', 'Lekki Phase 1', 'ikeja', 'ikoyi', 'surulere', 'yaba']
+EVENT_TYPES = ['concert', 'beach party', 'club_night', 'brunch', 'comedy', 'art exhibition']
+
+
+def make_sheets(count, seed=7):
+    rng = random.Random(seed)
+    start = date(2025, 1, 1)
+    events = [{
+        'title': f"Event {i}",
+        'description': f"Synthetic event number {i} with a typical length description",
+        'date': (start + timedelta(days=rng.randrange(730))).isoformat(),
+        'time': '20:00',
+        'location': f"Venue {rng.randrange(500)}",
+        'area': rng.choice(AREAS),
+        'event_type': rng.choice(EVENT_TYPES),
+        'vibe': 'Lively',
+        'ticket_link': f"https://tickets.example.com/{i}",
+        'image_url': f"https://images.example.com/{i}.jpg",
+    } for i in range(count)]
+    outfits = [{
+        'event_type': rng.choice(EVENT_TYPES),
+        'gender': rng.choice(['male', 'female', 'unisex']),
+        'style_name': f"Look {i}",
+        'description': 'Linen shirt, chinos and loafers',
+        'items': 'Shirt, Chinos, Loafers',
+        'vibe': 'Relaxed',
+        'image_url': f"https://images.example.com/look-{i}.jpg",
+        'shop_links': 'https://shop.example.com',
+    } for i in range(max(100, count // 100))]
+    return {'events': events, 'accommodations': make_accommodation_rows(count), 'outfits': outfits}
+
+
+def unique_memory_kb():
+    """Private (unshared) resident memory of this process"""
+    private = 0
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                private += int(line.split()[1])
+    return private
+
+
+def run_queries(store):
+    store.get_events()
+    store.get_events({'area': 'lekki', 'query_text': 'events in december'})
+    store.get_accommodations({'area': 'ikoyi', 'max_budget': 50000})
+    store.get_outfit_suggestions('concert', 'female')
+    # Scans every row, like the debug endpoints do
+    for sheet_type in SHEET_CONFIG:
+        sum(1 for row in store._get_sheet_data(sheet_type) if row.get('area') == 'lekki')
+    gc.collect()
+
+
+def forked_workers_memory(store):
+    """Average unique memory of WORKERS children forked after `store` was loaded"""
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    # As preload_for_workers does before gunicorn forks
+    gc.freeze()
+    pids = []
+    for _ in range(WORKERS):
+        pid = os.fork()
+        if pid == 0:
+            run_queries(store)
+            writer.send(unique_memory_kb())
+            os._exit(0)
+        pids.append(pid)
+    results = [reader.recv() for _ in pids]
+    for pid in pids:
+        os.waitpid(pid, 0)
+    gc.unfreeze()
+    return sum(results) / len(results) / 1024
+
+
+class CountingClient:
+    """Stands in for gspread, counting the batched value fetches across processes"""
+
+    def __init__(self, sheets, counter):
+        self.sheets = sheets
+        self.counter = counter
+
+    def open_by_key(self, key):
+        return self
+
+    def fetch_sheet_metadata(self, params=None):
+        return {'sheets': [{'properties': {'sheetId': int(SHEET_CONFIG[sheet_type]['gid']), 'title': sheet_type}}
+                           for sheet_type in SHEET_CONFIG]}
+
+    def values_batch_get(self, ranges, params=None):
+        with self.counter.get_lock():
+            self.counter.value += 1
+        value_ranges = []
+        for sheet_range in ranges:
+            rows = self.sheets[sheet_range.strip("'")]
+            keys = list(rows[0])
+            value_ranges.append({'values': [keys] + [[row[key] for key in keys] for row in rows]})
+        return {'valueRanges': value_ranges}
+
+
+def refresh_worker(sheets, counter, snapshot_path, seconds):
+    store = GoogleSheetsDataStore(cache_ttl=0.5, client=CountingClient(sheets, counter), snapshot_path=snapshot_path)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        store.get_events({'area': 'lekki'})
+        time.sleep(0.01)
+
+
+def refresh_fetches(sheets, snapshot_path, seconds=4):
+    """Sheets fetches made by WORKERS processes polling with a 0.5s TTL for `seconds`"""
+    counter = multiprocessing.Value('i', 0)
+    processes = [multiprocessing.Process(target=refresh_worker, args=(sheets, counter, snapshot_path, seconds))
+                 for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return counter.value
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    service.SHARED_SNAPSHOT_POLL_SECONDS = 0.2
+
+    print(f"Unique memory per worker after queries and gc, {WORKERS} forked workers")
+    print("(mapped: cell values and parsed columns shared, records and indexes still per worker)")
+    print(f"{'rows':>8} {'dict snapshot MB':>18} {'mapped snapshot MB':>20}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in SIZES:
+            sheets = make_sheets(size)
+
+            store = GoogleSheetsDataStore(client=object(), snapshot_path=None)
+            store._store_snapshots(sheets)
+            dict_mb = forked_workers_memory(store)
+
+            path = os.path.join(temp_dir, f"snapshot-{size}.bin")
+            store.save_snapshot_file(path)
+            del store
+            gc.collect()
+            mapped = GoogleSheetsDataStore(client=object(), snapshot_path=None)
+            mapped._store_mapped_snapshots(service.read_snapshot_file(path))
+            mapped_mb = forked_workers_memory(mapped)
+            del mapped
+            gc.collect()
+
+            print(f"{size:>8} {dict_mb:>18.1f} {mapped_mb:>20.1f}")
+
+        sheets = make_sheets(2000)
+        print(f"\nSheets fetches by {WORKERS} processes over 4s with a 0.5s TTL")
+        print(f"  per-process snapshots: {refresh_fetches(sheets, None)}")
+        # As after a gunicorn preload, the workers start from a snapshot file the master wrote
+        shared_path = os.path.join(temp_dir, 'shared.bin')
+        store = GoogleSheetsDataStore(client=object(), snapshot_path=None)
+        store._store_snapshots(sheets)
+        store.save_snapshot_file(shared_path)
+        print(f"  shared snapshot file:  {refresh_fetches(sheets, shared_path)}")
+
+
+if __name__ == '__main__':
+    main()
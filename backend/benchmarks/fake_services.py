@@ -0,0 +1,245 @@
+"""Local stand-ins for Dialogflow CX detect_intent and the Graph API messages endpoint, for load tests.
+
+Both answer after an injected latency and fail an injected share of calls, so the
+service can be pushed hard without touching Google or Meta. Run from the backend
+directory:
+
+    python -m benchmarks.fake_services [--dialogflow-latency-ms 150] [--graph-error-rate 0.02]
+        [--webhook-url http://127.0.0.1:5000/webhook]
+
+and start the app with DIALOGFLOW_EMULATOR_HOST=127.0.0.1:9001 and
+GRAPH_API_BASE_URL=http://127.0.0.1:9002/v20.0. With --webhook-url the fake agent
+fulfills events, stays, outfits and trip plans by calling the app's /webhook, as the
+real agent does. GET /_stats on the Graph port returns call counts and the time each
+recipient was last sent a message; add ?clear=1 to start over.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import grpc
+import requests
+from google.cloud.dialogflowcx_v3beta1 import types as dialogflow
+
+SESSIONS_SERVICE = 'google.cloud.dialogflow.cx.v3beta1.Sessions'
+AREAS = {'lekki': 'lekki', 'vi': 'victoria_island', 'victoria island': 'victoria_island', 'ikoyi': 'ikoyi',
+         'ikeja': 'ikeja', 'yaba': 'yaba', 'surulere': 'surulere'}
+EVENT_TYPES = ['concert', 'beach party', 'club', 'brunch', 'comedy', 'party']
+# First match wins, in this order; the agent's intents whose fulfillment is the /webhook
+INTENTS = [
+    ('trip.planning', ('trip', 'plan my', 'itinerary')),
+    ('outfit.inquiry', ('outfit', 'wear', 'look')),
+    ('accommodation.inquiry', ('hotel', 'stay', 'shortlet', 'accommodation', 'airbnb')),
+    ('events.inquiry', ('event', 'happening', 'party', 'concert', 'going on', 'this weekend')),
+]
+WELCOME = "Hey! 👋 I can find events, places to stay and outfits in Lagos. What are you looking for?"
+
+
+class Faults:
+    """Latency and errors to inject: `latency_ms` on average (between half and one and a half times
+    it), and a random `error_rate` share of calls failing"""
+
+    def __init__(self, latency_ms, error_rate):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.counts = {'dialogflow_calls': 0, 'dialogflow_errors': 0, 'webhook_errors': 0,
+                           'graph_calls': 0, 'graph_errors': 0}
+            # recipient -> wall clock time a message to them was accepted
+            self.deliveries = {}
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def delivered(self, recipient):
+        with self._lock:
+            self.counts['graph_calls'] += 1
+            self.deliveries[recipient] = time.time()
+
+    def snapshot(self, clear=False):
+        with self._lock:
+            result = {'counts': dict(self.counts), 'deliveries': dict(self.deliveries)}
+        if clear:
+            self.clear()
+        return result
+
+
+def match_intent(text):
+    """Display name and parameters the fake agent extracts from a message"""
+    lowered = text.lower()
+    parameters = {}
+    area = next((area for name, area in AREAS.items() if re.search(rf"\b{name}\b", lowered)), None)
+    if area:
+        parameters['area'] = area
+    event_type = next((event_type for event_type in EVENT_TYPES if event_type in lowered), None)
+    if event_type:
+        parameters['event_type'] = event_type
+    for intent, keywords in INTENTS:
+        if any(keyword in lowered for keyword in keywords):
+            return intent, parameters
+    return 'Default Welcome Intent', parameters
+
+
+class FakeDialogflow:
+    """Sessions.DetectIntent over plain gRPC, fulfilled by the app's /webhook when `webhook_url` is set"""
+
+    def __init__(self, faults, stats, webhook_url=None):
+        self.faults = faults
+        self.stats = stats
+        self.webhook_url = webhook_url
+        self._local = threading.local()
+
+    def _fulfill(self, intent, parameters, text, session):
+        if not self.webhook_url or intent == 'Default Welcome Intent':
+            return WELCOME
+        http = getattr(self._local, 'http', None) or requests.Session()
+        self._local.http = http
+        try:
+            response = http.post(self.webhook_url, timeout=30, json={
+                'intentInfo': {'displayName': intent},
+                'sessionInfo': {'session': session, 'parameters': parameters},
+                'text': text,
+            })
+            response.raise_for_status()
+            messages = response.json()['fulfillmentResponse']['messages']
+            return ' '.join(part for message in messages for part in message['text']['text'])
+        except (requests.RequestException, KeyError, ValueError):
+            self.stats.count('webhook_errors')
+            return "Sorry, something went wrong on our side."
+
+    def detect_intent(self, request, context):
+        self.stats.count('dialogflow_calls')
+        self.faults.delay()
+        if self.faults.fails():
+            self.stats.count('dialogflow_errors')
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'Injected failure')
+
+        text = request.query_input.text.text
+        intent, parameters = match_intent(text)
+        reply = self._fulfill(intent, parameters, text, request.session)
+        return dialogflow.DetectIntentResponse(
+            response_id=str(uuid.uuid4()),
+            query_result=dialogflow.QueryResult(
+                text=text,
+                language_code=request.query_input.language_code,
+                parameters=parameters,
+                match=dialogflow.Match(intent=dialogflow.Intent(display_name=intent), confidence=0.9),
+                response_messages=[dialogflow.ResponseMessage(text=dialogflow.ResponseMessage.Text(text=[reply]))],
+            ),
+        )
+
+    def serve(self, port, threads):
+        server = grpc.server(ThreadPoolExecutor(max_workers=threads))
+        server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(SESSIONS_SERVICE, {
+            'DetectIntent': grpc.unary_unary_rpc_method_handler(
+                self.detect_intent,
+                request_deserializer=dialogflow.DetectIntentRequest.deserialize,
+                response_serializer=dialogflow.DetectIntentResponse.serialize,
+            ),
+        })])
+        server.add_insecure_port(f"127.0.0.1:{port}")
+        server.start()
+        return server
+
+
+def graph_handler(faults, stats):
+    class GraphHandler(BaseHTTPRequestHandler):
+        """POST /<version>/<phone number id>/messages as the Cloud API answers it, and GET /_stats"""
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=()):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/_stats':
+                return self._send_json(404, {'error': {'message': 'Unknown path'}})
+            self._send_json(200, stats.snapshot(clear=bool(parse_qs(url.query).get('clear'))))
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            if not self.path.rstrip('/').endswith('/messages'):
+                return self._send_json(404, {'error': {'message': 'Unknown path'}})
+            faults.delay()
+            if faults.fails():
+                stats.count('graph_errors')
+                if random.random() < 0.5:
+                    return self._send_json(429, {'error': {'message': 'Injected rate limit', 'code': 130429}},
+                                           headers=[('Retry-After', '1')])
+                return self._send_json(500, {'error': {'message': 'Injected failure', 'code': 2, 'is_transient': True}})
+            recipient = payload.get('to', '')
+            # Keyed like the wa_id the message came from, which has no leading +
+            stats.delivered(recipient.lstrip('+'))
+            self._send_json(200, {
+                'messaging_product': 'whatsapp',
+                'contacts': [{'input': recipient, 'wa_id': recipient}],
+                'messages': [{'id': f"wamid.{uuid.uuid4().hex}"}],
+            })
+
+    return GraphHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dialogflow-port', type=int, default=9001)
+    parser.add_argument('--graph-port', type=int, default=9002)
+    parser.add_argument('--dialogflow-latency-ms', type=float, default=150)
+    parser.add_argument('--dialogflow-error-rate', type=float, default=0.0)
+    parser.add_argument('--graph-latency-ms', type=float, default=120)
+    parser.add_argument('--graph-error-rate', type=float, default=0.0)
+    parser.add_argument('--webhook-url', help="the app's /webhook, to fulfill intents like the real agent")
+    parser.add_argument('--threads', type=int, default=256, help='Dialogflow calls served at once')
+    args = parser.parse_args()
+
+    stats = Stats()
+    agent = FakeDialogflow(Faults(args.dialogflow_latency_ms, args.dialogflow_error_rate), stats, args.webhook_url)
+    grpc_server = agent.serve(args.dialogflow_port, args.threads)
+    graph_server = ThreadingHTTPServer(('127.0.0.1', args.graph_port),
+                                       graph_handler(Faults(args.graph_latency_ms, args.graph_error_rate), stats))
+    graph_server.daemon_threads = True
+    print(f"Dialogflow CX on 127.0.0.1:{args.dialogflow_port}, Graph API on http://127.0.0.1:{args.graph_port}/v20.0",
+          flush=True)
+    try:
+        graph_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        graph_server.server_close()
+        grpc_server.stop(grace=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""Load test the whole service: /webhook, /chat and /whatsapp/webhook traffic against fake Dialogflow and Graph APIs.
+
+Starts benchmarks/fake_services.py and the app (gunicorn, gunicorn with the ASGI worker,
+or the dev server) on a synthetic sheet snapshot, then replays a traffic mix at each
+concurrency in turn. It reports throughput, errors and p50/p95/p99 per endpoint, plus
+the time from a WhatsApp webhook call to the reply reaching the fake Graph API, so the
+concurrency where the service falls over shows up here first. Run from the backend
+directory:
+
+    python -m benchmarks.load_test [--concurrency 8 32 128] [--seconds 20] [--server asgi]
+        [--mix webhook=5,chat=3,whatsapp=2] [--dialogflow-latency-ms 150] [--dialogflow-error-rate 0.01]
+        [--graph-latency-ms 120] [--graph-error-rate 0.01] [--server-env WHATSAPP_WORKERS=8] [--output load.json]
+
+WhatsApp replies are paced by WHATSAPP_SEND_RATE like in production; raise it with
+--server-env to load the rest of the path.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+from benchmarks.bench_serving import BACKEND_DIR, REQUESTS as WEBHOOK_REQUESTS, build_snapshot, port_is_free, wait_until_ready
+
+SERVERS = {
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'main:app'],
+    'asgi': [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             '--worker-class', 'uvicorn.workers.UvicornWorker', 'asgi:app'],
+    'dev': [sys.executable, 'main.py'],
+}
+WEBHOOK_MIX = WEBHOOK_REQUESTS + [
+    {'intentInfo': {'displayName': 'trip.planning'}, 'sessionInfo': {'parameters': {'area': 'lekki'}},
+     'text': 'plan my trip to lekki this weekend'},
+]
+# Welcome chips (answered by the app itself) and free text (sent to Dialogflow)
+CHAT_MESSAGES = [
+    '🔥 Events this week', '🏠 Hotels in Lekki', '👗 Concert outfits',
+    "what's happening in lekki this weekend", 'any hotels in ikoyi under 50k', 'what should I wear to a beach party',
+    'plan my trip for december', 'hi there',
+]
+WHATSAPP_MESSAGES = ['hi', 'events this weekend', 'hotels in VI', 'concert outfits for women', 'plan my trip']
+PHONE_NUMBER_ID = '100000000000000'
+
+
+def whatsapp_payload(recipient, text):
+    """A Cloud API webhook call carrying one text message from `recipient`"""
+    return {
+        'object': 'whatsapp_business_account',
+        'entry': [{'id': '1', 'changes': [{'field': 'messages', 'value': {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': '2348000000000', 'phone_number_id': PHONE_NUMBER_ID},
+            'contacts': [{'profile': {'name': 'Load Test'}, 'wa_id': recipient}],
+            'messages': [{'from': recipient, 'id': f"wamid.{uuid.uuid4().hex}", 'timestamp': str(int(time.time())),
+                          'type': 'text', 'text': {'body': text}}],
+        }}]}],
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('webhook', 'chat', 'whatsapp'):
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def client_worker(base_url, seconds, threads, mix, worker_id):
+    """Send the traffic mix from `threads` threads for `seconds`.
+
+    Returns endpoint -> [(latency, ok)], and recipient -> wall clock send time of the
+    WhatsApp messages that were accepted.
+    """
+    endpoints, weights = zip(*mix.items())
+
+    def run(thread_id):
+        rng = random.Random(f"{worker_id}-{thread_id}")
+        session = requests.Session()
+        results = {endpoint: [] for endpoint in endpoints}
+        sent = {}
+        recipients = (f"234{worker_id:03d}{thread_id:03d}{sequence:06d}" for sequence in itertools.count())
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            if endpoint == 'webhook':
+                path, payload = '/webhook', rng.choice(WEBHOOK_MIX)
+            elif endpoint == 'chat':
+                path, payload = '/chat', {'message': rng.choice(CHAT_MESSAGES), 'session_id': f"load-{worker_id}-{thread_id}"}
+            else:
+                recipient = next(recipients)
+                path, payload = '/whatsapp/webhook', whatsapp_payload(recipient, rng.choice(WHATSAPP_MESSAGES))
+            sent_at = time.time()
+            started = time.perf_counter()
+            try:
+                response = session.post(base_url + path, json=payload, timeout=60)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            results[endpoint].append((time.perf_counter() - started, ok))
+            if endpoint == 'whatsapp' and ok:
+                sent[recipient] = sent_at
+        return results, sent
+
+    merged, sent = {endpoint: [] for endpoint in endpoints}, {}
+    with ThreadPoolExecutor(threads) as pool:
+        for results, thread_sent in pool.map(run, range(threads)):
+            for endpoint, samples in results.items():
+                merged[endpoint].extend(samples)
+            sent.update(thread_sent)
+    return merged, sent
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    ordered = sorted(latencies)
+    pick = lambda share: round(ordered[min(len(ordered) - 1, int(len(ordered) * share))] * 1000, 1)  # noqa: E731
+    return {'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+def run_step(base_url, graph_url, concurrency, seconds, mix, drain_seconds):
+    requests.get(f"{graph_url}/_stats?clear=1", timeout=5)
+    processes = max(1, min(os.cpu_count() or 1, concurrency // 8))
+    per_process = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    with ProcessPoolExecutor(processes) as pool:
+        outcomes = list(pool.map(client_worker, [base_url] * processes, [seconds] * processes, per_process,
+                                 [mix] * processes, range(processes)))
+
+    step = {}
+    for endpoint in mix:
+        samples = [sample for results, _ in outcomes for sample in results[endpoint]]
+        ok = [latency for latency, success in samples if success]
+        step[endpoint] = dict(requests=len(samples), rps=round(len(ok) / seconds, 1),
+                              errors=len(samples) - len(ok), **percentiles(ok))
+
+    sent = {recipient: sent_at for _, thread_sent in outcomes for recipient, sent_at in thread_sent.items()}
+    if sent:
+        # Replies still queued in the app are given a while to go out
+        deadline = time.monotonic() + drain_seconds
+        while True:
+            stats = requests.get(f"{graph_url}/_stats", timeout=5).json()
+            if len(sent.keys() & stats['deliveries'].keys()) == len(sent) or time.monotonic() >= deadline:
+                break
+            time.sleep(0.5)
+        replies = [stats['deliveries'][recipient] - sent_at
+                   for recipient, sent_at in sent.items() if recipient in stats['deliveries']]
+        step['whatsapp reply'] = dict(requests=len(sent), rps=round(len(replies) / seconds, 1),
+                                      errors=len(sent) - len(replies), **percentiles(replies))
+    return step
+
+
+def print_step(concurrency, step):
+    for endpoint, result in step.items():
+        error_share = result['errors'] / result['requests'] if result['requests'] else 0
+        p50, p95, p99 = (f"{result[key]:.1f}" if result[key] is not None else '-' for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f"{concurrency:>6} {endpoint:<16} {result['rps']:>9.1f} {error_share:>7.1%} {p50:>9} {p95:>9} {p99:>9}",
+              flush=True)
+
+
+def wait_for_fakes(graph_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{graph_url}/_stats", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def start(command, env, log_path):
+    with open(log_path, 'w') as log:
+        return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+
+
+def stop(process):
+    # The dev server's reloader and gunicorn's workers are children, so stop the whole group
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128], help='clients, one step each')
+    parser.add_argument('--seconds', type=int, default=20, help='per step')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('webhook=5,chat=3,whatsapp=2'))
+    parser.add_argument('--server', choices=sorted(SERVERS), default='gunicorn')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--dialogflow-port', type=int, default=9001)
+    parser.add_argument('--graph-port', type=int, default=9002)
+    parser.add_argument('--dialogflow-latency-ms', type=float, default=150)
+    parser.add_argument('--dialogflow-error-rate', type=float, default=0.0)
+    parser.add_argument('--graph-latency-ms', type=float, default=120)
+    parser.add_argument('--graph-error-rate', type=float, default=0.0)
+    parser.add_argument('--drain-seconds', type=float, default=30, help='wait for queued WhatsApp replies after a step')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE', help='extra app setting')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    for port in (args.port, args.dialogflow_port, args.graph_port):
+        if not port_is_free(port):
+            sys.exit(f"Port {port} is in use")
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    graph_url = f"http://127.0.0.1:{args.graph_port}"
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_path = os.path.join(temp_dir, 'sheets_snapshot.bin')
+        build_snapshot(snapshot_path)
+
+        fakes = start([
+            sys.executable, '-m', 'benchmarks.fake_services', '--webhook-url', f"{base_url}/webhook",
+            '--dialogflow-port', str(args.dialogflow_port), '--graph-port', str(args.graph_port),
+            '--dialogflow-latency-ms', str(args.dialogflow_latency_ms),
+            '--dialogflow-error-rate', str(args.dialogflow_error_rate),
+            '--graph-latency-ms', str(args.graph_latency_ms), '--graph-error-rate', str(args.graph_error_rate),
+        ], dict(os.environ), os.path.join(temp_dir, 'fake_services.log'))
+        if not wait_for_fakes(graph_url):
+            stop(fakes)
+            with open(os.path.join(temp_dir, 'fake_services.log')) as log:
+                sys.exit(f"The fake Dialogflow and Graph APIs did not start:\n{log.read()[-3000:]}")
+        env = dict(
+            os.environ, PORT=str(args.port), SHEET_SNAPSHOT_PATH=snapshot_path, STARTUP_WARMUP='false',
+            DIALOGFLOW_EMULATOR_HOST=f"127.0.0.1:{args.dialogflow_port}", GRAPH_API_BASE_URL=f"{graph_url}/v20.0",
+            WHATSAPP_DEDUPE_DB='', PROFILE_SAMPLE_EVERY='0',
+            **dict(setting.split('=', 1) for setting in args.server_env),
+        )
+        server_log = os.path.join(temp_dir, 'server.log')
+        server = start(SERVERS[args.server], env, server_log)
+        try:
+            if not wait_until_ready(args.port):
+                with open(server_log) as log:
+                    sys.exit(f"The {args.server} server did not become ready:\n{log.read()[-3000:]}")
+
+            print(f"{args.server} server, mix {args.mix}, {args.seconds}s per step, {os.cpu_count()} CPUs")
+            print(f"Dialogflow {args.dialogflow_latency_ms:g} ms / {args.dialogflow_error_rate:.1%} errors, "
+                  f"Graph API {args.graph_latency_ms:g} ms / {args.graph_error_rate:.1%} errors")
+            print(f"{'conc':>6} {'endpoint':<16} {'ok req/s':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+            steps = {}
+            for concurrency in args.concurrency:
+                steps[concurrency] = run_step(base_url, graph_url, concurrency, args.seconds, args.mix, args.drain_seconds)
+                print_step(concurrency, steps[concurrency])
+        finally:
+            stop(server)
+            stop(fakes)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'args': {key: value for key, value in vars(args).items() if key != 'output'}, 'steps': steps},
+                      output_file, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
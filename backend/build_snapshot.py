@@ -0,0 +1,40 @@
+"""Build the local sheet snapshot offline.
+
+Loads every configured spreadsheet from Google Sheets and writes the snapshot
+file the service reads at startup, so it can be baked into the container image:
+
+    python build_snapshot.py [--output PATH]
+"""
+import argparse
+import sys
+
+from main import SHEET_SNAPSHOT_PATH, GoogleSheetsDataStore, logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local Google Sheets snapshot file")
+    parser.add_argument('--output', default=SHEET_SNAPSHOT_PATH,
+                        help=f"where to write the snapshot (default: {SHEET_SNAPSHOT_PATH})")
+    args = parser.parse_args()
+
+    # Never start from an older snapshot: everything written here comes straight from Sheets
+    store = GoogleSheetsDataStore(snapshot_path=None)
+    # The client is created on first use, so create it now to find out whether the credentials work
+    if not store._ensure_client():
+        logger.error("Google Sheets client is not available, snapshot not built")
+        return 1
+
+    if not store.refresh_all():
+        logger.error("Failed to load every spreadsheet, snapshot not built")
+        return 1
+
+    if not store.save_snapshot_file(args.output):
+        return 1
+
+    for sheet_type, snapshot in store._snapshots.items():
+        logger.info("%s: %s rows", sheet_type, len(snapshot.rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Gunicorn configuration for serving the backend in production.
+
+    gunicorn --config gunicorn.conf.py main:app
+
+or, to wait on Dialogflow from an event loop instead of a thread per /chat call:
+
+    gunicorn --config gunicorn.conf.py --worker-class uvicorn.workers.UvicornWorker asgi:app
+
+The app is preloaded in the master: sheet snapshots and their indexes are built
+once and shared copy-on-write by the forked workers, which never load them from
+Sheets on their own at startup. After a refresh each worker maps the new snapshot
+file, sharing its cell values, and builds its own records and indexes over it.
+"""
+import os
+
+
+def _available_cpus():
+    """CPUs this container may run on, which can be fewer than the host has"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Threaded workers: requests spend most of their time waiting on Dialogflow and the Graph API
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', str(_available_cpus() * 2 + 1)))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported and before any worker is forked"""
+    import main
+    main.preload_for_workers()
+
+
+def post_fork(server, worker):
+    import main
+    main.after_worker_fork(workers=server.cfg.workers)
@@ -1,29 +1,577 @@
-from flask import Flask, request, jsonify
+import time
+_MODULE_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify, g, send_from_directory
 from datetime import datetime, timedelta
+import asyncio
 import logging
-import gspread
-from google.oauth2.service_account import Credentials
-from google.cloud import storage
-from google.cloud import dialogflowcx_v3beta1 as dialogflow_cx
-from google.api_core.client_options import ClientOptions
+import logging.handlers
 import os
+import atexit
 import json
+import hmac
+import sys
 import tempfile
 import uuid
+import random
 import requests
 import calendar
 import re
+import threading
+import contextvars
+import gc
+import queue
+import struct
+import sqlite3
+import mmap
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from collections.abc import Mapping, Sequence
+from itertools import chain, islice
+import heapq
+from functools import lru_cache, wraps
+from operator import attrgetter
 from flask_cors import CORS
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: each process refreshes the shared snapshot on its own
+    fcntl = None
+
+# Heavy Google client libraries (gspread, google.cloud.*) are imported on first use
+_IMPORTS_FINISHED = time.perf_counter()
+
 app = Flask(__name__)
 CORS(app)
-logging.basicConfig(level=logging.INFO)
+
+# Logging: level, 'text' or 'json' lines, records buffered for the writer thread, and the share
+# of requests whose full payload is logged at INFO (all of them are at DEBUG)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra=` fields of a record as keys"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BufferedLogHandler(logging.handlers.QueueHandler):
+    """Hand records to a writer thread so request threads never wait on the log stream.
+
+    Messages are formatted by the writer, not the caller, so pass values rather than
+    objects that change afterwards. When the buffer is full records are dropped and
+    counted instead of blocking.
+    """
+
+    def __init__(self, target, max_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(max_size))
+        self.target = target
+        self._listener = None
+        self.stats = {'records': 0, 'dropped': 0, 'emit_seconds': 0.0}
+        self.start()
+
+    def start(self):
+        self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self._listener.start()
+
+    def after_fork(self):
+        # The writer thread does not survive a fork, and the buffer may hold the parent's records
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.start()
+
+    def stop(self):
+        """Write out the buffered records and stop the writer thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def emit(self, record):
+        started = time.perf_counter()
+        super().emit(record)
+        self.stats['records'] += 1
+        self.stats['emit_seconds'] += time.perf_counter() - started
+
+    def get_stats(self):
+        records = self.stats['records']
+        return {
+            'records': records,
+            'dropped': self.stats['dropped'],
+            'buffered': self.queue.qsize(),
+            'emit_ms_total': round(self.stats['emit_seconds'] * 1000, 1),
+            'emit_us_mean': round(self.stats['emit_seconds'] / records * 1e6, 2) if records else None,
+        }
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Send every record, ours and the libraries', through one buffered handler on the root logger.
+
+    Like logging.basicConfig, leaves a root logger that already has handlers alone.
+    Returns the handler, or None.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    target = logging.StreamHandler()
+    if log_format == 'json':
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    handler = BufferedLogHandler(target)
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(handler.stop)
+    return handler
+
+
+log_handler = configure_logging()
+logger = logging.getLogger('travel_assistant')
+
+
+class LazyJson:
+    """A payload that is serialized only if its log record is written"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, default=str, ensure_ascii=False)
+
+
+def log_payload(label, payload):
+    """Log a full request payload: always at DEBUG, for a LOG_PAYLOAD_SAMPLE_RATE sample at INFO"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, LazyJson(payload))
+    elif logger.isEnabledFor(logging.INFO) and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.info("%s (sampled): %s", label, LazyJson(payload), extra={'sampled': True})
+
+
+# Upper bounds (s) of the latency histogram buckets served at /metrics
+METRICS_BUCKETS_SECONDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class MetricLabels:
+    """Endpoint and intent spans are recorded under; one instance per pair, so it hashes by identity"""
+    __slots__ = ('endpoint', 'intent')
+
+    def __init__(self, endpoint, intent):
+        self.endpoint = endpoint
+        self.intent = intent
+
+
+_metric_label_sets = {}
+
+
+def metric_labels(endpoint, intent=''):
+    labels = _metric_label_sets.get((endpoint, intent or ''))
+    if labels is None:
+        labels = _metric_label_sets.setdefault((endpoint, intent or ''), MetricLabels(endpoint, intent or ''))
+    return labels
+
+
+# Labels of the work running in this thread or task, attached to every span it records
+_metric_labels = contextvars.ContextVar('metric_labels', default=metric_labels('background'))
+
+
+def set_metric_labels(endpoint, intent=''):
+    """Label the spans recorded by the current thread or task from here on"""
+    return _metric_labels.set(metric_labels(endpoint, intent))
+
+
+def set_metric_intent(intent):
+    """Label the rest of the current request's spans with the intent it was matched to"""
+    _metric_labels.set(metric_labels(_metric_labels.get().endpoint, intent))
+
+
+class MetricsShard:
+    """One thread's histograms and counters, and the ones of the labels it last recorded under"""
+    __slots__ = ('histograms', 'counters', 'labels', 'stages', 'events', '__weakref__')
+
+    def __init__(self, histograms, counters):
+        self.histograms = histograms
+        self.counters = counters
+        self.labels = None
+
+    def use(self, labels):
+        self.labels = labels
+        self.stages = self.histograms.setdefault(labels, {})
+        self.events = self.counters.setdefault(labels, {})
+
+
+class StageMetrics:
+    """Latency histograms per stage and event counters, labeled by endpoint and intent.
+
+    Every thread records into its own shard, which keeps the stages of the labels it
+    last used. A span then costs a perf_counter() delta, a label identity check, one
+    dict lookup, a bucket bisect and two list updates, without a lock, and can stay
+    on in production. Shards are summed when /metrics is read, and a thread's numbers
+    are folded into the totals when it exits. Each worker process keeps and serves
+    its own numbers.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS_SECONDS):
+        self.buckets = buckets
+        self.after_fork()
+
+    def after_fork(self):
+        # The master's own startup work is not the worker's
+        self._local = threading.local()
+        # Reentrant, as a thread-local shard may be freed while this thread holds it
+        self._lock = threading.RLock()
+        # Shards of live threads by a serial number: ({labels: {stage: [count per bucket...,
+        # count over the last bucket, sum of seconds]}}, {labels: {event: count}})
+        self._shards = {}
+        self._next_shard_id = 0
+        # Totals of the threads that have exited, keyed like _totals
+        self._retired = ({}, {})
+
+    def _shard(self):
+        shard = MetricsShard({}, {})
+        with self._lock:
+            shard_id = self._next_shard_id
+            self._next_shard_id += 1
+            self._shards[shard_id] = (shard.histograms, shard.counters)
+        # Runs when the thread exits and its thread-local shard is freed
+        weakref.finalize(shard, self._retire, self._shards, shard_id)
+        self._local.shard = shard
+        return shard
+
+    def _retire(self, shards, shard_id):
+        with self._lock:
+            # Shards of the master's threads are freed in a forked worker too; those are not its numbers
+            if shards is not self._shards:
+                return
+            histograms, counters = shards.pop(shard_id)
+            self._add_shard(self._retired, histograms, counters)
+
+    def observe(self, stage, started):
+        """Record the time since the perf_counter value `started` as a `stage` span"""
+        elapsed = time.perf_counter() - started
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        labels = _metric_labels.get()
+        if shard.labels is not labels:
+            shard.use(labels)
+        try:
+            histogram = shard.stages[stage]
+        except KeyError:
+            histogram = shard.stages[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, elapsed)] += 1
+        histogram[-1] += elapsed
+
+    def count(self, event, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        labels = _metric_labels.get()
+        if shard.labels is not labels:
+            shard.use(labels)
+        events = shard.events
+        events[event] = events.get(event, 0) + amount
+
+    @staticmethod
+    def _add_shard(totals, histograms, counters):
+        """Add one shard's numbers to `totals`, keyed by (stage or event, endpoint, intent)"""
+        total_histograms, total_counters = totals
+        for labels, stages in list(histograms.items()):
+            for stage, histogram in list(stages.items()):
+                total = total_histograms.setdefault((stage, labels.endpoint, labels.intent), [0] * len(histogram))
+                for i, value in enumerate(list(histogram)):
+                    total[i] += value
+        for labels, events in list(counters.items()):
+            for event, count in list(events.items()):
+                key = (event, labels.endpoint, labels.intent)
+                total_counters[key] = total_counters.get(key, 0) + count
+
+    def _totals(self):
+        totals = ({}, {})
+        with self._lock:
+            retired_histograms, retired_counters = self._retired
+            for key, histogram in retired_histograms.items():
+                totals[0][key] = list(histogram)
+            totals[1].update(retired_counters)
+            shards = list(self._shards.values())
+            for histograms, counters in shards:
+                self._add_shard(totals, histograms, counters)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format"""
+        histograms, counters = self._totals()
+        bounds = [f"{bound:g}" for bound in self.buckets] + ['+Inf']
+        lines = [
+            '# HELP travel_assistant_stage_seconds Time spent in each stage of handling a request',
+            '# TYPE travel_assistant_stage_seconds histogram',
+        ]
+        for (stage, endpoint, intent), histogram in sorted(histograms.items()):
+            labels = f'stage="{_label_value(stage)}",endpoint="{_label_value(endpoint)}",intent="{_label_value(intent)}"'
+            cumulative = 0
+            for bound, count in zip(bounds, histogram):
+                cumulative += count
+                lines.append(f'travel_assistant_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'travel_assistant_stage_seconds_sum{{{labels}}} {histogram[-1]:.6f}')
+            lines.append(f'travel_assistant_stage_seconds_count{{{labels}}} {cumulative}')
+
+        lines += [
+            '# HELP travel_assistant_events_total Count of notable events, such as responses by status',
+            '# TYPE travel_assistant_events_total counter',
+        ]
+        for (event, endpoint, intent), count in sorted(counters.items()):
+            lines.append(f'travel_assistant_events_total{{event="{_label_value(event)}",'
+                         f'endpoint="{_label_value(endpoint)}",intent="{_label_value(intent)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = StageMetrics()
+
+
+def timed(stage):
+    """Decorator recording every call of a function as a `stage` span"""
+    def decorate(func):
+        observe, perf_counter = metrics.observe, time.perf_counter
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(stage, started)
+        return wrapper
+    return decorate
+
+
+@app.before_request
+def start_request_span():
+    g.metric_labels = set_metric_labels(request.endpoint or 'unmatched')
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def count_response(response):
+    metrics.count(f"http_{response.status_code}")
+    return response
+
+
+@app.teardown_request
+def finish_request_span(exc):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe('request', started)
+        _metric_labels.reset(g.pop('metric_labels'))
+
+# On-demand profiling of /chat, /webhook and /whatsapp/webhook: requests carrying an X-Admin-Token header
+# equal to PROFILE_ADMIN_TOKEN, and 1 in PROFILE_SAMPLE_EVERY others (0 = none), are profiled into
+# PROFILE_DIR, which keeps the newest PROFILE_MAX_FILES profiles. An empty token disables the
+# header and the /admin/profiles endpoints.
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_EVERY = int(os.getenv('PROFILE_SAMPLE_EVERY', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '50'))
+PROFILED_ENDPOINTS = {'chat_with_agent', 'webhook', 'handle_webhook'}
+
+
+class StackProfiler:
+    """Time per call stack of the current thread, in the folded format flamegraph.pl, speedscope and inferno read.
+
+    Every Python and builtin call is hooked with sys.setprofile, so a profiled request
+    runs several times slower; the hook's own time is left out of the profile. Time
+    spent blocked, such as waiting on Dialogflow, is counted in the blocking call.
+    Work handed to other threads shows up as the wait for it.
+    """
+
+    def __init__(self, root):
+        # Folded stack -> seconds spent with it on top
+        self.stacks = {}
+        self._paths = [root]
+        self._labels = {}
+        self._last = 0.0
+        self.seconds = 0.0
+
+    def start(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._hook)
+
+    def stop(self):
+        sys.setprofile(None)
+        # What the request would have taken unprofiled, roughly
+        self.seconds = sum(self.stacks.values())
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _hook(self, frame, event, arg):
+        path = self._paths[-1]
+        self.stacks[path] = self.stacks.get(path, 0.0) + time.perf_counter() - self._last
+        if event == 'call':
+            self._paths.append(f"{path};{self._label(frame.f_code)}")
+        elif event == 'c_call':
+            self._paths.append(f"{path};{getattr(arg, '__qualname__', None) or getattr(arg, '__name__', 'builtin')}")
+        elif len(self._paths) > 1:
+            # return, c_return or c_exception; returns from the frames the profile started in stay at the root
+            self._paths.pop()
+        self._last = time.perf_counter()
+
+    def folded(self):
+        """One `frame;frame;... microseconds` line per stack"""
+        return ''.join(f"{path} {round(seconds * 1e6)}\n" for path, seconds in self.stacks.items() if seconds >= 5e-7)
+
+
+class ProfileStore:
+    """Folded profiles in a directory, pruned to the newest `max_files`; shared by the worker processes"""
+
+    SUFFIX = '.folded'
+
+    def __init__(self, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+        self.directory = os.path.abspath(directory)
+        self.max_files = max_files
+        self._sequence = 0
+
+    def save(self, profiler, endpoint, intent=''):
+        """Write a finished profile, returning its file name (None when writing failed)"""
+        self._sequence += 1
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', '-'.join(filter(None, (
+            datetime.now().strftime('%Y%m%dT%H%M%S'), endpoint, intent,
+            f"{profiler.seconds * 1000:.0f}ms", str(os.getpid()), str(self._sequence),
+        )))) + self.SUFFIX
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as profile_file:
+                profile_file.write(profiler.folded())
+            self._prune()
+        except OSError as e:
+            logger.error("Failed to write profile %s: %s", name, e)
+            return None
+        logger.info("Wrote profile %s", name)
+        return name
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                return sorted((entry for entry in entries if entry.name.endswith(self.SUFFIX) and entry.is_file()),
+                              key=lambda entry: entry.stat().st_mtime, reverse=True)
+        except FileNotFoundError:
+            return []
+
+    def _prune(self):
+        for entry in self._entries()[self.max_files:]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+
+    def list(self):
+        """The stored profiles, newest first"""
+        profiles = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            profiles.append({'name': entry.name, 'bytes': stat.st_size,
+                             'written': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')})
+        return profiles
+
+
+profile_store = ProfileStore()
+
+
+def admin_token_matches(token):
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token or '', PROFILE_ADMIN_TOKEN)
+
+
+def profile_requested(headers):
+    """Whether to profile a request: the admin header, or the 1 in PROFILE_SAMPLE_EVERY sample"""
+    if headers.get('X-Admin-Token') and admin_token_matches(headers.get('X-Admin-Token')):
+        return True
+    return PROFILE_SAMPLE_EVERY > 0 and random.random() * PROFILE_SAMPLE_EVERY < 1
+
+
+@app.before_request
+def start_request_profile():
+    if request.endpoint in PROFILED_ENDPOINTS and profile_requested(request.headers):
+        g.profiler = StackProfiler(request.endpoint)
+        g.profiler.start()
+
+
+@app.after_request
+def save_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        labels = _metric_labels.get()
+        name = profile_store.save(profiler, labels.endpoint, labels.intent)
+        if name:
+            response.headers['X-Profile'] = name
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # When the request failed before after_request ran
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
 
 # Dialogflow CX Configuration
 PROJECT_ID = "codematic-playground"
 AGENT_ID = "10a6c174-ed65-4549-894d-eaa4dfa3d432"
 REGION = "global"
 LANGUAGE_CODE = "en-US"
+# Deadline of each Dialogflow call (s), and how many async calls (asgi.py) may be in flight per worker process
+DIALOGFLOW_TIMEOUT_SECONDS = float(os.getenv('DIALOGFLOW_TIMEOUT_SECONDS', '10'))
+DIALOGFLOW_MAX_CONCURRENCY = int(os.getenv('DIALOGFLOW_MAX_CONCURRENCY', '100'))
+# host:port of a local Dialogflow CX stand-in such as benchmarks/fake_services.py, reached without TLS or
+# credentials (empty = the real service)
+DIALOGFLOW_EMULATOR_HOST = os.getenv('DIALOGFLOW_EMULATOR_HOST', '')
+# Trip plans look up events, stays and outfits in parallel and go without any not back by this
+# deadline (s), as Dialogflow CX gives up on a webhook after 5s by default
+TRIP_PLAN_DEADLINE_SECONDS = float(os.getenv('TRIP_PLAN_DEADLINE_SECONDS', '4'))
+# Threads per worker process for those lookups while the sheets are still loading; this caps how
+# many a slow Sheets API can hold up
+TRIP_LOOKUP_WORKERS = int(os.getenv('TRIP_LOOKUP_WORKERS', '8'))
 
 
 # WHATSAPP CONFIGURATION
@@ -31,14 +579,115 @@ WHATSAPP_TOKEN="EAAPnZBCqPuu0BPFdXrKko0W4xUhbUt2rLmysynYDvKJmdaUWnGzLT2I3oKJevRT
 VERIFY_TOKEN = "TEAMCARTRANDOMVERIFYTOKEN"
 PHONENUMBER_ID = "732548379943793"
 
-# Configure the Dialogflow CX client
-if REGION and REGION != "global":
-    client_options = ClientOptions(api_endpoint=f"{REGION}-dialogflow.googleapis.com:443")
-else:
-    client_options = None
+# Meta Graph API client: pooled keep-alive connections, timeouts and retries
+# v20.0 rather than v23.0, as the token might not support v23.0
+GRAPH_API_BASE_URL = os.getenv('GRAPH_API_BASE_URL', "https://graph.facebook.com/v20.0")
+GRAPH_API_POOL_SIZE = int(os.getenv('GRAPH_API_POOL_SIZE', '10'))
+GRAPH_API_CONNECT_TIMEOUT = float(os.getenv('GRAPH_API_CONNECT_TIMEOUT', '3.05'))
+GRAPH_API_READ_TIMEOUT = float(os.getenv('GRAPH_API_READ_TIMEOUT', '10'))
+GRAPH_API_MAX_RETRIES = int(os.getenv('GRAPH_API_MAX_RETRIES', '3'))
+GRAPH_API_BACKOFF_SECONDS = float(os.getenv('GRAPH_API_BACKOFF_SECONDS', '0.5'))
+# Longest Retry-After we will wait out before giving up on a send
+GRAPH_API_MAX_RETRY_AFTER = float(os.getenv('GRAPH_API_MAX_RETRY_AFTER', '30'))
+GRAPH_API_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Outbound WhatsApp pacing: messages per second per business number and burst size for the
+# whole deployment, split evenly between gunicorn workers; minimum gap between messages to one
+# recipient, and parallel sends per process
+WHATSAPP_SEND_RATE = float(os.getenv('WHATSAPP_SEND_RATE', '20'))
+WHATSAPP_SEND_BURST = float(os.getenv('WHATSAPP_SEND_BURST', '20'))
+WHATSAPP_RECIPIENT_INTERVAL_SECONDS = float(os.getenv('WHATSAPP_RECIPIENT_INTERVAL_SECONDS', '1'))
+WHATSAPP_SEND_CONCURRENCY = int(os.getenv('WHATSAPP_SEND_CONCURRENCY', '4'))
+
+# Incoming WhatsApp messages are queued and answered by this many background threads
+WHATSAPP_WORKERS = int(os.getenv('WHATSAPP_WORKERS', '4'))
+# Messages waiting beyond this are refused with a 503 so Meta redelivers them later
+WHATSAPP_QUEUE_SIZE = int(os.getenv('WHATSAPP_QUEUE_SIZE', '1000'))
+# Recently processed message ids remembered to skip Meta's redeliveries, optionally in
+# a local SQLite file (empty = memory only) so dedupe survives restarts
+WHATSAPP_DEDUPE_MAX_IDS = int(os.getenv('WHATSAPP_DEDUPE_MAX_IDS', '10000'))
+WHATSAPP_DEDUPE_TTL_SECONDS = float(os.getenv('WHATSAPP_DEDUPE_TTL_SECONDS', '86400'))
+WHATSAPP_DEDUPE_DB = os.getenv('WHATSAPP_DEDUPE_DB', '')
+# How long a stopping worker process keeps answering queued messages
+WHATSAPP_DRAIN_SECONDS = float(os.getenv('WHATSAPP_DRAIN_SECONDS', '10'))
+
+# Cold-start budget for a worker to become ready, reported at the end of warmup
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '3000'))
+# Warm the Google clients and sheet data on a background thread as the server starts
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+
+# Milliseconds spent in each startup phase, exposed on /health and logged after warmup
+STARTUP_TIMINGS = {'imports_ms': round((_IMPORTS_FINISHED - _MODULE_STARTED) * 1000, 1)}
+
+
+def record_startup_timing(name, started):
+    """Record how long a startup phase took since the perf_counter value `started`"""
+    STARTUP_TIMINGS[name] = round((time.perf_counter() - started) * 1000, 1)
 
-# Initialize Dialogflow CX SessionsClient
-session_client = dialogflow_cx.SessionsClient(client_options=client_options)
+
+_session_client = None
+_session_client_lock = threading.Lock()
+# (event loop, SessionsAsyncClient, semaphore limiting its calls)
+_async_session = None
+ASYNC_DIALOGFLOW_STATS = {'calls': 0, 'in_flight': 0, 'peak_in_flight': 0, 'timeouts': 0, 'errors': 0}
+
+
+def get_dialogflow_cx():
+    """Import the Dialogflow CX library on first use, it is the slowest import in the service"""
+    from google.cloud import dialogflowcx_v3beta1 as dialogflow_cx
+    return dialogflow_cx
+
+
+def get_session_client():
+    """Return the Dialogflow CX SessionsClient, creating it on first use"""
+    global _session_client
+    if _session_client is None:
+        with _session_client_lock:
+            if _session_client is None:
+                started = time.perf_counter()
+                dialogflow_cx = get_dialogflow_cx()
+                _session_client = dialogflow_cx.SessionsClient(**_dialogflow_client_kwargs())
+                record_startup_timing('dialogflow_client_ms', started)
+    return _session_client
+
+
+def _dialogflow_client_kwargs(asynchronous=False):
+    """Regional agents are served from their own endpoint, an emulator over a plain channel"""
+    if DIALOGFLOW_EMULATOR_HOST:
+        import grpc
+        from google.cloud.dialogflowcx_v3beta1.services.sessions import transports
+        if asynchronous:
+            channel = grpc.aio.insecure_channel(DIALOGFLOW_EMULATOR_HOST)
+            return {'transport': transports.SessionsGrpcAsyncIOTransport(channel=channel)}
+        return {'transport': transports.SessionsGrpcTransport(channel=grpc.insecure_channel(DIALOGFLOW_EMULATOR_HOST))}
+    if REGION and REGION != "global":
+        from google.api_core.client_options import ClientOptions
+        return {'client_options': ClientOptions(api_endpoint=f"{REGION}-dialogflow.googleapis.com:443")}
+    return {}
+
+
+def get_async_session_client():
+    """Return the Dialogflow CX SessionsAsyncClient of the running event loop and the semaphore limiting its calls.
+
+    gRPC asyncio channels belong to the loop that created them, so a new loop gets a new client.
+    """
+    global _async_session
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session[0] is not loop:
+        started = time.perf_counter()
+        dialogflow_cx = get_dialogflow_cx()
+        client = dialogflow_cx.SessionsAsyncClient(**_dialogflow_client_kwargs(asynchronous=True))
+        _async_session = (loop, client, asyncio.Semaphore(DIALOGFLOW_MAX_CONCURRENCY))
+        record_startup_timing('dialogflow_async_client_ms', started)
+    return _async_session[1], _async_session[2]
+
+
+async def close_async_session_client():
+    """Close the async client's channel before its event loop stops"""
+    global _async_session
+    if _async_session is not None and _async_session[0] is asyncio.get_running_loop():
+        await _async_session[1].transport.close()
+    _async_session = None
 
 # Google Sheets configuration
 SCOPES = [
@@ -62,6 +711,245 @@ SHEET_CONFIG = {
     }
 }
 
+# Sheet types grouped by spreadsheet, so each spreadsheet is fetched in one batched request
+SHEET_GROUPS = {}
+for _sheet_type, _config in SHEET_CONFIG.items():
+    SHEET_GROUPS.setdefault(_config['sheet_id'], []).append(_sheet_type)
+
+# Alias -> canonical mappings for areas and event types
+ALIAS_CONFIG_PATH = os.getenv(
+    'ALIAS_CONFIG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'normalization_aliases.json')
+)
+
+# Dialogflow CX agent export; its welcome chips are answered locally by /chat
+DIALOGFLOW_CONFIG_PATH = os.getenv(
+    'DIALOGFLOW_CONFIG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'dialogflow_config.json')
+)
+
+# Local copy of the last loaded sheets, served at startup while Sheets is refreshed in the background.
+# Worker processes memory-map this one file, sharing its cell values, and a single refresher between
+# them; each still builds its own records and indexes over the mapping.
+SHEET_SNAPSHOT_PATH = os.getenv(
+    'SHEET_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sheets_snapshot.bin')
+)
+SNAPSHOT_FILE_MAGIC = b'TASNAP'
+SNAPSHOT_FORMAT_VERSION = 2
+
+# How long a loaded sheet snapshot is served before a background refresh is triggered
+SHEET_CACHE_TTL_SECONDS = int(os.getenv('SHEET_CACHE_TTL_SECONDS', '300'))
+# Minimum wait before retrying a refresh that failed
+SHEET_REFRESH_RETRY_SECONDS = int(os.getenv('SHEET_REFRESH_RETRY_SECONDS', '30'))
+# How long to wait before looking for a snapshot that another process is refreshing
+SHARED_SNAPSHOT_POLL_SECONDS = int(os.getenv('SHARED_SNAPSHOT_POLL_SECONDS', '5'))
+
+
+class AliasResolver:
+    """Resolve free-text values to canonical names through a reverse lookup compiled once.
+
+    Values are transformed to a lookup key (e.g. lowercased), then mapped
+    alias -> canonical with a single dict lookup; unknown values resolve to
+    their key. Results are memoized since sheets repeat the same few values.
+    """
+
+    def __init__(self, mappings, key_transform):
+        self._key_transform = key_transform
+        self._lookup = {}
+        for canonical, aliases in mappings.items():
+            # First mapping wins when an alias is listed under more than one canonical name
+            for alias in [canonical, *aliases]:
+                self._lookup.setdefault(key_transform(alias), canonical)
+        self.resolve = lru_cache(maxsize=4096)(self._resolve)
+
+    def _resolve(self, value):
+        key = self._key_transform(value)
+        return self._lookup.get(key, key)
+
+
+def load_alias_config(path=ALIAS_CONFIG_PATH):
+    """Load the area and event type alias mappings, falling back to no aliases"""
+    try:
+        with open(path, encoding='utf-8') as config_file:
+            config = json.load(config_file)
+        logger.info("Loaded normalization aliases from %s", path)
+        return config.get('areas', {}), config.get('event_types', {})
+    except (OSError, ValueError) as e:
+        logger.error("Failed to load normalization aliases from %s: %s", path, e)
+        return {}, {}
+
+
+_area_aliases, _event_type_aliases = load_alias_config()
+AREA_RESOLVER = AliasResolver(_area_aliases, lambda value: value.lower().strip())
+EVENT_TYPE_RESOLVER = AliasResolver(_event_type_aliases, lambda value: value.lower().strip().replace(' ', '_'))
+
+
+_MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_BLANK_DATE_VALUES = {'', 'tbd', 'n/a', 'none'}
+_UNPARSED = object()
+
+
+def _build_date(year, month, day):
+    try:
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+# Date shapes recognized by a cheap regex, each with the strptime formats it can represent.
+# Order matters: it is the order the original strptime chain tried formats in.
+_DATE_SHAPES = [
+    ('%Y-%m-%d', re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})$'), lambda m: _build_date(m[1], m[2], m[3])),
+    ('%d/%m/%Y', re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})$'), lambda m: _build_date(m[3], m[2], m[1])),
+    ('%m/%d/%Y', re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})$'), lambda m: _build_date(m[3], m[1], m[2])),
+    ('%d-%m-%Y', re.compile(r'(\d{1,2})-(\d{1,2})-(\d{4})$'), lambda m: _build_date(m[3], m[2], m[1])),
+    ('%Y/%m/%d', re.compile(r'(\d{4})/(\d{1,2})/(\d{1,2})$'), lambda m: _build_date(m[1], m[2], m[3])),
+    ('%d %B %Y', re.compile(r'(\d{1,2}) ([A-Za-z]+) (\d{4})$'),
+     lambda m: _build_date(m[3], _MONTH_NUMBERS[m[2].lower()], m[1]) if m[2].lower() in _MONTH_NUMBERS else None),
+    ('%B %d, %Y', re.compile(r'([A-Za-z]+) (\d{1,2}), (\d{4})$'),
+     lambda m: _build_date(m[3], _MONTH_NUMBERS[m[1].lower()], m[2]) if m[1].lower() in _MONTH_NUMBERS else None),
+]
+_DATE_FORMATS = [date_format for date_format, _, _ in _DATE_SHAPES]
+
+
+class DateColumnParser:
+    """Parse a sheet's date column, dispatching on the shape of each value instead of trying
+    every strptime format in turn.
+
+    `learn` samples the column once at load time and moves its dominant format to the
+    front (which also settles whether ambiguous dd/mm vs mm/dd values are read day first).
+    Results are cached per distinct value, and values that cannot be parsed are counted
+    instead of logged one by one.
+    """
+
+    def __init__(self, shapes=None):
+        self._shapes = list(shapes or _DATE_SHAPES)
+        self._cache = {}
+        self.failures = 0
+        self.failed_samples = []
+
+    @property
+    def dominant_format(self):
+        return self._shapes[0][0]
+
+    @classmethod
+    def learn(cls, values, sample_size=500):
+        """Build a parser whose shape order follows the most common format in `values`"""
+        counts = dict.fromkeys(_DATE_FORMATS, 0)
+        sampled = 0
+        for value in values:
+            if sampled >= sample_size:
+                break
+            date_str = str(value).strip() if value is not None else ''
+            if date_str.lower() in _BLANK_DATE_VALUES:
+                continue
+            sampled += 1
+            for date_format, pattern, build in _DATE_SHAPES:
+                match = pattern.match(date_str)
+                if match and build(match):
+                    counts[date_format] += 1
+
+        # Ties keep the original format order (day first for dd/mm vs mm/dd)
+        shapes = sorted(_DATE_SHAPES, key=lambda shape: -counts[shape[0]])
+        return cls(shapes)
+
+    def parse(self, value):
+        """Parse a date cell, returning None for blanks and unparseable values"""
+        result = self._cache.get(value, _UNPARSED)
+        if result is _UNPARSED:
+            result = self._cache[value] = self._parse_uncached(value)
+
+        if result is False:
+            self.failures += 1
+            return None
+        return result
+
+    def _parse_uncached(self, value):
+        """Returns a datetime, None for a blank value, or False when the value cannot be parsed"""
+        if not value:
+            return None
+        date_str = str(value).strip()
+        if len(date_str) <= 4 and date_str.lower() in _BLANK_DATE_VALUES:
+            return None
+
+        # Zero-padded ISO dates are by far the most common and have a C fast path
+        if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-':
+            try:
+                return datetime.fromisoformat(date_str)
+            except ValueError:
+                pass
+
+        for _, pattern, build in self._shapes:
+            match = pattern.match(date_str)
+            if match:
+                parsed = build(match)
+                if parsed:
+                    return parsed
+
+        # Anything the shapes do not cover still gets the full strptime treatment
+        for date_format in _DATE_FORMATS:
+            try:
+                return datetime.strptime(date_str, date_format)
+            except ValueError:
+                continue
+
+        if len(self.failed_samples) < 5:
+            self.failed_samples.append(date_str)
+        return False
+
+
+_MONTH_PATTERN = (
+    r'january|february|march|april|may|june|july|august|september|october|november|december'
+    r'|jan|feb|mar|apr|jun|jul|aug|sept|sep|oct|nov|dec'
+)
+
+
+def _month_number(name):
+    """Number of a month named in full or abbreviated ("dec", "sept") as _MONTH_PATTERN matches it, else None"""
+    if not name or len(name) < 3:
+        return None
+    return next((number for full_name, number in _MONTH_NUMBERS.items() if full_name.startswith(name)), None)
+
+
+# A month named without a day; "may" only after "in" or "of", or as the whole query,
+# so "may i see events this week" asks about this week rather than May
+_BARE_MONTH_PATTERN = (
+    r'january|february|march|april|june|july|august|september|october|november|december'
+    r'|jan|feb|mar|apr|jun|jul|aug|sept|sep|oct|nov|dec'
+    r'|(?<=\bin )may|(?<=\bof )may|^may$'
+)
+
+_ORDINAL_SUFFIX = r'(?:st|nd|rd|th)?'
+
+# Every temporal expression we understand, matched in a single pass over the query.
+# Word boundaries keep "mar" in "market" and "may" in "mayfair" from matching.
+_DATE_QUERY_PATTERN = re.compile(
+    rf'\b(?:'
+    rf'(?P<range_month>{_MONTH_PATTERN})\.?\s+(?P<range_start>\d{{1,2}}){_ORDINAL_SUFFIX}\s*(?:-|–|to|until|till)\s*'
+    rf'(?:(?P<range_end_month>{_MONTH_PATTERN})\.?\s+)?(?P<range_end>\d{{1,2}}){_ORDINAL_SUFFIX}'
+    rf'|(?P<day_range_start>\d{{1,2}}){_ORDINAL_SUFFIX}\s*(?:-|–|to|until|till)\s*(?P<day_range_end>\d{{1,2}}){_ORDINAL_SUFFIX}'
+    rf'\s+(?:of\s+)?(?P<day_range_month>{_MONTH_PATTERN})'
+    rf'|(?P<iso_year>\d{{4}})-(?P<iso_month>\d{{1,2}})-(?P<iso_day>\d{{1,2}})'
+    rf'|(?P<date_month>{_MONTH_PATTERN})\.?\s+(?P<date_day>\d{{1,2}}){_ORDINAL_SUFFIX}'
+    rf'|(?P<day_first>\d{{1,2}}){_ORDINAL_SUFFIX}\s+(?:of\s+)?(?P<day_first_month>{_MONTH_PATTERN})'
+    rf'|next\s+(?P<next_count>\d{{1,3}})\s+(?P<next_unit>days?|weeks?)'
+    rf'|(?P<this_week>this\s+week|current\s+week)'
+    rf'|(?P<next_week>next\s+week)'
+    rf'|(?P<this_month>this\s+month|current\s+month)'
+    rf'|(?P<weekend>(?:this\s+)?weekend)'
+    rf'|(?P<today>today|tonight)'
+    rf'|(?P<tomorrow>tomorrow)'
+    rf'|(?P<month>{_BARE_MONTH_PATTERN})'
+    rf')\b'
+)
+
+# When a query holds several expressions the most specific one wins
+_DATE_TOKEN_PRIORITY = [
+    'range_month', 'day_range_start', 'iso_year', 'date_month', 'day_first', 'next_count',
+    'month', 'this_week', 'next_week', 'this_month', 'weekend', 'today', 'tomorrow'
+]
+
 
 class DateRangeParser:
     """Utility class to parse various date range queries"""
@@ -71,80 +959,679 @@ class DateRangeParser:
         """Parse natural language date queries and return date range"""
         if not query_text:
             return None, None
-            
-        query_lower = query_text.lower()
-        current_date = datetime.now()
-        
-        # Month name patterns
-        months = {
-            'january': 1, 'february': 2, 'march': 3, 'april': 4,
-            'may': 5, 'june': 6, 'july': 7, 'august': 8,
-            'september': 9, 'october': 10, 'november': 11, 'december': 12,
-            'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
-            'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
-        }
         
-        # Check for specific month queries
-        for month_name, month_num in months.items():
-            if month_name in query_lower:
-                # Default to current year or next year if month has passed
-                year = current_date.year
-                if month_num < current_date.month:
-                    year += 1
-                
-                # Get first and last day of the month
-                start_date = datetime(year, month_num, 1)
-                last_day = calendar.monthrange(year, month_num)[1]
-                end_date = datetime(year, month_num, last_day)
-                
-                logging.info(f"Parsed month query: {month_name} -> {start_date} to {end_date}")
-                return start_date, end_date
-        
-        # This week
-        if 'this week' in query_lower or 'current week' in query_lower:
-            week_start = current_date - timedelta(days=current_date.weekday())
-            week_end = week_start + timedelta(days=6)
-            return week_start, week_end
-        
-        # Next week
-        if 'next week' in query_lower:
-            week_start = current_date + timedelta(days=7-current_date.weekday())
-            week_end = week_start + timedelta(days=6)
-            return week_start, week_end
-        
-        # This month
-        if 'this month' in query_lower or 'current month' in query_lower:
-            month_start = current_date.replace(day=1)
-            next_month = month_start.replace(month=month_start.month % 12 + 1, day=1)
-            month_end = next_month - timedelta(days=1)
-            return month_start, month_end
-        
-        # Weekend patterns
-        if 'weekend' in query_lower or 'this weekend' in query_lower:
-            days_until_saturday = (5 - current_date.weekday()) % 7
-            saturday = current_date + timedelta(days=days_until_saturday)
-            sunday = saturday + timedelta(days=1)
-            return saturday, sunday
-        
-        # Today/tomorrow patterns
-        if 'today' in query_lower:
-            return current_date, current_date
-        
-        if 'tomorrow' in query_lower:
-            tomorrow = current_date + timedelta(days=1)
-            return tomorrow, tomorrow
+        # Queries repeat a lot (the welcome chips), so results are memoized per day
+        normalized_query = ' '.join(str(query_text).lower().split())
+        return DateRangeParser._parse_normalized(normalized_query, datetime.now().date().toordinal())
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _parse_normalized(query_lower, today_ordinal):
+        today = datetime.fromordinal(today_ordinal)
+
+        best_range, best_text, best_rank = None, None, len(_DATE_TOKEN_PRIORITY)
+        for match in _DATE_QUERY_PATTERN.finditer(query_lower):
+            kind = DateRangeParser._token_kind(match)
+            rank = _DATE_TOKEN_PRIORITY.index(kind)
+            if rank >= best_rank:
+                continue
+            try:
+                date_range = DateRangeParser._resolve(kind, match, today)
+            except ValueError:
+                # An impossible day such as "feb 30" still tells us the month
+                month = next(filter(None, map(_month_number, match.groups())), None)
+                rank = _DATE_TOKEN_PRIORITY.index('month')
+                if month is None or rank >= best_rank:
+                    continue
+                date_range = DateRangeParser._month_range(month, today)
+            best_range, best_text, best_rank = date_range, match.group(0), rank
+
+        if best_range is not None:
+            logger.debug("Parsed date query: '%s' -> %s to %s", best_text, best_range[0], best_range[1])
+            return best_range
         
         # Default to current year if no specific date found
-        logging.info("No specific date pattern found, defaulting to current year")
-        year_start = current_date.replace(month=1, day=1)
-        year_end = current_date.replace(month=12, day=31)
-        return year_start, year_end
+        logger.debug("No specific date pattern found, defaulting to current year")
+        return datetime(today.year, 1, 1), datetime(today.year, 12, 31)
+
+    @staticmethod
+    def _token_kind(match):
+        for kind in _DATE_TOKEN_PRIORITY:
+            if match.group(kind) is not None:
+                return kind
+        return None
+
+    @staticmethod
+    def _year_for_month(month, today):
+        # Default to current year or next year if month has passed
+        return today.year + 1 if month < today.month else today.year
+
+    @staticmethod
+    def _month_range(month, today):
+        year = DateRangeParser._year_for_month(month, today)
+        # Get first and last day of the month
+        return datetime(year, month, 1), datetime(year, month, calendar.monthrange(year, month)[1])
+
+    @staticmethod
+    def _resolve(kind, match, today):
+        """Turn one matched expression into a (start, end) datetime pair"""
+        if kind == 'range_month':
+            start_month = _month_number(match['range_month'])
+            end_month = _month_number(match['range_end_month']) if match['range_end_month'] else start_month
+            start_year = DateRangeParser._year_for_month(start_month, today)
+            end_year = start_year + 1 if end_month < start_month else start_year
+            return (datetime(start_year, start_month, int(match['range_start'])),
+                    datetime(end_year, end_month, int(match['range_end'])))
+
+        if kind == 'day_range_start':
+            month = _month_number(match['day_range_month'])
+            year = DateRangeParser._year_for_month(month, today)
+            return (datetime(year, month, int(match['day_range_start'])),
+                    datetime(year, month, int(match['day_range_end'])))
+
+        if kind == 'iso_year':
+            day = datetime(int(match['iso_year']), int(match['iso_month']), int(match['iso_day']))
+            return day, day
+
+        if kind in ('date_month', 'day_first'):
+            month = _month_number(match['date_month'] or match['day_first_month'])
+            year = DateRangeParser._year_for_month(month, today)
+            day = datetime(year, month, int(match['date_day'] or match['day_first']))
+            return day, day
+
+        if kind == 'next_count':
+            days = int(match['next_count']) * (7 if match['next_unit'].startswith('week') else 1)
+            # Today is the first of the days
+            return today, today + timedelta(days=days - 1)
+
+        if kind == 'month':
+            return DateRangeParser._month_range(_month_number(match['month']), today)
+
+        if kind == 'this_week':
+            week_start = today - timedelta(days=today.weekday())
+            return week_start, week_start + timedelta(days=6)
+
+        if kind == 'next_week':
+            week_start = today + timedelta(days=7 - today.weekday())
+            return week_start, week_start + timedelta(days=6)
+
+        if kind == 'this_month':
+            last_day = calendar.monthrange(today.year, today.month)[1]
+            return today.replace(day=1), today.replace(day=last_day)
+
+        if kind == 'weekend':
+            saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+            return saturday, saturday + timedelta(days=1)
+
+        if kind == 'today':
+            return today, today
+
+        tomorrow = today + timedelta(days=1)
+        return tomorrow, tomorrow
+
+
+class EventRecord:
+    """An events row with its date, area and type parsed once when the snapshot loads"""
+    __slots__ = ('data', 'position', 'date', 'day', 'area', 'event_type')
+
+    def __init__(self, data, position, date, area, event_type):
+        self.data = data
+        self.position = position
+        self.date = date
+        self.day = date.date() if date else None
+        self.area = area
+        self.event_type = event_type
+
+
+class AccommodationRecord:
+    """An accommodations row with numeric price and rating parsed once when the snapshot loads"""
+    __slots__ = ('data', 'position', 'area', 'acc_type', 'price', 'rating')
+
+    def __init__(self, data, position, area, acc_type, price, rating):
+        self.data = data
+        self.position = position
+        self.area = area
+        self.acc_type = acc_type
+        self.price = price
+        self.rating = rating
+
+
+class OutfitRecord:
+    """An outfits row with its event type and gender normalized once when the snapshot loads"""
+    __slots__ = ('data', 'position', 'event_type', 'gender')
+
+    def __init__(self, data, position, event_type, gender):
+        self.data = data
+        self.position = position
+        self.event_type = event_type
+        self.gender = gender
+
+
+class DateSortedEvents:
+    """Events in date order with a parallel list of day ordinals for bisecting date ranges"""
+    __slots__ = ('events', 'keys')
+
+    def __init__(self, events):
+        self.events = events
+        self.keys = [event.day.toordinal() for event in events]
+
+    def span(self, start_day=None, end_day=None):
+        """Index range of the events falling between start_day and end_day inclusive"""
+        if start_day is None:
+            return 0, len(self.events)
+        return (
+            bisect_left(self.keys, start_day.toordinal()),
+            bisect_right(self.keys, end_day.toordinal())
+        )
+
+
+class EventIndex:
+    """Secondary indexes over dated events: by area, by event type and by date"""
+
+    def __init__(self, records):
+        # Stable sort, so events on the same day keep their sheet order
+        dated_events = sorted((event for event in records if event.day is not None), key=attrgetter('date'))
+
+        by_area = {}
+        by_type = {}
+        for event in dated_events:
+            by_area.setdefault(event.area, []).append(event)
+            by_type.setdefault(event.event_type, []).append(event)
+
+        self.by_date = DateSortedEvents(dated_events)
+        self.by_area = {area: DateSortedEvents(events) for area, events in by_area.items()}
+        self.by_type = {event_type: DateSortedEvents(events) for event_type, events in by_type.items()}
+
+    def query(self, start_day=None, end_day=None, area=None, event_type=None, limit=5):
+        """Return up to `limit` matching events in date order without sorting or scanning everything.
+
+        The smallest candidate set (date range, area bucket or type bucket, each
+        already in date order) is walked from its first in-range event, and the
+        remaining filters are checked per event until `limit` matches are found.
+        """
+        buckets = [self.by_date]
+        if area is not None:
+            buckets.append(self.by_area.get(area))
+        if event_type is not None:
+            buckets.append(self.by_type.get(event_type))
+        if None in buckets:
+            return []
+
+        best_bucket, best_span = None, None
+        for bucket in buckets:
+            lo, hi = bucket.span(start_day, end_day)
+            if best_span is None or hi - lo < best_span[1] - best_span[0]:
+                best_bucket, best_span = bucket, (lo, hi)
+
+        matches = []
+        events = best_bucket.events
+        for position in range(*best_span):
+            event = events[position]
+            if area is not None and event.area != area:
+                continue
+            if event_type is not None and event.event_type != event_type:
+                continue
+            matches.append(event)
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+class PriceRankedGroup:
+    """Accommodations for one (area, type) key, ordered by price and by rating.
+
+    Budget queries work on each place's rank in the rating order. The price-ordered
+    ranks are cut into blocks of RANKED_BLOCK_SIZE, and a segment tree over the
+    blocks keeps the best RANKED_BLOCK_SIZE ranks under every node.
+    """
+    __slots__ = ('by_rating', 'price_keys', 'price_ranks', 'unpriced_ranks', 'block_count', 'ranked_blocks')
+
+    RANKED_BLOCK_SIZE = 16
+
+    def __init__(self, records):
+        # Highest rating first, ties kept in sheet order
+        self.by_rating = sorted(records, key=lambda record: (-record.rating, record.position))
+        prices = [record.price for record in self.by_rating]
+        self.price_ranks = sorted((rank for rank, price in enumerate(prices) if price is not None), key=prices.__getitem__)
+        self.price_keys = [prices[rank] for rank in self.price_ranks]
+        self.unpriced_ranks = [rank for rank, price in enumerate(prices) if price is None]
+
+        size = self.RANKED_BLOCK_SIZE
+        self.block_count = len(self.price_ranks) // size
+        # Leaves at block_count + i, node i merges nodes 2i and 2i + 1; a partial last block is left out
+        self.ranked_blocks = [None] * self.block_count + [
+            sorted(self.price_ranks[start:start + size]) for start in range(0, self.block_count * size, size)
+        ]
+        for node in range(self.block_count - 1, 0, -1):
+            self.ranked_blocks[node] = sorted(self.ranked_blocks[2 * node] + self.ranked_blocks[2 * node + 1])[:size]
+
+    def top_rated(self, min_price=None, max_price=None, limit=5):
+        """Return the `limit` best rated places whose price falls within the budget.
+
+        Places without a parseable price are always kept, as they may still fit.
+        When most priced places are in budget the rating order is walked directly,
+        skipping those out of budget. Otherwise the price range is found by
+        bisection, and the blocks fully inside it come from O(log n) tree nodes.
+        These are merged with the at most two partial blocks at its ends, which
+        takes O(log n + limit log log n). A limit above RANKED_BLOCK_SIZE ranks
+        the whole range with a bounded heap.
+        """
+        if min_price is None and max_price is None:
+            return self.by_rating[:limit]
+
+        lo = bisect_left(self.price_keys, min_price) if min_price is not None else 0
+        hi = bisect_right(self.price_keys, max_price) if max_price is not None else len(self.price_keys)
+        if hi <= lo and not self.unpriced_ranks:
+            return []
+
+        if (hi - lo) * 2 >= len(self.price_keys):
+            matches = []
+            for record in self.by_rating:
+                if record.price is not None:
+                    if min_price is not None and record.price < min_price:
+                        continue
+                    if max_price is not None and record.price > max_price:
+                        continue
+                matches.append(record)
+                if len(matches) >= limit:
+                    break
+            return matches
+
+        # Unpriced places are already in rating order, so only the first `limit` can make the cut
+        unpriced = self.unpriced_ranks[:limit]
+        if limit > self.RANKED_BLOCK_SIZE:
+            ranks = heapq.nsmallest(limit, chain(islice(self.price_ranks, lo, hi), unpriced))
+            return [self.by_rating[rank] for rank in ranks]
+
+        size = self.RANKED_BLOCK_SIZE
+        first_block, last_block = -(-lo // size), hi // size
+        if first_block >= last_block:
+            runs = [sorted(self.price_ranks[lo:hi])]
+        else:
+            runs = [sorted(self.price_ranks[lo:first_block * size]), sorted(self.price_ranks[last_block * size:hi])]
+            left, right = first_block + self.block_count, last_block + self.block_count
+            while left < right:
+                if left & 1:
+                    runs.append(self.ranked_blocks[left])
+                    left += 1
+                if right & 1:
+                    right -= 1
+                    runs.append(self.ranked_blocks[right])
+                left >>= 1
+                right >>= 1
+        runs.append(unpriced)
+        return [self.by_rating[rank] for rank in islice(heapq.merge(*runs), limit)]
+
+
+class AccommodationIndex:
+    """Price/rating groups for every combination of area and accommodation type filters"""
+
+    def __init__(self, records):
+        groups = {}
+        for record in records:
+            # A set, as a record with no area or type would otherwise land in the same group twice
+            for key in {(record.area, record.acc_type), (record.area, None), (None, record.acc_type), (None, None)}:
+                groups.setdefault(key, []).append(record)
+        self.groups = {key: PriceRankedGroup(group) for key, group in groups.items()}
+
+    def query(self, area=None, acc_type=None, min_price=None, max_price=None, limit=5):
+        group = self.groups.get((area, acc_type))
+        if group is None:
+            return []
+        return group.top_rated(min_price, max_price, limit)
+
+
+class OutfitIndex:
+    """Ready-made outfit results keyed by (canonical event type, gender), unisex looks merged in"""
+
+    def __init__(self, records, limit=5):
+        by_type = {}
+        for record in records:
+            by_type.setdefault(record.event_type, []).append(record)
+
+        self.table = {}
+        for event_type, outfits in by_type.items():
+            self.table[(event_type, None)] = [outfit.data for outfit in outfits[:limit]]
+            # Every gender seen in the sheet, plus unisex which is what any other gender resolves to
+            for gender in {outfit.gender for outfit in outfits} | {'unisex'}:
+                matches = [outfit for outfit in outfits if outfit.gender == gender or outfit.gender == 'unisex']
+                self.table[(event_type, gender)] = [outfit.data for outfit in matches[:limit]]
+
+    def lookup(self, event_type, gender=None):
+        results = self.table.get((event_type, gender))
+        if results is None and gender is not None:
+            # A gender with no looks of its own for this event type only gets the unisex ones
+            results = self.table.get((event_type, 'unisex'))
+        return [dict(outfit) for outfit in results] if results else []
+
+
+class SheetSnapshot:
+    """Last successfully loaded copy of a sheet: raw rows, typed records and their indexes"""
+
+    def __init__(self, rows, records, index=None, loaded_at=None, source='sheets'):
+        self.rows = rows
+        self.records = records
+        self.index = index
+        self.loaded_at = loaded_at if loaded_at is not None else time.monotonic()
+        self.source = source
+
+    def age(self):
+        return time.monotonic() - self.loaded_at
+
+    def is_stale(self, ttl_seconds):
+        return self.age() >= ttl_seconds
+
+
+# Parsed fields kept as fixed-width columns next to the cells, so a mapped snapshot
+# never re-parses dates, prices or aliases. 'I' columns hold interned value ids.
+_SNAPSHOT_COLUMNS = {
+    'events': (('day', 'i'), ('area', 'I'), ('event_type', 'I')),
+    'accommodations': (('area', 'I'), ('acc_type', 'I'), ('price', 'd'), ('rating', 'd')),
+    'outfits': (('event_type', 'I'), ('gender', 'I')),
+}
+_SNAPSHOT_ALIGNMENT = 8
+_SNAPSHOT_PREAMBLE = struct.Struct('<6sHI')
+
+
+def _encode_snapshot_value(value):
+    """Encode a cell value as a type tag byte followed by its text"""
+    if value is None:
+        return b'n'
+    if isinstance(value, str):
+        return b's' + value.encode('utf-8')
+    if isinstance(value, bool):
+        raise TypeError(f"cannot store {type(value).__name__} in a snapshot")
+    if isinstance(value, int):
+        return b'i' + str(value).encode('ascii')
+    if isinstance(value, float):
+        return b'f' + repr(value).encode('ascii')
+    raise TypeError(f"cannot store {type(value).__name__} in a snapshot")
+
+
+def _snapshot_column_value(record, name, intern):
+    value = getattr(record, name)
+    if name == 'day':
+        return value.toordinal() if value else 0
+    if name == 'price':
+        return float('nan') if value is None else value
+    if name == 'rating':
+        return value
+    return intern(value)
+
+
+def write_snapshot_file(path, snapshots, date_parse_stats=None):
+    """Atomically write sheet snapshots to a read-only file that workers can memory-map.
+
+    Layout: magic bytes, a uint16 format version and a uint32 header length, then a
+    JSON header locating each section. Every distinct cell value is stored once in an
+    interned value table; each sheet is a fixed-width matrix of uint32 value ids plus
+    the fixed-width parsed columns in _SNAPSHOT_COLUMNS. Sections are 8-byte aligned.
+    The new file replaces the old one with a rename, so readers never see a partial file.
+    """
+    value_ids = {('n', None): 0}
+    encoded_values = [_encode_snapshot_value(None)]
+
+    def intern(value):
+        key = (type(value).__name__, value)
+        value_id = value_ids.get(key)
+        if value_id is None:
+            value_id = value_ids[key] = len(encoded_values)
+            encoded_values.append(_encode_snapshot_value(value))
+        return value_id
+
+    generation = time.time_ns()
+    header = {
+        'generation': generation,
+        'saved_at': datetime.now().isoformat(),
+        'date_parsing': date_parse_stats or {},
+        'sheets': {}
+    }
+    sections = []
+
+    for sheet_type, snapshot in snapshots.items():
+        rows = snapshot.rows
+        keys = list(rows[0].keys()) if len(rows) else []
+        cells = array('I', (intern(row.get(key, '')) for row in rows for key in keys))
+        columns = {}
+        for name, typecode in _SNAPSHOT_COLUMNS.get(sheet_type, ()):
+            columns[name] = typecode
+            sections.append((sheet_type, name, array(typecode, (
+                _snapshot_column_value(record, name, intern) for record in snapshot.records
+            ))))
+        sections.append((sheet_type, 'cells', cells))
+        header['sheets'][sheet_type] = {
+            'sheet_id': SHEET_CONFIG[sheet_type]['sheet_id'],
+            'gid': SHEET_CONFIG[sheet_type]['gid'],
+            'keys': keys,
+            'rows': len(rows),
+            'columns': columns,
+            'sections': {}
+        }
+
+    value_offsets = array('I', [0])
+    for encoded in encoded_values:
+        value_offsets.append(value_offsets[-1] + len(encoded))
+    value_blob = b''.join(encoded_values)
+
+    # Section offsets depend on the header length, so lay the sections out relative to
+    # the end of the header first, then shift them once the header size is known
+    layout = []
+    position = 0
+    for name, data in [('value_offsets', value_offsets.tobytes()), ('value_blob', value_blob)] + [
+        ((sheet_type, column), section.tobytes()) for sheet_type, column, section in sections
+    ]:
+        layout.append((name, position, data))
+        position += len(data) + (-len(data)) % _SNAPSHOT_ALIGNMENT
+
+    header['value_count'] = len(encoded_values)
+    header_length = 0
+    while True:
+        base = _SNAPSHOT_PREAMBLE.size + header_length
+        base += (-base) % _SNAPSHOT_ALIGNMENT
+        for name, offset, data in layout:
+            if isinstance(name, tuple):
+                header['sheets'][name[0]]['sections'][name[1]] = [base + offset, len(data)]
+            else:
+                header[name] = [base + offset, len(data)]
+        encoded_header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        if len(encoded_header) == header_length:
+            break
+        header_length = len(encoded_header)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('wb', dir=directory, prefix='.snapshot-', delete=False) as temp_file:
+        temp_file.write(_SNAPSHOT_PREAMBLE.pack(SNAPSHOT_FILE_MAGIC, SNAPSHOT_FORMAT_VERSION, header_length))
+        temp_file.write(encoded_header)
+        temp_file.write(b'\0' * (base - _SNAPSHOT_PREAMBLE.size - header_length))
+        for name, offset, data in layout:
+            temp_file.write(data)
+            temp_file.write(b'\0' * ((-len(data)) % _SNAPSHOT_ALIGNMENT))
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.chmod(temp_file.name, 0o644)
+    os.replace(temp_file.name, path)
+    return generation
+
+
+def read_snapshot_header(path):
+    """Read only the JSON header of a snapshot file. Raises ValueError for unreadable files."""
+    with open(path, 'rb') as snapshot_file:
+        preamble = snapshot_file.read(_SNAPSHOT_PREAMBLE.size)
+        if len(preamble) < _SNAPSHOT_PREAMBLE.size:
+            raise ValueError("not a sheet snapshot file")
+        magic, version, header_length = _SNAPSHOT_PREAMBLE.unpack(preamble)
+        if magic != SNAPSHOT_FILE_MAGIC:
+            raise ValueError("not a sheet snapshot file")
+        if version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format version {version}")
+        try:
+            return json.loads(snapshot_file.read(header_length).decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"corrupt snapshot file: {e}")
+
+
+class SnapshotValues:
+    """The interned value table of a mapped snapshot, decoded on access"""
+    __slots__ = ('offsets', 'blob', '_keys')
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        # Index keys (areas, types, genders) repeat on every row, so decode each once
+        self._keys = {0: None}
+
+    def get(self, value_id):
+        start, end = self.offsets[value_id], self.offsets[value_id + 1]
+        tag = self.blob[start]
+        if tag == 0x73:  # 's'
+            return str(self.blob[start + 1:end], 'utf-8')
+        if tag == 0x69:  # 'i'
+            return int(bytes(self.blob[start + 1:end]))
+        if tag == 0x66:  # 'f'
+            return float(bytes(self.blob[start + 1:end]))
+        return None
+
+    def key(self, value_id):
+        value = self._keys.get(value_id, _UNPARSED)
+        if value is _UNPARSED:
+            value = self._keys[value_id] = self.get(value_id)
+        return value
+
+
+class MappedRow(Mapping):
+    """Read-only view of one row of a mapped sheet; cells are decoded when read"""
+    __slots__ = ('sheet', 'position')
+
+    def __init__(self, sheet, position):
+        self.sheet = sheet
+        self.position = position
+
+    def __getitem__(self, key):
+        sheet = self.sheet
+        return sheet.values.get(sheet.cells[self.position * sheet.width + sheet.key_columns[key]])
+
+    def __iter__(self):
+        return iter(self.sheet.keys)
+
+    def __len__(self):
+        return self.sheet.width
+
+
+class MappedSheet(Sequence):
+    """A sheet's rows inside a mapped snapshot file. Indexing returns plain dicts."""
+
+    def __init__(self, snapshot_file, sheet_type, header):
+        self.sheet_type = sheet_type
+        self.values = snapshot_file.values
+        self.keys = header['keys']
+        self.key_columns = {key: column for column, key in enumerate(self.keys)}
+        self.width = len(self.keys)
+        self.length = header['rows']
+        self.cells = snapshot_file.section(header['sections']['cells'], 'I')
+        self.columns = {
+            name: snapshot_file.section(header['sections'][name], typecode)
+            for name, typecode in header['columns'].items()
+        }
+
+    def row(self, position):
+        return MappedRow(self, position)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [dict(MappedRow(self, i)) for i in range(*position.indices(self.length))]
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('row index out of range')
+        return dict(MappedRow(self, position))
+
+    def __len__(self):
+        return self.length
+
+
+class SnapshotFile:
+    """A snapshot file memory-mapped read-only. Sheets read straight from the mapping, so
+    every worker process on the host shares the pages of cell values and parsed columns.
+    The records and indexes built over them are each process's own."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        if len(self._view) < _SNAPSHOT_PREAMBLE.size:
+            raise ValueError("not a sheet snapshot file")
+        magic, version, header_length = _SNAPSHOT_PREAMBLE.unpack_from(self._view)
+        if magic != SNAPSHOT_FILE_MAGIC:
+            raise ValueError("not a sheet snapshot file")
+        if version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot format version {version}")
+        start = _SNAPSHOT_PREAMBLE.size
+        try:
+            header = json.loads(str(self._view[start:start + header_length], 'utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"corrupt snapshot file: {e}")
+
+        self.generation = header['generation']
+        self.saved_at = header.get('saved_at')
+        self.date_parsing = header.get('date_parsing', {})
+        self.values = SnapshotValues(self.section(header['value_offsets'], 'I'), self.section(header['value_blob']))
+
+        self.sheets = {}
+        for sheet_type, sheet in header.get('sheets', {}).items():
+            config = SHEET_CONFIG.get(sheet_type)
+            if not config or config['sheet_id'] != sheet.get('sheet_id') or config['gid'] != sheet.get('gid'):
+                continue
+            self.sheets[sheet_type] = MappedSheet(self, sheet_type, sheet)
+
+    def section(self, location, typecode=None):
+        offset, length = location
+        if offset + length > len(self._view):
+            raise ValueError("truncated snapshot file")
+        section = self._view[offset:offset + length]
+        return section.cast(typecode) if typecode else section
+
+    def age(self):
+        """Seconds since the file was written"""
+        return max(0.0, time.time() - self.generation / 1e9)
+
+
+def read_snapshot_file(path):
+    """Map a snapshot file written by write_snapshot_file. Raises ValueError for unreadable files."""
+    return SnapshotFile(path)
 
 
 class GoogleSheetsDataStore:
-    def __init__(self):
-        self.gc = None
-        self._initialize_sheets_client()
+    def __init__(self, cache_ttl=SHEET_CACHE_TTL_SECONDS, client=None, snapshot_path=SHEET_SNAPSHOT_PATH):
+        self.gc = client
+        self.cache_ttl = cache_ttl
+        self._snapshots = {}
+        self._refreshing = set()
+        self._last_refresh_failure = {}
+        self._refresh_deferred_until = {}
+        self._spreadsheets = {}
+        self._worksheet_titles = {}
+        self.refresh_stats = {'refreshes': 0, 'last_refresh_api_calls': 0, 'total_api_calls': 0}
+        self.date_parse_stats = {}
+        self._state_lock = threading.Lock()
+        self._load_locks = {sheet_id: threading.Lock() for sheet_id in SHEET_GROUPS}
+        self.snapshot_path = snapshot_path
+        self._persist_lock = threading.Lock()
+        # Generation of the snapshot file this process last mapped or wrote
+        self._file_generation = None
+        # The Sheets client is created on first fetch, not at import time
+        self._client_lock = threading.Lock()
+        self._client_failed_at = None
+        # Called with the sheet types of every snapshot stored, e.g. to pre-render responses
+        self._snapshot_listeners = []
+
+        # Serve the last saved snapshot straight away, then refresh it from Sheets
+        started = time.perf_counter()
+        loaded_sheet_ids = self._load_snapshot_file() if snapshot_path else set()
+        record_startup_timing('snapshot_file_ms', started)
+
+        for sheet_id in loaded_sheet_ids:
+            self._schedule_refresh(sheet_id)
     
     def _download_service_account_from_gcs(self):
         """Download service account key from Google Cloud Storage"""
@@ -152,6 +1639,8 @@ class GoogleSheetsDataStore:
             bucket_name = 'travel-assistant-demo'
             blob_name = 'service-account-key.json'
             
+            from google.cloud import storage
+
             storage_client = storage.Client()
             bucket = storage_client.bucket(bucket_name)
             blob = bucket.blob(blob_name)
@@ -159,16 +1648,20 @@ class GoogleSheetsDataStore:
             temp_file = tempfile.NamedTemporaryFile(mode='w+', suffix='.json', delete=False)
             blob.download_to_filename(temp_file.name)
             
-            logging.info(f"Successfully downloaded service account key from GCS: gs://{bucket_name}/{blob_name}")
+            logger.info("Successfully downloaded service account key from GCS: gs://%s/%s", bucket_name, blob_name)
             return temp_file.name
             
         except Exception as e:
-            logging.error(f"Failed to download service account key from GCS: {e}")
+            logger.error("Failed to download service account key from GCS: %s", e)
             return None
     
     def _initialize_sheets_client(self):
         """Initialize Google Sheets client with service account credentials"""
+        started = time.perf_counter()
         try:
+            import gspread
+            from google.oauth2.service_account import Credentials
+
             creds = None
             temp_file_path = None
             
@@ -176,7 +1669,7 @@ class GoogleSheetsDataStore:
             temp_file_path = self._download_service_account_from_gcs()
             if temp_file_path and os.path.exists(temp_file_path):
                 creds = Credentials.from_service_account_file(temp_file_path, scopes=SCOPES)
-                logging.info("Loaded credentials from GCS")
+                logger.info("Loaded credentials from GCS")
                 
                 try:
                     os.unlink(temp_file_path)
@@ -188,7 +1681,7 @@ class GoogleSheetsDataStore:
                 creds_file = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'service-account-key.json')
                 if os.path.exists(creds_file):
                     creds = Credentials.from_service_account_file(creds_file, scopes=SCOPES)
-                    logging.info("Loaded credentials from local file")
+                    logger.info("Loaded credentials from local file")
             
             # Method 3: Try environment variables (fallback)
             if not creds:
@@ -196,132 +1689,596 @@ class GoogleSheetsDataStore:
                 if creds_json:
                     creds_info = json.loads(creds_json)
                     creds = Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-                    logging.info("Loaded credentials from environment variables")
+                    logger.info("Loaded credentials from environment variables")
             
             if not creds:
                 raise Exception("No Google Service Account credentials found")
             
             self.gc = gspread.authorize(creds)
-            logging.info("Google Sheets client initialized successfully")
+            logger.info("Google Sheets client initialized successfully")
             
         except Exception as e:
-            logging.error(f"Failed to initialize Google Sheets client: {e}")
+            logger.error("Failed to initialize Google Sheets client: %s", e)
             self.gc = None
+
+        finally:
+            record_startup_timing('sheets_client_ms', started)
+
+    def _ensure_client(self):
+        """Create the Sheets client on first use, retrying a failed attempt after a back-off"""
+        if self.gc is not None:
+            return True
+
+        with self._client_lock:
+            if self.gc is None:
+                failed_at = self._client_failed_at
+                if failed_at is not None and time.monotonic() - failed_at < SHEET_REFRESH_RETRY_SECONDS:
+                    return False
+                self._initialize_sheets_client()
+                self._client_failed_at = None if self.gc is not None else time.monotonic()
+        return self.gc is not None
+
+    def warm_up(self):
+        """Create the Sheets client and load every sheet that has no snapshot yet"""
+        started = time.perf_counter()
+        self._ensure_client()
+        for sheet_types in SHEET_GROUPS.values():
+            self._get_snapshot(sheet_types[0])
+        record_startup_timing('sheets_warmup_ms', started)
+
+    def is_ready(self):
+        """True once every configured sheet has a snapshot to serve"""
+        return all(sheet_type in self._snapshots for sheet_type in SHEET_CONFIG)
+
+    def preload(self, timeout=60):
+        """Load every spreadsheet synchronously before worker processes are forked.
+
+        Waits for background refreshes started from the snapshot file, then loads any
+        spreadsheet that is still missing or only served from the file. Data that
+        cannot be refreshed keeps being served from the file.
+        """
+        deadline = time.monotonic() + timeout
+        while self._refreshing and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        fetched = {}
+        for sheet_id, sheet_types in SHEET_GROUPS.items():
+            snapshot = self._snapshots.get(sheet_types[0])
+            if snapshot is not None and snapshot.source == 'sheets':
+                continue
+            with self._load_locks[sheet_id]:
+                sheets = self._fetch_spreadsheet(sheet_id)
+            if sheets is not None:
+                fetched.update(sheets)
+
+        if fetched:
+            self._publish_snapshots(fetched)
+
+    def prepare_fork(self):
+        """Close pooled HTTP connections so forked workers never share a socket"""
+        session = getattr(self.gc, 'session', None)
+        if session is not None:
+            session.close()
+
+    def after_fork(self):
+        """Reset per-process state in a freshly forked worker.
+
+        Locks may have been held, and refresh threads running, in the parent at
+        fork time; neither survives into the child.
+        """
+        self._state_lock = threading.Lock()
+        self._load_locks = {sheet_id: threading.Lock() for sheet_id in SHEET_GROUPS}
+        self._persist_lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_deferred_until = {}
     
+    def _get_snapshot(self, sheet_type):
+        """Get the snapshot for a sheet from the cache.
+
+        Only the very first load blocks on Google Sheets. Once a snapshot exists it
+        is always served immediately; if it is older than the TTL a background
+        refresh is started and readers keep getting the last good snapshot.
+        Returns None if the sheet could not be loaded.
+        """
+        snapshot = self._snapshots.get(sheet_type)
+        if snapshot is None:
+            return self._load_snapshot(sheet_type)
+
+        if snapshot.is_stale(self.cache_ttl):
+            self._schedule_refresh(SHEET_CONFIG[sheet_type]['sheet_id'])
+
+        return snapshot
+
     def _get_sheet_data(self, sheet_type):
-        """Get data from a specific Google Sheet"""
-        if not self.gc:
-            logging.error("Google Sheets client not initialized")
-            return []
-        
+        """Get the raw row dicts of a sheet: a list, or a MappedSheet when read from the snapshot file"""
+        snapshot = self._get_snapshot(sheet_type)
+        return snapshot.rows if snapshot else []
+
+    def _load_snapshot(self, sheet_type):
+        """Synchronously load a sheet that has no snapshot yet (cold start)"""
+        sheet_id = SHEET_CONFIG[sheet_type]['sheet_id']
+        with self._load_locks[sheet_id]:
+            # Another request may have finished the load while we were waiting
+            snapshot = self._snapshots.get(sheet_type)
+            if snapshot is not None:
+                return snapshot
+
+            sheets = self._fetch_spreadsheet(sheet_id)
+            if sheets is None:
+                return None
+
+            self._store_snapshots(sheets)
+            if self.snapshot_path:
+                # Keep the request path free of disk writes
+                threading.Thread(target=self.save_snapshot_file, name='sheet-snapshot-save', daemon=True).start()
+            return self._snapshots[sheet_type]
+
+    def _store_snapshots(self, sheets, source='sheets'):
+        self._serve_snapshots(self._build_snapshots(sheets, source))
+
+    def _build_snapshots(self, sheets, source='sheets'):
+        """Build the records of fetched sheets, leaving the indexes to _serve_snapshots"""
+        loaded_at = time.monotonic()
+        return {sheet_type: SheetSnapshot(rows, self._build_records(sheet_type, rows), None, loaded_at, source)
+                for sheet_type, rows in sheets.items()}
+
+    def _serve_snapshots(self, snapshots):
+        for sheet_type, snapshot in snapshots.items():
+            snapshot.index = self._build_index(sheet_type, snapshot.records)
+            self._snapshots[sheet_type] = snapshot
+        self._notify_snapshot_listeners(list(snapshots))
+
+    def _publish_snapshots(self, sheets):
+        """Serve freshly fetched sheets, through the shared snapshot file when there is one.
+
+        The file is written first and then mapped like in every other worker, so the
+        indexes and snapshot listeners run once per refresh. If the file cannot be
+        written or mapped the new snapshots are served from memory.
+        """
+        snapshots = self._build_snapshots(sheets)
+        if self.snapshot_path:
+            with self._persist_lock:
+                if (self._write_snapshot_file(self.snapshot_path, dict(self._snapshots, **snapshots))
+                        and self._adopt_snapshot_file(source='sheets')):
+                    return
+        self._serve_snapshots(snapshots)
+
+    def _store_mapped_snapshots(self, snapshot_file, source='file'):
+        """Serve every sheet of a mapped snapshot file, building this process's records and
+        indexes from its parsed columns"""
+        # Keep staleness relative to when the file was written, not when it was mapped
+        loaded_at = time.monotonic() - snapshot_file.age()
+        for sheet_type, sheet in snapshot_file.sheets.items():
+            records = self._build_mapped_records(sheet_type, sheet)
+            index = self._build_index(sheet_type, records)
+            self._snapshots[sheet_type] = SheetSnapshot(sheet, records, index, loaded_at, source)
+            if sheet_type in snapshot_file.date_parsing:
+                self.date_parse_stats[sheet_type] = snapshot_file.date_parsing[sheet_type]
+        self._file_generation = snapshot_file.generation
+        self._notify_snapshot_listeners(list(snapshot_file.sheets))
+
+    def add_snapshot_listener(self, callback):
+        """Call `callback(sheet_types)` after new snapshots are stored, and once now for those already loaded"""
+        self._snapshot_listeners.append(callback)
+        if self._snapshots:
+            self._notify_snapshot_listeners(list(self._snapshots), [callback])
+
+    def _notify_snapshot_listeners(self, sheet_types, listeners=None):
+        for callback in listeners or self._snapshot_listeners:
+            try:
+                callback(sheet_types)
+            except Exception as e:
+                logger.error("Snapshot listener failed for %s: %s", ', '.join(sheet_types), e)
+
+    def _load_snapshot_file(self):
+        """Load snapshots saved by a previous run or baked into the image.
+
+        Returns the ids of the spreadsheets that were loaded, so they can be
+        refreshed from Google Sheets in the background.
+        """
+        if not os.path.exists(self.snapshot_path):
+            logger.info("No local sheet snapshot at %s, first request will load from Sheets", self.snapshot_path)
+            return set()
+
+        try:
+            snapshot_file = read_snapshot_file(self.snapshot_path)
+            self._store_mapped_snapshots(snapshot_file)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable sheet snapshot %s: %s", self.snapshot_path, e)
+            return set()
+
+        sheets = snapshot_file.sheets
+        logger.info("Loaded %s sheets from local snapshot saved at %s", ', '.join(sheets) or 'no', snapshot_file.saved_at)
+        return {SHEET_CONFIG[sheet_type]['sheet_id'] for sheet_type in sheets}
+
+    def _adopt_snapshot_file(self, max_age=None, source='file'):
+        """Switch to the shared snapshot file if another process has written a newer one.
+
+        Returns True if a newer snapshot, no older than `max_age` seconds, was mapped.
+        """
+        try:
+            header = read_snapshot_header(self.snapshot_path)
+            if header['generation'] == self._file_generation:
+                return False
+            if max_age is not None and time.time() - header['generation'] / 1e9 >= max_age:
+                return False
+            snapshot_file = read_snapshot_file(self.snapshot_path)
+            self._store_mapped_snapshots(snapshot_file, source)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not map shared sheet snapshot %s: %s", self.snapshot_path, e)
+            return False
+
+        logger.info("Mapped %s sheets from shared snapshot saved at %s", ', '.join(snapshot_file.sheets), snapshot_file.saved_at)
+        return True
+
+    def _acquire_refresh_lock(self):
+        """Try to become the one process refreshing the shared snapshot.
+
+        Returns a file descriptor to release with os.close, or None if another
+        process on this host is already refreshing. Raises OSError if the lock
+        file cannot be created or locked.
+        """
+        lock_fd = os.open(f"{self.snapshot_path}.lock", os.O_CREAT | os.O_RDWR, 0o644)
+        if fcntl is None:
+            return lock_fd
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            return None
+        except OSError:
+            os.close(lock_fd)
+            raise
+        return lock_fd
+
+    def save_snapshot_file(self, path=None):
+        """Write the current snapshots to disk, returning True on success.
+
+        Saving to the shared snapshot path also maps the new file, so this process
+        drops its row dicts and reads from the same pages as every other worker.
+        """
+        path = path or self.snapshot_path
+        if not path:
+            return False
+
+        snapshots = dict(self._snapshots)
+        with self._persist_lock:
+            if not self._write_snapshot_file(path, snapshots):
+                return False
+            if path == self.snapshot_path:
+                sources = {snapshot.source for snapshot in snapshots.values()}
+                self._adopt_snapshot_file(source='sheets' if 'sheets' in sources else 'file')
+        return True
+
+    def _write_snapshot_file(self, path, snapshots):
+        date_parse_stats = {sheet_type: self.date_parse_stats[sheet_type]
+                            for sheet_type in snapshots if sheet_type in self.date_parse_stats}
+        try:
+            write_snapshot_file(path, snapshots, date_parse_stats)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Failed to save local sheet snapshot %s: %s", path, e)
+            return False
+        logger.info("Saved %s sheets to local snapshot %s", ', '.join(snapshots), path)
+        return True
+
+    def refresh_all(self):
+        """Synchronously load every configured spreadsheet, returning True if all succeeded"""
+        succeeded = True
+        for sheet_id in SHEET_GROUPS:
+            with self._load_locks[sheet_id]:
+                sheets = self._fetch_spreadsheet(sheet_id)
+            if sheets is None:
+                succeeded = False
+                continue
+            self._store_snapshots(sheets)
+        return succeeded
+
+    def _schedule_refresh(self, sheet_id):
+        """Start a background refresh for a stale spreadsheet unless one is already running"""
+        with self._state_lock:
+            if sheet_id in self._refreshing:
+                return
+
+            last_failure = self._last_refresh_failure.get(sheet_id)
+            if last_failure is not None and time.monotonic() - last_failure < SHEET_REFRESH_RETRY_SECONDS:
+                return
+            if time.monotonic() < self._refresh_deferred_until.get(sheet_id, 0):
+                return
+
+            self._refreshing.add(sheet_id)
+
+        thread = threading.Thread(
+            target=self._refresh_snapshot,
+            args=(sheet_id,),
+            name=f"sheet-refresh-{sheet_id[:8]}",
+            daemon=True
+        )
+        thread.start()
+
+    def _refresh_snapshot(self, sheet_id):
+        """Reload a spreadsheet and swap in new snapshots, keeping the old ones on failure.
+
+        With a shared snapshot file only one process on the host fetches from Sheets;
+        the others map the file it writes.
+        """
+        lock_fd = None
+        try:
+            if self.snapshot_path:
+                if self._adopt_snapshot_file(max_age=self.cache_ttl):
+                    return
+                try:
+                    lock_fd = self._acquire_refresh_lock()
+                except OSError as e:
+                    # A read-only or full volume; refreshing in every process beats never refreshing
+                    logger.warning("Could not lock shared sheet snapshot %s, refreshing without the lock: %s",
+                                   self.snapshot_path, e)
+                else:
+                    if lock_fd is None:
+                        with self._state_lock:
+                            self._refresh_deferred_until[sheet_id] = time.monotonic() + SHARED_SNAPSHOT_POLL_SECONDS
+                        return
+                    # The holder of the lock may have finished just before we took it
+                    if self._adopt_snapshot_file(max_age=self.cache_ttl):
+                        return
+
+            with self._load_locks[sheet_id]:
+                sheets = self._fetch_spreadsheet(sheet_id)
+
+            if sheets is None:
+                logger.warning("Refresh of spreadsheet %s failed, serving stale snapshots", sheet_id)
+                with self._state_lock:
+                    self._last_refresh_failure[sheet_id] = time.monotonic()
+                return
+
+            self._publish_snapshots(sheets)
+            with self._state_lock:
+                self._last_refresh_failure.pop(sheet_id, None)
+            logger.info("Refreshed %s snapshots in the background", ', '.join(sheets))
+
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+            with self._state_lock:
+                self._refreshing.discard(sheet_id)
+
+    def get_cache_status(self):
+        """Summarize the snapshot cache for health and debug endpoints"""
+        status = {}
+        for sheet_type, config in SHEET_CONFIG.items():
+            snapshot = self._snapshots.get(sheet_type)
+            status[sheet_type] = {
+                'loaded': snapshot is not None,
+                'records': len(snapshot.records) if snapshot else 0,
+                'age_seconds': round(snapshot.age(), 1) if snapshot else None,
+                'stale': snapshot.is_stale(self.cache_ttl) if snapshot else None,
+                'source': snapshot.source if snapshot else None,
+                'refreshing': config['sheet_id'] in self._refreshing
+            }
+            if sheet_type in self.date_parse_stats:
+                status[sheet_type]['date_parsing'] = self.date_parse_stats[sheet_type]
+        return status
+
+    def get_refresh_stats(self):
+        """Sheets API call counts for the most recent and all refreshes"""
+        return dict(self.refresh_stats)
+
+    @timed('sheets_fetch')
+    def _fetch_spreadsheet(self, sheet_id):
+        """Fetch every configured worksheet of a spreadsheet in one batched values request.
+
+        The opened spreadsheet handle and its gid -> title map are kept between
+        refreshes, so a steady-state refresh costs a single values:batchGet call.
+        Returns a dict of sheet_type -> records, or None on failure.
+        """
+        if not self._ensure_client():
+            logger.error("Google Sheets client not initialized")
+            return None
+
+        from gspread.utils import absolute_range_name
+
+        sheet_types = SHEET_GROUPS[sheet_id]
+        api_calls = 0
+
         try:
-            config = SHEET_CONFIG[sheet_type]
-            sheet_id = config['sheet_id']
-            gid = config['gid']
-            
-            spreadsheet = self.gc.open_by_key(sheet_id)
-            worksheet = spreadsheet.get_worksheet_by_id(int(gid))
-            
-            records = worksheet.get_all_records()
-            
-            # Normalize keys
-            normalized_records = []
-            for record in records:
-                normalized_record = {}
-                for key, value in record.items():
-                    normalized_key = key.lower().replace(' ', '_').replace('-', '_')
-                    normalized_record[normalized_key] = value
-                normalized_records.append(normalized_record)
-            
-            logging.info(f"Successfully loaded {len(normalized_records)} records from {sheet_type} sheet")
-            return normalized_records
-            
+            spreadsheet = self._spreadsheets.get(sheet_id)
+            if spreadsheet is None:
+                spreadsheet = self.gc.open_by_key(sheet_id)
+                api_calls += 1
+                self._spreadsheets[sheet_id] = spreadsheet
+
+            titles = self._worksheet_titles.get(sheet_id)
+            if titles is None:
+                metadata = spreadsheet.fetch_sheet_metadata({'fields': 'sheets.properties(sheetId,title)'})
+                api_calls += 1
+                titles = {
+                    str(sheet['properties']['sheetId']): sheet['properties']['title']
+                    for sheet in metadata.get('sheets', [])
+                }
+                self._worksheet_titles[sheet_id] = titles
+
+            ranges = [absolute_range_name(titles[SHEET_CONFIG[sheet_type]['gid']]) for sheet_type in sheet_types]
+            response = spreadsheet.values_batch_get(ranges)
+            api_calls += 1
+
+            value_ranges = response.get('valueRanges', [])
+            sheets = {}
+            for sheet_type, value_range in zip(sheet_types, value_ranges):
+                sheets[sheet_type] = self._rows_to_records(value_range.get('values', []))
+                logger.info("Successfully loaded %s records from %s sheet", len(sheets[sheet_type]), sheet_type)
+
+            return sheets
+
         except Exception as e:
-            logging.error(f"Error loading {sheet_type} data from Google Sheets: {e}")
+            # Worksheets may have been renamed or removed, so look the titles up again next time
+            self._worksheet_titles.pop(sheet_id, None)
+            logger.error("Error loading %s data from Google Sheets: %s", ', '.join(sheet_types), e)
+            return None
+
+        finally:
+            self.refresh_stats['refreshes'] += 1
+            self.refresh_stats['last_refresh_api_calls'] = api_calls
+            self.refresh_stats['total_api_calls'] += api_calls
+            logger.info("Spreadsheet %s refresh made %s Sheets API call(s)", sheet_id, api_calls)
+
+    @staticmethod
+    def _rows_to_records(values):
+        """Turn raw worksheet values into dicts keyed by normalized header, like get_all_records"""
+        if not values:
             return []
+
+        from gspread.utils import numericise_all
+
+        # Normalize keys once per sheet rather than once per record
+        keys = [str(header).lower().replace(' ', '_').replace('-', '_') for header in values[0]]
+        width = len(keys)
+
+        records = []
+        for row in values[1:]:
+            row = list(row[:width]) + [''] * (width - len(row))
+            records.append(dict(zip(keys, numericise_all(row))))
+        return records
     
+    @timed('normalize')
+    def _build_records(self, sheet_type, rows):
+        """Parse raw rows into typed records so queries never re-parse strings"""
+        if sheet_type == 'events':
+            date_parser = DateColumnParser.learn(row.get('date') for row in rows)
+            records = [
+                EventRecord(
+                    row,
+                    position,
+                    date_parser.parse(row.get('date')),
+                    self._normalize_area_value(row.get('area')),
+                    self._normalize_event_type(row.get('event_type'))
+                )
+                for position, row in enumerate(rows)
+            ]
+            self.date_parse_stats[sheet_type] = {
+                'dominant_format': date_parser.dominant_format,
+                'unparseable': date_parser.failures,
+                'unparseable_samples': date_parser.failed_samples
+            }
+            if date_parser.failures:
+                logger.warning("%s of %s %s rows have unparseable dates and will be skipped, e.g. %s", date_parser.failures, len(rows), sheet_type, date_parser.failed_samples)
+            return records
+
+        if sheet_type == 'accommodations':
+            return [
+                AccommodationRecord(
+                    row,
+                    position,
+                    self._normalize_area_value(row.get('area')),
+                    str(row.get('type', '')).lower().strip(),
+                    self._parse_price(row.get('price_per_night', '0')),
+                    self._parse_rating(row.get('rating', '0'))
+                )
+                for position, row in enumerate(rows)
+            ]
+
+        if sheet_type == 'outfits':
+            return [
+                OutfitRecord(
+                    row,
+                    position,
+                    self._normalize_event_type(row.get('event_type')),
+                    str(row.get('gender', '')).lower().strip()
+                )
+                for position, row in enumerate(rows)
+            ]
+
+        return []
+
+    @timed('normalize')
+    def _build_mapped_records(self, sheet_type, sheet):
+        """Build typed records from a mapped sheet's parsed columns without touching its cells"""
+        columns = sheet.columns
+        key = sheet.values.key
+        if sheet_type == 'events':
+            # Events share one datetime per distinct day
+            days = {day: datetime.fromordinal(day) for day in set(columns['day']) if day}
+            return [
+                EventRecord(
+                    sheet.row(position),
+                    position,
+                    days.get(day),
+                    key(area),
+                    key(event_type)
+                )
+                for position, (day, area, event_type)
+                in enumerate(zip(columns['day'], columns['area'], columns['event_type']))
+            ]
+
+        if sheet_type == 'accommodations':
+            return [
+                AccommodationRecord(
+                    sheet.row(position),
+                    position,
+                    key(area),
+                    key(acc_type),
+                    None if price != price else price,
+                    rating
+                )
+                for position, (area, acc_type, price, rating)
+                in enumerate(zip(columns['area'], columns['acc_type'], columns['price'], columns['rating']))
+            ]
+
+        if sheet_type == 'outfits':
+            return [
+                OutfitRecord(sheet.row(position), position, key(event_type), key(gender))
+                for position, (event_type, gender) in enumerate(zip(columns['event_type'], columns['gender']))
+            ]
+
+        return []
+
+    @staticmethod
+    @timed('index')
+    def _build_index(sheet_type, records):
+        """Build the query indexes for a freshly loaded sheet"""
+        if sheet_type == 'events':
+            return EventIndex(records)
+        if sheet_type == 'accommodations':
+            return AccommodationIndex(records)
+        if sheet_type == 'outfits':
+            return OutfitIndex(records)
+        return None
+
+    @staticmethod
+    def _parse_price(price_value):
+        """Extract the numeric nightly price, or None if the cell has no number"""
+        price_str = str(price_value).replace(',', '').replace('₦', '').replace('NGN', '').strip()
+        price_match = re.search(r'(\d+(?:\.\d+)?)', price_str)
+        return float(price_match.group(1)) if price_match else None
+
+    @staticmethod
+    def _parse_rating(rating_value):
+        """Extract the numeric rating, defaulting to 0.0"""
+        rating_match = re.search(r'(\d+(?:\.\d+)?)', str(rating_value).strip())
+        return float(rating_match.group(1)) if rating_match else 0.0
+
     def _normalize_area_value(self, area_value):
         """Normalize area values for comparison"""
         if not area_value:
             return None
         
-        area_str = str(area_value).lower().strip()
-        
-        # Area mappings for flexible matching
-        area_mappings = {
-            'victoria_island': ['vi', 'victoria island', 'island', 'vic island', 'victoria_island'],
-            'lekki': ['lekki', 'lekki phase 1', 'phase 1', 'admiralty', 'lekki_phase_1'],
-            'ikeja': ['ikeja', 'mainland', 'gra', 'ikeja_gra'],
-            'ikoyi': ['ikoyi', 'old ikoyi', 'banana island', 'banana_island'],
-            'surulere': ['surulere', 'suru', 'national theatre area', 'national_theatre']
-        }
-        
-        # Check for direct matches first
-        for canonical, variations in area_mappings.items():
-            if area_str in variations or area_str == canonical:
-                return canonical
-        
-        return area_str
+        return AREA_RESOLVER.resolve(str(area_value))
     
-    def _parse_date_from_string(self, date_str):
-        """Parse date string with multiple format support"""
-        if not date_str or str(date_str).lower().strip() in ['', 'tbd', 'n/a', 'none']:
-            return None
-        
-        date_str = str(date_str).strip()
-        
-        # Try different date formats
-        date_formats = [
-            '%Y-%m-%d',      # 2024-12-16
-            '%d/%m/%Y',      # 16/12/2024
-            '%m/%d/%Y',      # 12/16/2024
-            '%d-%m-%Y',      # 16-12-2024
-            '%Y/%m/%d',      # 2024/12/16
-            '%d %B %Y',      # 16 December 2024
-            '%B %d, %Y',     # December 16, 2024
-        ]
-        
-        for date_format in date_formats:
-            try:
-                return datetime.strptime(date_str, date_format)
-            except ValueError:
-                continue
-        
-        logging.debug(f"Could not parse date: {date_str}")
-        return None
-
     def _normalize_event_type(self, event_type_value):
         """Normalize event type values for flexible comparison."""
         if not event_type_value:
             return None
 
-        event_str = str(event_type_value).lower().strip().replace(' ', '_')
-
-        # Event type mappings
-        event_mappings = {
-            'concert': ['concert', 'music_show', 'show', 'live_music'],
-            'beach_party': ['beach_party', 'beach', 'pool_party'],
-            'club_night': ['club_night', 'club', 'party', 'turn_up'],
-            'brunch': ['brunch', 'day_party'],
-            'detty_december': ['detty_december', 'december_fest']
-        }
-
-        for canonical, variations in event_mappings.items():
-            if event_str in variations:
-                return canonical
-
-        return event_str
+        return EVENT_TYPE_RESOLVER.resolve(str(event_type_value))
         
+    @timed('filter_events')
     def get_events(self, filters=None, date_range=None):
         """Get events with improved filtering and date range support"""
-        events = self._get_sheet_data('events')
+        snapshot = self._get_snapshot('events')
         
-        if not events:
-            logging.warning("No events data found")
+        if not snapshot or not snapshot.records:
+            logger.warning("No events data found")
             return []
         
-        filtered_events = []
-        
         # Parse date range
         start_date, end_date = None, None
         if date_range:
@@ -329,178 +2286,74 @@ class GoogleSheetsDataStore:
         elif filters and filters.get('query_text'):
             start_date, end_date = DateRangeParser.parse_date_query(filters['query_text'])
         
-        logging.info(f"Filtering events with date range: {start_date} to {end_date}")
-        logging.info(f"Applied filters: {filters}")
+        logger.debug("Filtering events with date range: %s to %s", start_date, end_date)
+        logger.debug("Applied filters: %s", filters)
         
         # If no date range is specified, we want to return the first 5 events sorted by date
         # This means we don't apply any date filtering, just return the earliest events
+        start_day = start_date.date() if start_date and end_date else None
+        end_day = end_date.date() if start_date and end_date else None
+        filter_area = self._normalize_area_value(filters['area']) if filters and filters.get('area') else None
+        filter_type = self._normalize_event_type(filters['event_type']) if filters and filters.get('event_type') else None
         
-        for event in events:
-            try:
-                # Parse event date
-                event_date = self._parse_date_from_string(event.get('date'))
-                
-                if not event_date:
-                    logging.debug(f"Skipping event with unparseable date: {event.get('title', 'Unknown')}")
-                    continue
-                
-                # Apply date range filter (only if date range is specified)
-                if start_date and end_date:
-                    if not (start_date.date() <= event_date.date() <= end_date.date()):
-                        logging.debug(f"Date filter: {event_date.date()} not in range {start_date.date()} to {end_date.date()}")
-                        continue
-                
-                # Apply area filter
-                if filters and filters.get('area'):
-                    event_area = self._normalize_area_value(event.get('area'))
-                    filter_area = self._normalize_area_value(filters['area'])
-                    
-                    logging.debug(f"Comparing areas: event='{event.get('area')}' (normalized: '{event_area}') vs filter='{filters['area']}' (normalized: '{filter_area}')")
-                    
-                    if event_area != filter_area:
-                        logging.debug(f"Area filter mismatch: {event_area} != {filter_area}")
-                        continue
-                
-                # Apply event type filter
-                if filters and filters.get('event_type'):
-                    event_type = self._normalize_event_type(event.get('event_type'))
-                    filter_type = self._normalize_event_type(filters['event_type'])
-                    
-                    logging.debug(f"Comparing event types: event='{event.get('event_type')}' (normalized: '{event_type}') vs filter='{filters['event_type']}' (normalized: '{filter_type}')")
-                    
-                    if event_type != filter_type:
-                        logging.debug(f"Event type filter mismatch: {event_type} != {filter_type}")
-                        continue
-                
-                filtered_events.append(event)
-                
-            except Exception as e:
-                logging.debug(f"Error processing event: {e}")
-                continue
-        
-        # Sort by date
-        def get_sort_date(event):
-            event_date = self._parse_date_from_string(event.get('date'))
-            return event_date if event_date else datetime.min
-        
-        filtered_events.sort(key=get_sort_date)
+        # Events without a parseable date are never indexed, so never listed
+        events = snapshot.index.query(start_day, end_day, filter_area, filter_type, limit=5)  # Return top 5 instead of 3
         
-        logging.info(f"Found {len(filtered_events)} events after filtering")
-        return filtered_events[:5]  # Return top 5 instead of 3
+        logger.debug("Found %s events after filtering", len(events))
+        return [dict(event.data) for event in events]
     
+    @timed('filter_accommodations')
     def get_accommodations(self, filters=None):
         """Get accommodation options with improved filters"""
-        accommodations = self._get_sheet_data('accommodations')
+        snapshot = self._get_snapshot('accommodations')
         
-        if not accommodations:
-            logging.warning("No accommodations data found")
+        if not snapshot or not snapshot.records:
+            logger.warning("No accommodations data found")
             return []
         
-        filtered_accommodations = []
+        logger.debug("Filtering accommodations with filters: %s", filters)
         
-        logging.info(f"Filtering accommodations with filters: {filters}")
-        
-        for accommodation in accommodations:
-            try:
-                # Apply area filter
-                if filters and filters.get('area'):
-                    acc_area = self._normalize_area_value(accommodation.get('area'))
-                    filter_area = self._normalize_area_value(filters['area'])
-                    
-                    logging.debug(f"Comparing areas: acc='{accommodation.get('area')}' (normalized: '{acc_area}') vs filter='{filters['area']}' (normalized: '{filter_area}')")
-                    
-                    if acc_area != filter_area:
-                        logging.debug(f"Area filter mismatch: {acc_area} != {filter_area}")
-                        continue
-                
-                # Apply budget filter
-                if filters and filters.get('max_budget'):
-                    try:
-                        price_str = str(accommodation.get('price_per_night', '0')).replace(',', '').replace('₦', '').replace('NGN', '').strip()
-                        # Extract numeric value from price string
-                        price_match = re.search(r'(\d+(?:\.\d+)?)', price_str)
-                        if price_match:
-                            price = float(price_match.group(1))
-                            logging.debug(f"Comparing prices: {price} <= {filters['max_budget']}")
-                            if price > float(filters['max_budget']):
-                                logging.debug(f"Budget filter: {price} > {filters['max_budget']}")
-                                continue
-                        else:
-                            logging.debug(f"Could not parse price: {price_str}")
-                    except (ValueError, TypeError) as e:
-                        logging.debug(f"Error parsing price: {e}")
-                        continue
-                
-                # Apply accommodation type filter
-                if filters and filters.get('accommodation_type'):
-                    acc_type = str(accommodation.get('type', '')).lower().strip()
-                    filter_type = str(filters['accommodation_type']).lower().strip()
-                    
-                    logging.debug(f"Comparing types: acc='{accommodation.get('type')}' (normalized: '{acc_type}') vs filter='{filters['accommodation_type']}' (normalized: '{filter_type}')")
-                    
-                    if acc_type != filter_type:
-                        logging.debug(f"Type filter mismatch: {acc_type} != {filter_type}")
-                        continue
-                
-                filtered_accommodations.append(accommodation)
-                
-            except Exception as e:
-                logging.debug(f"Error processing accommodation: {e}")
-                continue
+        filter_area = self._normalize_area_value(filters['area']) if filters and filters.get('area') else None
+        filter_type = str(filters['accommodation_type']).lower().strip() if filters and filters.get('accommodation_type') else None
         
-        # Sort by rating (descending)
-        def get_rating(accommodation):
-            try:
-                rating_str = str(accommodation.get('rating', '0')).strip()
-                rating_match = re.search(r'(\d+(?:\.\d+)?)', rating_str)
-                return float(rating_match.group(1)) if rating_match else 0.0
-            except (ValueError, TypeError):
-                return 0.0
+        min_budget = self._parse_budget(filters, 'min_budget')
+        max_budget = self._parse_budget(filters, 'max_budget')
         
-        filtered_accommodations.sort(key=get_rating, reverse=True)
+        # Sorted by rating (descending)
+        accommodations = snapshot.index.query(filter_area, filter_type, min_budget, max_budget, limit=5)  # Return top 5
         
-        logging.info(f"Found {len(filtered_accommodations)} accommodations after filtering")
-        return filtered_accommodations[:5]  # Return top 5
+        logger.debug("Found %s accommodations after filtering", len(accommodations))
+        return [dict(accommodation.data) for accommodation in accommodations]
+    
+    @staticmethod
+    def _parse_budget(filters, key):
+        """Read a numeric budget bound from the filters, ignoring missing or invalid values"""
+        if not filters or not filters.get(key):
+            return None
+        try:
+            return float(filters[key])
+        except (ValueError, TypeError):
+            logger.warning("Ignoring invalid %s value: %s", key, filters[key])
+            return None
     
+    @timed('filter_outfits')
     def get_outfit_suggestions(self, event_type, gender=None):
         """Get outfit suggestions for specific event types"""
-        outfits = self._get_sheet_data('outfits')
+        snapshot = self._get_snapshot('outfits')
         
-        if not outfits:
-            logging.warning("No outfits data found")
+        if not snapshot or not snapshot.records:
+            logger.warning("No outfits data found")
             return []
         
-        filtered_outfits = []
         filter_event_type = self._normalize_event_type(event_type) # Normalize the input
+        filter_gender = str(gender).lower().strip() if gender else None
         
-        logging.info(f"Filtering outfits for event_type: {event_type} (normalized: {filter_event_type}), gender: {gender}")
+        logger.debug("Filtering outfits for event_type: %s (normalized: %s), gender: %s", event_type, filter_event_type, gender)
         
-        for outfit in outfits:
-            try:
-                # Filter by event type
-                outfit_event_type = self._normalize_event_type(outfit.get('event_type'))
-                
-                logging.debug(f"Comparing outfit event_type: {outfit.get('event_type')} (normalized: {outfit_event_type}) with filter: {filter_event_type}")
-                
-                if outfit_event_type != filter_event_type:
-                    continue
-                
-                # Filter by gender
-                outfit_gender = str(outfit.get('gender', '')).lower().strip()
-                
-                if gender:
-                    filter_gender = str(gender).lower().strip()
-                    if outfit_gender != filter_gender and outfit_gender != 'unisex':
-                        continue
-                
-                filtered_outfits.append(outfit)
-                
-            except Exception as e:
-                logging.debug(f"Error processing outfit: {e}")
-                continue
+        filtered_outfits = snapshot.index.lookup(filter_event_type, filter_gender)  # Up to 5 outfits
         
-        logging.info(f"Found {len(filtered_outfits)} outfits after filtering")
-        return filtered_outfits[:5]  # Return up to 5 outfits
+        logger.debug("Found %s outfits after filtering", len(filtered_outfits))
+        return filtered_outfits
 
 
 # Initialize data store
@@ -538,6 +2391,7 @@ def extract_parameter_value(parameters, param_name, fallback_names=None):
     return None
 
 
+@timed('format_events')
 def format_events_response(events, filters=None):
     """Format events data for Dialogflow response"""
     if not events:
@@ -566,6 +2420,7 @@ def format_events_response(events, filters=None):
     return response_text
 
 
+@timed('format_accommodations')
 def format_accommodation_response(accommodations, filters=None):
     """Format accommodation data for Dialogflow response"""
     if not accommodations:
@@ -573,6 +2428,8 @@ def format_accommodation_response(accommodations, filters=None):
         if filters:
             if filters.get('area'):
                 filter_info += f" in {filters['area'].title()}"
+            if filters.get('min_budget'):
+                filter_info += f" from ₦{filters['min_budget']}"
             if filters.get('max_budget'):
                 filter_info += f" under ₦{filters['max_budget']}"
         
@@ -600,6 +2457,7 @@ def format_accommodation_response(accommodations, filters=None):
     return response_text
 
 
+@timed('format_outfits')
 def format_outfit_response(outfits, event_type):
     """Format outfit suggestions for response"""
     if not outfits:
@@ -627,60 +2485,579 @@ def format_outfit_response(outfits, event_type):
     return response_text
 
 
-@app.route('/chat', methods=['POST'])
-def chat_with_agent():
-    """
-    Endpoint: Receives a message from frontend, sends it to Dialogflow CX agent,
-    and returns the agent's response.
+def new_lookup_executor():
+    # Threads start on first use, so the gunicorn master never has any to lose in a fork
+    return ThreadPoolExecutor(max_workers=TRIP_LOOKUP_WORKERS, thread_name_prefix='trip-lookup')
+
+
+lookup_executor = new_lookup_executor()
+TRIP_PLAN_STATS = {'plans': 0, 'partial': 0, 'missed': {}, 'failed': {}}
+_trip_plan_stats_lock = threading.Lock()
+
+
+def gather_with_deadline(calls, timeout, inline=False):
+    """Run the callables of `calls` ({name: callable}) in parallel, sharing one deadline.
+
+    Returns ({name: result}, {name: exception}) for the calls that returned or raised
+    within `timeout` seconds. The rest are left out of both and finish in the
+    background on the shared lookup pool. With `inline` the calls run one after the
+    other in this thread, for when they only read loaded snapshots and cannot block.
+    """
+    futures = {}
+    for name, call in calls.items():
+        if not inline:
+            try:
+                # Each lookup runs in a copy of this context, so its spans keep the request's labels
+                futures[name] = lookup_executor.submit(contextvars.copy_context().run, call)
+                continue
+            except RuntimeError:
+                # The executor refuses work once the interpreter is shutting down
+                pass
+        futures[name] = Future()
+        try:
+            futures[name].set_result(call())
+        except Exception as e:
+            futures[name].set_exception(e)
+    wait(futures.values(), timeout=timeout)
+
+    results, failures = {}, {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            logger.warning("%s lookup did not finish within %ss, leaving it out", name, timeout)
+        elif future.exception() is not None:
+            failures[name] = future.exception()
+            logger.error("%s lookup failed: %s", name, failures[name])
+        else:
+            results[name] = future.result()
+    return results, failures
+
+
+def record_trip_plan(missing, failures):
+    """Count a trip plan, and the lookups it went without: failed if they raised, else missed"""
+    with _trip_plan_stats_lock:
+        TRIP_PLAN_STATS['plans'] += 1
+        if missing:
+            TRIP_PLAN_STATS['partial'] += 1
+        for name in missing:
+            counts = TRIP_PLAN_STATS['failed' if name in failures else 'missed']
+            counts[name] = counts.get(name, 0) + 1
+    if missing:
+        metrics.count('trip_plan_partial')
+
+
+def get_trip_plan_stats():
+    with _trip_plan_stats_lock:
+        return {key: dict(value) if isinstance(value, dict) else value for key, value in TRIP_PLAN_STATS.items()}
+
+
+# Words build_intent_response dispatches on, in the order it tries them
+INTENT_KINDS = ('events', 'accommodation', 'outfit', 'trip')
+
+
+def intent_kind(intent_name):
+    """The build_intent_response branch an intent name reaches, or 'other'.
+
+    Used as the metric label for names taken from a request body, so callers
+    cannot create new metric series.
+    """
+    lowered = str(intent_name or '').lower()
+    return next((kind for kind in INTENT_KINDS if kind in lowered), 'other')
+
+
+def build_intent_response(intent_name, parameters, query_text):
+    """Answer a matched intent from the sheet data, as the webhook fulfills it for Dialogflow"""
+    if 'events' in intent_name.lower():
+        # Handle events inquiry
+        filters = {'query_text': query_text}  # Include original query for date parsing
+        
+        # Extract area parameter
+        area_param = extract_parameter_value(parameters, 'area', ['location', 'place'])
+        if area_param:
+            filters['area'] = str(area_param)
+            logger.debug("Applied area filter: %s", filters['area'])
+        
+        # Extract event_type parameter
+        event_type_param = extract_parameter_value(parameters, 'event_type', ['type', 'event_type'])
+        if event_type_param:
+            filters['event_type'] = str(event_type_param)
+            logger.debug("Applied event type filter: %s", filters['event_type'])
+        
+        events = data_store.get_events(filters)
+        response_text = format_events_response(events, filters)
+        
+    elif 'accommodation' in intent_name.lower():
+        # Handle accommodation inquiry
+        filters = {}
+        
+        # Extract area parameter
+        area_param = extract_parameter_value(parameters, 'area', ['location', 'place'])
+        if area_param:
+            filters['area'] = str(area_param)
+            logger.debug("Applied area filter: %s", filters['area'])
+        
+        # Extract max_budget parameter
+        budget_param = extract_parameter_value(parameters, 'max_budget', ['budget', 'price', 'cost', 'amount'])
+        if budget_param:
+            try:
+                filters['max_budget'] = float(budget_param)
+                logger.debug("Applied budget filter: %s", filters['max_budget'])
+            except (ValueError, TypeError):
+                logger.warning("Invalid budget value: %s", budget_param)
+        
+        # Extract min_budget parameter
+        min_budget_param = extract_parameter_value(parameters, 'min_budget', ['min_price'])
+        if min_budget_param:
+            try:
+                filters['min_budget'] = float(min_budget_param)
+                logger.debug("Applied minimum budget filter: %s", filters['min_budget'])
+            except (ValueError, TypeError):
+                logger.warning("Invalid minimum budget value: %s", min_budget_param)
+        
+        # Extract accommodation_type parameter
+        acc_type_param = extract_parameter_value(parameters, 'accommodation_type', ['type', 'accommodation_type'])
+        if acc_type_param:
+            filters['accommodation_type'] = str(acc_type_param)
+            logger.debug("Applied accommodation type filter: %s", filters['accommodation_type'])
+        
+        accommodations = data_store.get_accommodations(filters)
+        response_text = format_accommodation_response(accommodations, filters)
+        
+    elif 'outfit' in intent_name.lower():
+        # Handle outfit suggestions
+        # Extract event_type parameter
+        event_type = extract_parameter_value(parameters, 'event_type', ['type', 'event_type'])
+        
+        # Extract gender parameter
+        gender = extract_parameter_value(parameters, 'gender', ['gender_type'])
+        
+        # If no event_type provided, try to get from query context or use a default
+        if not event_type:
+            # Check if there's any event-related context in the query
+            query_lower = query_text.lower() if query_text else ""
+            if 'concert' in query_lower or 'music' in query_lower:
+                event_type = 'concert'
+            elif 'beach' in query_lower or 'pool' in query_lower:
+                event_type = 'beach_party'
+            elif 'club' in query_lower or 'party' in query_lower:
+                event_type = 'club_night'
+            elif 'brunch' in query_lower:
+                event_type = 'brunch'
+            elif 'december' in query_lower or 'detty' in query_lower:
+                event_type = 'detty_december'
+            else:
+                # Default to concert if no specific type found
+                event_type = 'concert'
+        
+        logger.debug("Getting outfits for event_type: %s, gender: %s", event_type, gender)
+        
+        outfits = data_store.get_outfit_suggestions(event_type, gender)
+        response_text = format_outfit_response(outfits, event_type)
+        
+    elif 'trip' in intent_name.lower():
+        # Handle trip planning - provide comprehensive trip information
+        logger.debug("Handling trip planning request")
+        
+        # Extract area parameter if specified
+        area_param = extract_parameter_value(parameters, 'area', ['location', 'place'])
+        
+        # Events filters (default to current year if no specific date)
+        event_filters = {'query_text': query_text}
+        if area_param:
+            event_filters['area'] = str(area_param)
+        
+        # Accommodation filters
+        acc_filters = {}
+        if area_param:
+            acc_filters['area'] = str(area_param)
+        
+        # Once every sheet is loaded the lookups only read in-memory snapshots, so they run
+        # inline. Before that they run at once, and a source that is slow to load (e.g. on a
+        # cold start) is left out of the plan rather than holding up the other two.
+        results, failures = gather_with_deadline({
+            'events': lambda: data_store.get_events(event_filters),
+            'accommodations': lambda: data_store.get_accommodations(acc_filters),
+            'outfits': lambda: data_store.get_outfit_suggestions('concert'),  # Default to concert
+        }, TRIP_PLAN_DEADLINE_SECONDS, inline=data_store.is_ready())
+        record_trip_plan([name for name in ('events', 'accommodations', 'outfits') if name not in results], failures)
+        
+        def unavailable(name, label):
+            if name in failures:
+                return f"I couldn't load {label} right now, sorry! Try asking me about them directly. 😕"
+            return f"I'm still pulling up {label} for you, ask me again in a moment! ⏳"
+
+        events_response = (format_events_response(results['events'], event_filters)
+                           if 'events' in results else unavailable('events', 'events'))
+        acc_response = (format_accommodation_response(results['accommodations'], acc_filters)
+                        if 'accommodations' in results else unavailable('accommodations', 'places to stay'))
+        outfit_response = (format_outfit_response(results['outfits'], 'concert')
+                           if 'outfits' in results else unavailable('outfits', 'outfit ideas'))
+        
+        # Combine all responses
+        response_text = f"🌟 **Your Lagos Trip Plan** 🌟\n\n"
+        
+        if area_param:
+            response_text += f"📍 **Focusing on {area_param.title()}**\n\n"
+        
+        response_text += "🎉 **TOP EVENTS**\n"
+        response_text += events_response + "\n\n"
+        
+        response_text += "🏨 **WHERE TO STAY**\n"
+        response_text += acc_response + "\n\n"
+        
+        response_text += "👗 **STYLE INSPIRATION**\n"
+        response_text += outfit_response + "\n\n"
+        
+        response_text += "💡 **Trip Planning Tips:**\n"
+        response_text += "• Book accommodations early, especially during peak seasons\n"
+        response_text += "• Check event dates and book tickets in advance\n"
+        response_text += "• Consider the weather when packing outfits\n"
+        response_text += "• Explore different areas of Lagos for the full experience\n\n"
+        
+        response_text += "Need specific recommendations? Ask me about events in a particular area, budget-friendly stays, or outfit suggestions for specific events! 🎯"
+        
+    else:
+        # Default/fallback response
+        response_text = ("Hey there! Ready to Detty this December in Lagos? \n\n"
+                       "🔥 I am Yinka and I can help you plan your trip, find events, comfy places to stay, or outfit inspo. \n"
+                       "🌟 What would you like to explore?\n\n"
+                       "Try asking: 'What should I wear for brunch' or 'What events are in Ikeja?' or 'Show me hotels in Lekki'")
+
+    return response_text
+
+
+def intent_sheet_types(intent_name):
+    """The sheets build_intent_response reads to answer an intent"""
+    intent = intent_name.lower()
+    if 'events' in intent:
+        return ('events',)
+    if 'accommodation' in intent:
+        return ('accommodations',)
+    if 'outfit' in intent:
+        return ('outfits',)
+    if 'trip' in intent:
+        return ('events', 'accommodations', 'outfits')
+    return ()
+
+
+def normalize_chip_text(text):
+    """Drop the leading emoji of a chip and fold case and spacing"""
+    return ' '.join(re.sub(r'^[\W_]+', '', str(text)).lower().split())
+
+
+def _find_chip_texts(node):
+    """Every chip option text in a piece of the agent config, in order"""
+    if isinstance(node, dict):
+        if node.get('type') == 'chips':
+            return [option['text'] for option in node.get('options', []) if option.get('text')]
+        node = list(node.values())
+    if isinstance(node, list):
+        return [text for child in node for text in _find_chip_texts(child)]
+    return []
+
+
+def load_chip_routes(path=DIALOGFLOW_CONFIG_PATH):
+    """Resolve the chips of the agent config to the intent and parameters Dialogflow would match.
+
+    A chip resolves when it matches one of an intent's training phrases, where an
+    annotated part matches any synonym of its entity. Chips that match no phrase
+    are left to Dialogflow. Returns {normalized chip text: (intent, parameters)}.
+    """
+    try:
+        with open(path, encoding='utf-8') as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError) as e:
+        logger.error("Failed to load Dialogflow config from %s: %s", path, e)
+        return {}
+
+    synonyms = {}
+    for entity_type in config.get('entityTypes', []):
+        synonyms[entity_type['displayName']] = {
+            synonym.lower(): entity['value']
+            for entity in entity_type.get('entities', [])
+            for synonym in [entity['value'], *entity.get('synonyms', [])]
+        }
+
+    phrases = []
+    for intent in config.get('intents', []):
+        parameter_ids = {parameter['entityType'].rsplit('/', 1)[-1].lstrip('@'): parameter['id']
+                         for parameter in intent.get('parameters', [])}
+        for phrase in intent.get('trainingPhrases', []):
+            pattern, slots = [], []
+            for part in phrase.get('parts', []):
+                entity = part.get('parameterValue', '').lstrip('@')
+                if not entity:
+                    pattern.append(re.escape(' '.join(part['text'].lower().split())))
+                    continue
+                values = synonyms.get(entity)
+                if values:
+                    pattern.append('(' + '|'.join(re.escape(value) for value in sorted(values, key=len, reverse=True)) + ')')
+                else:
+                    pattern.append(r'([\d,.]+)' if entity == 'sys.number' else '(.+?)')
+                slots.append((parameter_ids.get(entity, entity), values))
+            phrases.append((intent['displayName'], re.compile(r'\s*'.join(pattern)), slots))
+
+    routes = {}
+    for chip in _find_chip_texts(config.get('flows', [])):
+        text = normalize_chip_text(chip)
+        for intent_name, pattern, slots in phrases:
+            match = pattern.fullmatch(text)
+            if match:
+                routes[text] = (intent_name, {
+                    parameter: values.get(value, value) if values else value
+                    for (parameter, values), value in zip(slots, match.groups())
+                })
+                break
+        else:
+            logger.info("Chip '%s' matches no training phrase, leaving it to Dialogflow", chip)
+    return routes
+
+
+class ChipResponder:
+    """Answer the welcome chips of the agent config from the sheet snapshots, skipping Dialogflow.
+
+    A chip's response is rendered whenever a snapshot it reads is stored, and
+    again on lookup if the day has changed since chips like "Events this week"
+    are relative to today.
+    """
+
+    def __init__(self, store, routes):
+        self.store = store
+        self.routes = routes
+        # normalized chip text -> (snapshots it was rendered from, day, response text)
+        self._rendered = {}
+        self.stats = {'answered': 0, 'renders': 0}
+
+    def _current_snapshots(self, intent_name):
+        return tuple(self.store._snapshots.get(sheet_type) for sheet_type in intent_sheet_types(intent_name))
+
+    def _render(self, text, query_text=None):
+        intent_name, parameters = self.routes[text]
+        snapshots = self._current_snapshots(intent_name)
+        if any(snapshot is None for snapshot in snapshots):
+            return None
+        response_text = build_intent_response(intent_name, dict(parameters), query_text or text)
+        self._rendered[text] = (snapshots, datetime.now().date(), response_text)
+        self.stats['renders'] += 1
+        return response_text
+
+    def render(self, sheet_types=None):
+        """Pre-render every chip answered from `sheet_types`, or from any sheet"""
+        for text, (intent_name, _) in self.routes.items():
+            if sheet_types is None or set(intent_sheet_types(intent_name)) & set(sheet_types):
+                self._render(text)
+
+    def lookup(self, message):
+        """(intent, response text) for a chip message, or None to ask Dialogflow"""
+        text = normalize_chip_text(message)
+        route = self.routes.get(text)
+        if route is None:
+            return None
+
+        intent_name = route[0]
+        rendered = self._rendered.get(text)
+        if (rendered is None or rendered[1] != datetime.now().date() or
+                any(old is not new for old, new in zip(rendered[0], self._current_snapshots(intent_name)))):
+            response_text = self._render(text, message)
+            if response_text is None:
+                return None
+        else:
+            response_text = rendered[2]
+        self.stats['answered'] += 1
+        return intent_name, response_text
+
+    def get_stats(self):
+        return {'chips': sorted(self.routes), **self.stats}
+
+
+chip_responder = ChipResponder(data_store, load_chip_routes())
+data_store.add_snapshot_listener(chip_responder.render)
+
+
+@app.route('/chat', methods=['POST'])
+def chat_with_agent():
+    """
+    Endpoint: Receives a message from frontend, sends it to Dialogflow CX agent,
+    and returns the agent's response.
+    """
+    try:
+        if not request.is_json:
+            return jsonify({"error": "Request must be JSON"}), 400
+
+        data = request.get_json()
+        user_message = data.get('message')
+        session_id = data.get('session_id')
+        user_id = data.get('user_id', str(uuid.uuid4()))
+
+        if not user_message:
+            return jsonify({"error": "Message field is required"}), 400
+
+        # Use provided session_id if present, else generate one
+        if not session_id:
+            session_id = f"session-{user_id}"
+
+        # Welcome chips are answered from the sheets without a Dialogflow round trip
+        chip = chip_reply(user_message, session_id)
+        if chip:
+            return jsonify(chip)
+
+        session_client = get_session_client()
+        dialogflow_cx = get_dialogflow_cx()
+        session_path = session_client.session_path(PROJECT_ID, REGION, AGENT_ID, session_id)
+
+        text_input = dialogflow_cx.types.TextInput(text=user_message)
+        query_input = dialogflow_cx.types.QueryInput(
+            text=text_input,
+            language_code=LANGUAGE_CODE
+        )
+
+        started = time.perf_counter()
+        try:
+            response = session_client.detect_intent(
+                request={"session": session_path, "query_input": query_input},
+                timeout=DIALOGFLOW_TIMEOUT_SECONDS
+            )
+        finally:
+            metrics.observe('dialogflow', started)
+
+        return jsonify(chat_reply(response.query_result, session_id))
+
+    except Exception as e:
+        logger.error("Error calling Dialogflow CX API: %s", e)
+        return jsonify({"error": f"Could not process your request: {str(e)}"}), 500
+
+
+def chip_reply(user_message, session_id):
+    """The /chat response for a welcome chip answered locally, or None"""
+    chip = chip_responder.lookup(user_message)
+    if not chip:
+        return None
+    intent_name, response_text = chip
+    logger.debug("Answered chip '%s' locally as %s", user_message, intent_name)
+    set_metric_intent(intent_name)
+    metrics.count('chip_answered')
+    return {
+        "response": response_text,
+        "intent": intent_name,
+        "confidence": 1.0,
+        "session_id": session_id
+    }
+
+
+def chat_reply(query_result, session_id):
+    """The /chat response for a Dialogflow CX query result"""
+    fulfillment_texts = [
+        message.text.text[0]
+        for message in query_result.response_messages
+        if message.text.text
+    ]
+    fulfillment_text = " ".join(fulfillment_texts)
+    set_metric_intent(query_result.match.intent.display_name if query_result.match.intent else None)
+
+    logger.info("Chat query matched intent %s", query_result.match.intent.display_name if query_result.match.intent else 'N/A')
+    logger.debug("User Query: %s, Agent Response: %s", query_result.text, fulfillment_text)
+
+    return {
+        "response": fulfillment_text,
+        "intent": query_result.match.intent.display_name if query_result.match.intent else None,
+        "confidence": query_result.match.confidence if query_result.match.intent else None,
+        "session_id": session_id
+    }
+
+
+async def detect_intent_async(user_message, session_id, timeout=DIALOGFLOW_TIMEOUT_SECONDS):
+    """Send a message to Dialogflow CX without holding a thread while it answers.
+
+    At most DIALOGFLOW_MAX_CONCURRENCY calls run at once; `timeout` covers waiting
+    for a slot as well as the call. Raises asyncio.TimeoutError when it runs out.
     """
+    from google.api_core.exceptions import DeadlineExceeded
+
+    session_client, call_slots = get_async_session_client()
+    dialogflow_cx = get_dialogflow_cx()
+    session_path = session_client.session_path(PROJECT_ID, REGION, AGENT_ID, session_id)
+    query_input = dialogflow_cx.types.QueryInput(
+        text=dialogflow_cx.types.TextInput(text=user_message),
+        language_code=LANGUAGE_CODE
+    )
+
+    deadline = time.monotonic() + timeout
+    stats = ASYNC_DIALOGFLOW_STATS
+    stats['calls'] += 1
+    started = time.perf_counter()
     try:
-        if not request.is_json:
-            return jsonify({"error": "Request must be JSON"}), 400
+        await asyncio.wait_for(call_slots.acquire(), timeout)
+    except asyncio.TimeoutError:
+        stats['timeouts'] += 1
+        metrics.count('dialogflow_timeout')
+        raise
+    finally:
+        metrics.observe('dialogflow_wait', started)
+    stats['in_flight'] += 1
+    stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+    started = time.perf_counter()
+    try:
+        response = await session_client.detect_intent(
+            request={"session": session_path, "query_input": query_input},
+            timeout=max(deadline - time.monotonic(), 0.001)
+        )
+    except DeadlineExceeded as e:
+        stats['timeouts'] += 1
+        metrics.count('dialogflow_timeout')
+        raise asyncio.TimeoutError(f"Dialogflow did not answer within {timeout}s") from e
+    except Exception:
+        stats['errors'] += 1
+        raise
+    finally:
+        metrics.observe('dialogflow', started)
+        stats['in_flight'] -= 1
+        call_slots.release()
+    return response.query_result
+
+
+async def chat_with_agent_async(data):
+    """/chat for the ASGI entry point (asgi.py): same replies as chat_with_agent, returned as (body, status)"""
+    # Each ASGI request runs in its own task, so these labels stay with this request
+    set_metric_labels('chat_with_agent')
+    started = time.perf_counter()
+    status = 500
+    try:
+        body, status = await _chat_reply_async(data)
+        return body, status
+    finally:
+        # What the Flask request hooks record for the WSGI route
+        metrics.count(f"http_{status}")
+        metrics.observe('request', started)
+
+
+async def _chat_reply_async(data):
+    try:
+        if not isinstance(data, dict):
+            return {"error": "Request must be JSON"}, 400
 
-        data = request.get_json()
         user_message = data.get('message')
         session_id = data.get('session_id')
         user_id = data.get('user_id', str(uuid.uuid4()))
 
         if not user_message:
-            return jsonify({"error": "Message field is required"}), 400
+            return {"error": "Message field is required"}, 400
 
-        # Use provided session_id if present, else generate one
         if not session_id:
             session_id = f"session-{user_id}"
-        session_path = session_client.session_path(PROJECT_ID, REGION, AGENT_ID, session_id)
-
-        text_input = dialogflow_cx.types.TextInput(text=user_message)
-        query_input = dialogflow_cx.types.QueryInput(
-            text=text_input,
-            language_code=LANGUAGE_CODE
-        )
-
-        response = session_client.detect_intent(
-            request={"session": session_path, "query_input": query_input}
-        )
-
-        fulfillment_texts = [
-            message.text.text[0]
-            for message in response.query_result.response_messages
-            if message.text.text
-        ]
-        fulfillment_text = " ".join(fulfillment_texts)
 
-        logging.info(f"User Query: {response.query_result.text}")
-        logging.info(f"Detected Intent: {response.query_result.match.intent.display_name if response.query_result.match.intent else 'N/A'}")
-        logging.info(f"Agent Response: {fulfillment_text}")
+        chip = chip_reply(user_message, session_id)
+        if chip:
+            return chip, 200
 
-        return jsonify({
-            "response": fulfillment_text,
-            "intent": response.query_result.match.intent.display_name if response.query_result.match.intent else None,
-            "confidence": response.query_result.match.confidence if response.query_result.match.intent else None,
-            "session_id": session_id
-        })
+        query_result = await detect_intent_async(user_message, session_id)
+        return chat_reply(query_result, session_id), 200
 
+    except asyncio.TimeoutError as e:
+        logger.error("Dialogflow CX call timed out: %s", e)
+        return {"error": "Could not process your request: the assistant took too long to answer"}, 504
     except Exception as e:
-        logging.error(f"Error calling Dialogflow CX API: {e}")
-        return jsonify({"error": f"Could not process your request: {str(e)}"}), 500
+        logger.error("Error calling Dialogflow CX API: %s", e)
+        return {"error": f"Could not process your request: {str(e)}"}, 500
 
 
 @app.route('/webhook', methods=['POST'])
@@ -693,6 +3070,7 @@ def webhook():
         intent_name = req.get('intentInfo', {}).get('displayName', '')
         parameters = req.get('sessionInfo', {}).get('parameters', {})
         query_text = req.get('text', '')  # Original user query for date parsing
+        set_metric_intent(intent_kind(intent_name))
         
         # Try alternative parameter extraction paths for Dialogflow CX
         if not parameters:
@@ -712,153 +3090,17 @@ def webhook():
         if not parameters and 'parameters' in req:
             parameters = req['parameters']
         
-        logging.info(f"Webhook called with intent: {intent_name}")
-        logging.info(f"Parameters: {parameters}")
-        logging.info(f"Query text: {query_text}")
-        logging.info(f"Full request structure: {json.dumps(req, indent=2)}")
+        logger.info("Webhook called with intent: %s, parameters: %s, query text: %s", intent_name, parameters, query_text)
+        log_payload("Full request structure", req)
         
         # Additional debugging for parameter extraction
         if parameters:
-            logging.info(f"Parameter keys: {list(parameters.keys())}")
-            for key, value in parameters.items():
-                logging.info(f"Parameter '{key}': {value} (type: {type(value)})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Parameter types: %s", {key: type(value).__name__ for key, value in parameters.items()})
         else:
-            logging.warning("No parameters found in request")
+            logger.warning("No parameters found in request")
         
-        if 'events' in intent_name.lower():
-            # Handle events inquiry
-            filters = {'query_text': query_text}  # Include original query for date parsing
-            
-            # Extract area parameter
-            area_param = extract_parameter_value(parameters, 'area', ['location', 'place'])
-            if area_param:
-                filters['area'] = str(area_param)
-                logging.info(f"Applied area filter: {filters['area']}")
-            
-            # Extract event_type parameter
-            event_type_param = extract_parameter_value(parameters, 'event_type', ['type', 'event_type'])
-            if event_type_param:
-                filters['event_type'] = str(event_type_param)
-                logging.info(f"Applied event type filter: {filters['event_type']}")
-            
-            events = data_store.get_events(filters)
-            response_text = format_events_response(events, filters)
-            
-        elif 'accommodation' in intent_name.lower():
-            # Handle accommodation inquiry
-            filters = {}
-            
-            # Extract area parameter
-            area_param = extract_parameter_value(parameters, 'area', ['location', 'place'])
-            if area_param:
-                filters['area'] = str(area_param)
-                logging.info(f"Applied area filter: {filters['area']}")
-            
-            # Extract max_budget parameter
-            budget_param = extract_parameter_value(parameters, 'max_budget', ['budget', 'price', 'cost', 'amount'])
-            if budget_param:
-                try:
-                    filters['max_budget'] = float(budget_param)
-                    logging.info(f"Applied budget filter: {filters['max_budget']}")
-                except (ValueError, TypeError):
-                    logging.warning(f"Invalid budget value: {budget_param}")
-            
-            # Extract accommodation_type parameter
-            acc_type_param = extract_parameter_value(parameters, 'accommodation_type', ['type', 'accommodation_type'])
-            if acc_type_param:
-                filters['accommodation_type'] = str(acc_type_param)
-                logging.info(f"Applied accommodation type filter: {filters['accommodation_type']}")
-            
-            accommodations = data_store.get_accommodations(filters)
-            response_text = format_accommodation_response(accommodations, filters)
-            
-        elif 'outfit' in intent_name.lower():
-            # Handle outfit suggestions
-            # Extract event_type parameter
-            event_type = extract_parameter_value(parameters, 'event_type', ['type', 'event_type'])
-            
-            # Extract gender parameter
-            gender = extract_parameter_value(parameters, 'gender', ['gender_type'])
-            
-            # If no event_type provided, try to get from query context or use a default
-            if not event_type:
-                # Check if there's any event-related context in the query
-                query_lower = query_text.lower() if query_text else ""
-                if 'concert' in query_lower or 'music' in query_lower:
-                    event_type = 'concert'
-                elif 'beach' in query_lower or 'pool' in query_lower:
-                    event_type = 'beach_party'
-                elif 'club' in query_lower or 'party' in query_lower:
-                    event_type = 'club_night'
-                elif 'brunch' in query_lower:
-                    event_type = 'brunch'
-                elif 'december' in query_lower or 'detty' in query_lower:
-                    event_type = 'detty_december'
-                else:
-                    # Default to concert if no specific type found
-                    event_type = 'concert'
-            
-            logging.info(f"Getting outfits for event_type: {event_type}, gender: {gender}")
-            
-            outfits = data_store.get_outfit_suggestions(event_type, gender)
-            response_text = format_outfit_response(outfits, event_type)
-            
-        elif 'trip' in intent_name.lower():
-            # Handle trip planning - provide comprehensive trip information
-            logging.info("Handling trip planning request")
-            
-            # Extract area parameter if specified
-            area_param = extract_parameter_value(parameters, 'area', ['location', 'place'])
-            
-            # Get events (default to current year if no specific date)
-            event_filters = {'query_text': query_text}
-            if area_param:
-                event_filters['area'] = str(area_param)
-            
-            events = data_store.get_events(event_filters)
-            events_response = format_events_response(events, event_filters)
-            
-            # Get accommodations
-            acc_filters = {}
-            if area_param:
-                acc_filters['area'] = str(area_param)
-            
-            accommodations = data_store.get_accommodations(acc_filters)
-            acc_response = format_accommodation_response(accommodations, acc_filters)
-            
-            # Get outfit suggestions (default to concert)
-            outfits = data_store.get_outfit_suggestions('concert')
-            outfit_response = format_outfit_response(outfits, 'concert')
-            
-            # Combine all responses
-            response_text = f"🌟 **Your Lagos Trip Plan** 🌟\n\n"
-            
-            if area_param:
-                response_text += f"📍 **Focusing on {area_param.title()}**\n\n"
-            
-            response_text += "🎉 **TOP EVENTS**\n"
-            response_text += events_response + "\n\n"
-            
-            response_text += "🏨 **WHERE TO STAY**\n"
-            response_text += acc_response + "\n\n"
-            
-            response_text += "👗 **STYLE INSPIRATION**\n"
-            response_text += outfit_response + "\n\n"
-            
-            response_text += "💡 **Trip Planning Tips:**\n"
-            response_text += "• Book accommodations early, especially during peak seasons\n"
-            response_text += "• Check event dates and book tickets in advance\n"
-            response_text += "• Consider the weather when packing outfits\n"
-            response_text += "• Explore different areas of Lagos for the full experience\n\n"
-            
-            response_text += "Need specific recommendations? Ask me about events in a particular area, budget-friendly stays, or outfit suggestions for specific events! 🎯"
-            
-        else:
-            # Default/fallback response
-            response_text = ("Hey there! Ready to Detty this December in Lagos? \n\n"
-                           "🔥 I am Yinka and I can help you plan your trip, find events, comfy places to stay, or outfit inspo. \n"
-                           "🌟 What would you like to explore?\n\n"
-                           "Try asking: 'What should I wear for brunch' or 'What events are in Ikeja?' or 'Show me hotels in Lekki'")
+        response_text = build_intent_response(intent_name, parameters, query_text)
         
         return jsonify({
             'fulfillmentResponse': {
@@ -873,7 +3115,7 @@ def webhook():
         })
         
     except Exception as e:
-        logging.error(f"Webhook error: {e}")
+        logger.error("Webhook error: %s", e)
         return jsonify({
             'fulfillmentResponse': {
                 'messages': [
@@ -894,10 +3136,60 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'service': 'Lagos Travel Guide - Enhanced Version',
-        'sheets_connected': data_store.gc is not None
+        'sheets_connected': data_store.gc is not None,
+        'ready': data_store.is_ready(),
+        'startup': STARTUP_TIMINGS,
+        'sheet_cache': data_store.get_cache_status(),
+        'sheet_refresh': data_store.get_refresh_stats(),
+        'chat_chips': chip_responder.get_stats(),
+        'whatsapp_queue': message_queue.get_stats(),
+        'whatsapp_dedupe': message_deduplicator.get_stats(),
+        'graph_api': graph_api.get_stats(),
+        'outbound_whatsapp': outbound_scheduler.get_stats(),
+        'dialogflow_async': ASYNC_DIALOGFLOW_STATS,
+        'trip_plans': get_trip_plan_stats(),
+        'logging': log_handler.get_stats() if log_handler is not None else None
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage latency histograms and event counters of this worker process, in Prometheus text format"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Recent request profiles (see PROFILE_ADMIN_TOKEN)"""
+    if not admin_token_matches(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"profiles": profile_store.list()})
+
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """One profile in the folded stack format, e.g. for `flamegraph.pl profile.folded > profile.svg`"""
+    if not admin_token_matches(request.headers.get('X-Admin-Token')) or not name.endswith(ProfileStore.SUFFIX):
+        return jsonify({"error": "Not found"}), 404
+    return send_from_directory(profile_store.directory, name, mimetype='text/plain', as_attachment=True)
+
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({'status': 'alive'})
+
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: every sheet has data to answer from"""
+    ready = data_store.is_ready()
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'startup': STARTUP_TIMINGS
+    }), 200 if ready else 503
+
+
 @app.route('/test-sheets', methods=['GET'])
 def test_sheets():
     """Test endpoint to verify Google Sheets connection and filtering"""
@@ -957,6 +3249,157 @@ def test_sheets():
         }), 500
 
 
+class GraphApiClient:
+    """Shared HTTP client for the Meta Graph API.
+
+    Requests go through one pooled keep-alive session, so replies reuse open TLS
+    connections, and every call has connect and read timeouts. 429 and 5xx responses
+    are retried with jittered exponential backoff, waiting at least as long as the
+    Retry-After header asks. Read timeouts are not retried, since Meta may already
+    have delivered the message.
+    """
+
+    def __init__(self, base_url=GRAPH_API_BASE_URL, token=None, pool_size=GRAPH_API_POOL_SIZE,
+                 timeout=(GRAPH_API_CONNECT_TIMEOUT, GRAPH_API_READ_TIMEOUT), max_retries=GRAPH_API_MAX_RETRIES,
+                 backoff=GRAPH_API_BACKOFF_SECONDS, max_retry_after=GRAPH_API_MAX_RETRY_AFTER):
+        self.base_url = base_url
+        self.token = token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.after_fork()
+
+    def after_fork(self):
+        """Drop the session so this process opens connections of its own"""
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'statuses': {}}
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers['Content-Type'] = 'application/json'
+                    self._session = session
+        return self._session
+
+    @timed('graph_api')
+    def post(self, path, payload):
+        """POST JSON to the Graph API, returning the final response.
+
+        Raises requests.exceptions.RequestException if the request could not be
+        completed; error statuses are returned for the caller to check.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        headers = {'Authorization': f"Bearer {self.token or WHATSAPP_TOKEN}"}
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+            except requests.exceptions.ConnectTimeout:
+                # Nothing reached Meta, so this is always safe to retry
+                self._record(started, 'connect_timeout')
+                delay = self._backoff_delay(attempt)
+                if attempt >= self.max_retries:
+                    self._record_failure()
+                    raise
+            except requests.exceptions.RequestException:
+                self._record(started, 'error')
+                self._record_failure()
+                raise
+            else:
+                self._record(started, response.status_code)
+                if response.status_code not in GRAPH_API_RETRY_STATUSES or attempt >= self.max_retries:
+                    if response.status_code >= 400:
+                        self._record_failure()
+                    return response
+                delay = self._backoff_delay(attempt, response.headers.get('Retry-After'))
+                if delay is None:
+                    # Meta wants us to back off for longer than a reply is worth waiting
+                    self._record_failure()
+                    return response
+
+            attempt += 1
+            with self._stats_lock:
+                self.stats['retries'] += 1
+            logger.warning("Graph API call to %s will be retried in %.2fs (attempt %s)", path, delay, attempt)
+            time.sleep(delay)
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than Retry-After.
+
+        Returns None when Retry-After is longer than max_retry_after.
+        """
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        wait = parse_retry_after(retry_after)
+        if wait is not None:
+            if wait > self.max_retry_after:
+                return None
+            delay = max(delay, wait)
+        return delay
+
+    def _record(self, started, status):
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['statuses'][str(status)] = self.stats['statuses'].get(str(status), 0) + 1
+            self._latencies.append(time.monotonic() - started)
+
+    def _record_failure(self):
+        with self._stats_lock:
+            self.stats['failures'] += 1
+
+    def get_stats(self):
+        """Request counts, latency and how often pooled connections were reused"""
+        connections_opened = 0
+        pooled_requests = 0
+        if self._session is not None:
+            # The same adapter is mounted for both schemes
+            for adapter in {id(adapter): adapter for adapter in self._session.adapters.values()}.values():
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        connections_opened += pool.num_connections
+                        pooled_requests += pool.num_requests
+
+        with self._stats_lock:
+            stats = {**self.stats, 'statuses': dict(self.stats['statuses'])}
+            latencies = list(self._latencies)
+        return {
+            **stats,
+            'latency': summarize_durations(latencies),
+            'connections_opened': connections_opened,
+            'connections_reused': max(0, pooled_requests - connections_opened)
+        }
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header holding seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+graph_api = GraphApiClient()
+
+
 def send_template_message(recipient_phone_number):
     """
     Sends a WhatsApp template message using the Meta Graph API.
@@ -966,13 +3409,6 @@ def send_template_message(recipient_phone_number):
         recipient_phone_number (str): The phone number of the recipient (e.g., "2348012345678").
     """
 
-    url = f"https://graph.facebook.com/v20.0/{PHONENUMBER_ID}/messages"
-    
-    headers = {
-        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-
     data = {
         "messaging_product": "whatsapp",
         "to": recipient_phone_number,
@@ -987,23 +3423,24 @@ def send_template_message(recipient_phone_number):
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = graph_api.post(f"{PHONENUMBER_ID}/messages", data)
         response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-        print("Message sent successfully!")
-        print(json.dumps(response.json(), indent=2))
-        return response.json()
+        result = response.json()
+        logger.info("Template message sent successfully to %s", recipient_phone_number)
+        logger.debug("Template message response: %s", LazyJson(result))
+        return result
     except requests.exceptions.HTTPError as err:
-        print(f"HTTP error occurred: {err}")
-        print(f"Response content: {response.text}")
+        logger.error("HTTP error occurred: %s", err)
+        logger.error("Response content: %s", response.text)
         return None
     except requests.exceptions.ConnectionError as err:
-        print(f"Error connecting to the server: {err}")
+        logger.error("Error connecting to the server: %s", err)
         return None
     except requests.exceptions.Timeout as err:
-        print(f"The request timed out: {err}")
+        logger.error("The request timed out: %s", err)
         return None
     except requests.exceptions.RequestException as err:
-        print(f"An unexpected error occurred: {err}")
+        logger.error("An unexpected error occurred: %s", err)
         return None
 
 
@@ -1016,16 +3453,8 @@ def send_whatsapp_text_message(phone_number_id, recipient_phone_number, message_
         recipient_phone_number (str): The phone number of the recipient (e.g., "2348012345678").
         message_text (str): The text message to send.
     """
-    # Use v20.0 instead of v23.0 - your token might not support v23.0
-    url = f"https://graph.facebook.com/v20.0/{phone_number_id}/messages"
-    
-    headers = {
-        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-
     formatted_number = recipient_phone_number if recipient_phone_number.startswith('+') else f'+{recipient_phone_number}'
-    logger.log(f"Sending WhatsApp message to {formatted_number}: {message_text}")
+    logger.debug("Sending WhatsApp message to %s: %s", formatted_number, message_text)
 
     data = {
         "messaging_product": "whatsapp",
@@ -1037,67 +3466,249 @@ def send_whatsapp_text_message(phone_number_id, recipient_phone_number, message_
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = graph_api.post(f"{phone_number_id}/messages", data)
         response.raise_for_status()
-        logger.log(f"WhatsApp message sent successfully to {recipient_phone_number}")
+        logger.info("WhatsApp message sent successfully to %s", recipient_phone_number)
         return response.json()
     except requests.exceptions.RequestException as err:
-        logger.error(f"Error sending WhatsApp message: {err}")
-        if hasattr(err, 'response') and err.response:
-            logger.error(f"Response content: {err.response.text}")
+        logger.error("Error sending WhatsApp message: %s", err)
+        if getattr(err, 'response', None) is not None:
+            # A 4xx/5xx Response is falsy, so test for None rather than truthiness
+            logger.error("Response content: %s", err.response.text)
         return None
 
-async def chat_with_dialogflow_cx(user_message, user_id):
-    """
-    Send a message to Dialogflow CX and get the response.
-    
-    Args:
-        user_message (str): The message from the user
-        user_id (str): Unique identifier for the user session
-    
-    Returns:
-        str: The response from Dialogflow CX
+class TokenBucket:
+    """Allows `rate` events per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+
+class _RecipientQueue:
+    """Messages waiting for one recipient, sent one at a time and spaced out"""
+    __slots__ = ('jobs', 'busy', 'next_allowed')
+
+    def __init__(self):
+        self.jobs = deque()
+        self.busy = False
+        self.next_allowed = 0.0
+
+
+class OutboundScheduler:
+    """Paces outbound WhatsApp messages instead of sending them as fast as they are produced.
+
+    Each business phone number gets a token bucket for its overall send rate, and
+    messages to the same recipient go out in order, one at a time, at least
+    `recipient_interval` seconds apart. Messages over the limit wait in the queue
+    rather than being dropped. A dispatcher thread hands due messages to a small pool
+    of sender threads; both start on the first message.
+
+    `rate` and `burst` are for the whole deployment: each of `processes` forked
+    workers gets an even share, so a worker busier than the rest may wait while
+    another has tokens to spare.
     """
-    try:
-        # Create unique session ID for this user
-        session_id = f"whatsapp-session-{user_id}"
-        
-        # Construct the session path for Dialogflow CX
-        session_path = session_client.session_path(PROJECT_ID, REGION, AGENT_ID, session_id)
 
-        # Create a TextInput object
-        text_input = dialogflow_cx.types.TextInput(text=user_message)
+    # Seconds between sweeps of recipients that no longer need pacing
+    IDLE_SWEEP_SECONDS = 60
 
-        # Create a QueryInput object with language_code
-        query_input = dialogflow_cx.types.QueryInput(
-            text=text_input,
-            language_code=LANGUAGE_CODE
-        )
+    def __init__(self, sender, rate=WHATSAPP_SEND_RATE, burst=WHATSAPP_SEND_BURST,
+                 recipient_interval=WHATSAPP_RECIPIENT_INTERVAL_SECONDS, concurrency=WHATSAPP_SEND_CONCURRENCY):
+        self.sender = sender
+        self.rate = rate
+        self.burst = burst
+        self.recipient_interval = recipient_interval
+        self.concurrency = concurrency
+        self.after_fork()
 
-        # Send the query to Dialogflow CX
-        response = session_client.detect_intent(
-            request={"session": session_path, "query_input": query_input}
-        )
+    def after_fork(self, processes=1):
+        """Start with no queued messages and no threads, as in a fresh process, sending
+        at this process's share of the rate"""
+        self.process_rate = self.rate / processes
+        # At least one token, or no message could ever go out
+        self.process_burst = max(1.0, self.burst / processes)
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._recipients = {}
+        # Recipients with queued messages, in the order they first had one waiting
+        self._waiting = {}
+        self._sends = queue.Queue()
+        self._dispatcher = None
+        self._queued = 0
+        self._in_flight = 0
+        self._sent_times = {}
+        self._next_sweep = time.monotonic() + self.IDLE_SWEEP_SECONDS
+        self._wait_times = deque(maxlen=1000)
+        self.stats = {'submitted': 0, 'sent': 0, 'failed': 0}
 
-        # Extract the fulfillment text from Dialogflow CX's response
-        fulfillment_texts = [
-            message.text.text[0]
-            for message in response.query_result.response_messages
-            if message.text.text
-        ]
-        fulfillment_text = " ".join(fulfillment_texts) if fulfillment_texts else "I'm sorry, I didn't understand that. Can you please rephrase?"
+    def submit(self, phone_number_id, recipient_phone_number, message_text):
+        """Queue a text message, returning a Future for the sender's result"""
+        future = Future()
+        key = (phone_number_id, recipient_phone_number)
+        with self._condition:
+            self._ensure_threads()
+            recipient = self._recipients.get(key)
+            if recipient is None:
+                recipient = self._recipients[key] = _RecipientQueue()
+            recipient.jobs.append((time.monotonic(), message_text, future))
+            self._waiting.setdefault(key, None)
+            self._queued += 1
+            self.stats['submitted'] += 1
+            self._condition.notify()
+        return future
 
-        # Log the interaction
-        logger.log(f"WhatsApp User Query: {response.query_result.text}")
-        logger.log(f"Detected Intent: {response.query_result.match.intent.display_name if response.query_result.match.intent else 'N/A'}")
-        logger.log(f"Confidence: {response.query_result.match.confidence if response.query_result.match.intent else 'N/A'}")
-        logger.log(f"Agent Response: {fulfillment_text}")
+    def _bucket(self, phone_number_id):
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self._buckets[phone_number_id] = TokenBucket(self.process_rate, self.process_burst)
+        return bucket
 
-        return fulfillment_text
+    def _ensure_threads(self):
+        # Plain daemon threads rather than an executor, which refuses work once the
+        # interpreter starts shutting down and so could not drain the queue at exit
+        if self._dispatcher is None:
+            for number in range(self.concurrency):
+                threading.Thread(target=self._send_loop, name=f"whatsapp-send-{number}", daemon=True).start()
+            self._dispatcher = threading.Thread(target=self._dispatch, name='whatsapp-dispatch', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        with self._condition:
+            while True:
+                timeout = self._dispatch_due(time.monotonic())
+                self._condition.wait(timeout)
+
+    def _dispatch_due(self, now):
+        """Hand every message that may go out now to the senders.
+
+        Returns how long to sleep before something else becomes due, or None to
+        sleep until a message is queued or a send finishes.
+        """
+        timeout = None
+        for key in list(self._waiting):
+            recipient = self._recipients[key]
+            if recipient.busy:
+                continue
+            if recipient.next_allowed > now:
+                timeout = min(timeout, recipient.next_allowed - now) if timeout is not None else recipient.next_allowed - now
+                continue
+            bucket = self._bucket(key[0])
+            if not bucket.try_acquire(now):
+                timeout = min(timeout, bucket.wait_time(now)) if timeout is not None else bucket.wait_time(now)
+                continue
+
+            enqueued_at, message_text, future = recipient.jobs.popleft()
+            if not recipient.jobs:
+                del self._waiting[key]
+            recipient.busy = True
+            recipient.next_allowed = now + self.recipient_interval
+            self._queued -= 1
+            self._in_flight += 1
+            self._wait_times.append(now - enqueued_at)
+            sent_times = self._sent_times.setdefault(key[0], deque())
+            sent_times.append(now)
+            # Only the last minute is reported, so at most rate x 60 entries are kept
+            self._forget_old_sends(sent_times, now)
+            self._sends.put((key, message_text, future))
+        return timeout
+
+    def _send_loop(self):
+        set_metric_labels('whatsapp_send')
+        while True:
+            self._send(*self._sends.get())
+
+    def _send(self, key, message_text, future):
+        phone_number_id, recipient_phone_number = key
+        try:
+            result = self.sender(phone_number_id, recipient_phone_number, message_text)
+        except Exception as e:
+            result = None
+            logger.error("Error sending queued WhatsApp message to %s: %s", recipient_phone_number, e)
+
+        with self._condition:
+            self._in_flight -= 1
+            self.stats['sent' if result else 'failed'] += 1
+            self._recipients[key].busy = False
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._forget_idle_recipients(now)
+                self._next_sweep = now + self.IDLE_SWEEP_SECONDS
+            self._condition.notify()
+        future.set_result(result)
+
+    def _forget_idle_recipients(self, now):
+        """Drop recipients kept only to pace a next message that is now allowed anyway"""
+        for key in [key for key, recipient in self._recipients.items()
+                    if not recipient.busy and not recipient.jobs and recipient.next_allowed <= now]:
+            del self._recipients[key]
+
+    def drain(self, timeout=WHATSAPP_DRAIN_SECONDS):
+        """Wait up to `timeout` seconds for queued messages to be sent"""
+        deadline = time.monotonic() + timeout
+        while (self._queued or self._in_flight) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not (self._queued or self._in_flight)
+
+    @staticmethod
+    def _forget_old_sends(sent_times, now):
+        while sent_times and sent_times[0] < now - 60:
+            sent_times.popleft()
+
+    def get_stats(self):
+        """Queue sizes and, per business phone number, the send headroom left"""
+        now = time.monotonic()
+        with self._condition:
+            numbers = {}
+            for phone_number_id in set(self._buckets) | set(self._sent_times):
+                sent_times = self._sent_times.setdefault(phone_number_id, deque())
+                self._forget_old_sends(sent_times, now)
+                capacity_per_minute = self.process_rate * 60
+                numbers[phone_number_id] = {
+                    'tokens_available': round(self._bucket(phone_number_id).available(now), 2),
+                    'sent_last_minute': len(sent_times),
+                    'capacity_per_minute': capacity_per_minute,
+                    'headroom_per_minute': max(0, capacity_per_minute - len(sent_times)),
+                    'utilization': round(len(sent_times) / capacity_per_minute, 4)
+                }
+            return {
+                'rate_per_second': self.process_rate,
+                'burst': self.process_burst,
+                'deployment_rate_per_second': self.rate,
+                'recipient_interval_seconds': self.recipient_interval,
+                'queued': self._queued,
+                'in_flight': self._in_flight,
+                'recipients_waiting': len(self._waiting),
+                **self.stats,
+                'wait_time': summarize_durations(list(self._wait_times)),
+                'phone_numbers': numbers
+            }
+
+
+outbound_scheduler = OutboundScheduler(send_whatsapp_text_message)
+atexit.register(outbound_scheduler.drain)
 
-    except Exception as e:
-        logger.error(f"Error calling Dialogflow CX API: {e}")
-        return "I'm having trouble processing your request right now. Please try again later."
 
 def chat_with_dialogflow_cx_sync(user_message, user_id):
     """
@@ -1115,6 +3726,8 @@ def chat_with_dialogflow_cx_sync(user_message, user_id):
         session_id = f"whatsapp-session-{user_id}"
         
         # Construct the session path for Dialogflow CX
+        session_client = get_session_client()
+        dialogflow_cx = get_dialogflow_cx()
         session_path = session_client.session_path(PROJECT_ID, REGION, AGENT_ID, session_id)
 
         # Create a TextInput object
@@ -1127,9 +3740,15 @@ def chat_with_dialogflow_cx_sync(user_message, user_id):
         )
 
         # Send the query to Dialogflow CX
-        response = session_client.detect_intent(
-            request={"session": session_path, "query_input": query_input}
-        )
+        started = time.perf_counter()
+        try:
+            response = session_client.detect_intent(
+                request={"session": session_path, "query_input": query_input},
+                timeout=DIALOGFLOW_TIMEOUT_SECONDS
+            )
+        finally:
+            metrics.observe('dialogflow', started)
+        set_metric_intent(response.query_result.match.intent.display_name if response.query_result.match.intent else None)
 
         # Extract the fulfillment text from Dialogflow CX's response
         fulfillment_texts = [
@@ -1140,109 +3759,311 @@ def chat_with_dialogflow_cx_sync(user_message, user_id):
         fulfillment_text = " ".join(fulfillment_texts) if fulfillment_texts else "I'm sorry, I didn't understand that. Can you please rephrase?"
 
         # Log the interaction
-        logger.log(f"WhatsApp User Query: {response.query_result.text}")
-        logger.log(f"Detected Intent: {response.query_result.match.intent.display_name if response.query_result.match.intent else 'N/A'}")
-        logger.log(f"Confidence: {response.query_result.match.confidence if response.query_result.match.intent else 'N/A'}")
-        logger.log(f"Agent Response: {fulfillment_text}")
+        logger.info("WhatsApp query matched intent %s (confidence %s)",
+                    response.query_result.match.intent.display_name if response.query_result.match.intent else 'N/A',
+                    response.query_result.match.confidence if response.query_result.match.intent else 'N/A')
+        logger.debug("WhatsApp User Query: %s, Agent Response: %s", response.query_result.text, fulfillment_text)
 
         return fulfillment_text
 
     except Exception as e:
-        logger.error(f"Error calling Dialogflow CX API: {e}")
+        logger.error("Error calling Dialogflow CX API: %s", e)
         return "I'm having trouble processing your request right now. Please try again later."
 
 
+@timed('whatsapp_message')
 def process_message(message: dict, contact: dict = None):
     """
     Processes an individual incoming WhatsApp message and responds via Dialogflow CX.
     """
-    logger.log("--- Processing Incoming WhatsApp Message ---")
-    
+    # Queue worker threads run nothing else, so their labels are never reset
+    set_metric_labels('whatsapp_message')
     message_id = message.get('id')
     from_number = message.get('from')
     message_type = message.get('type')
     
-    logger.log(f"Message ID: {message_id}")
-    logger.log(f"From: {from_number}")
-    logger.log(f"Type: {message_type}")
+    logger.info("Processing WhatsApp %s message %s from %s", message_type, message_id, from_number)
 
     if contact:
-        logger.log(f"Contact Name: {contact.get('profile', {}).get('name')}")
-        logger.log(f"Contact Wa_ID: {contact.get('wa_id')}")
+        logger.debug("Contact Name: %s, Wa_ID: %s", contact.get('profile', {}).get('name'), contact.get('wa_id'))
 
 
     # Only handle text messages for now
     if message_type == 'text':
         user_message = message.get('text', {}).get('body', '')
-        logger.log(f"Text Message: {user_message}")
+        logger.debug("Text Message: %s", user_message)
         
         if user_message.strip():
             try:
                 # Get response from Dialogflow CX (using sync version)
                 dialogflow_response = chat_with_dialogflow_cx_sync(user_message, from_number)
                 
-                # Send response back to WhatsApp user
-                send_result = send_whatsapp_text_message(
+                # Queue the response back to the WhatsApp user; it goes out when the send rate allows
+                send_result = outbound_scheduler.submit(
                     phone_number_id=PHONENUMBER_ID,
                     recipient_phone_number=from_number,
                     message_text=dialogflow_response
                 )
-                
-                if send_result:
-                    logger.log(f"Successfully responded to WhatsApp message from {from_number}")
-                else:
-                    logger.error(f"Failed to send WhatsApp response to {from_number}")
+
+                def log_send_result(future, from_number=from_number):
+                    if future.result():
+                        logger.info("Successfully responded to WhatsApp message from %s", from_number)
+                    else:
+                        logger.error("Failed to send WhatsApp response to %s", from_number)
+
+                send_result.add_done_callback(log_send_result)
                     
             except Exception as e:
-                logger.error(f"Error processing WhatsApp message: {e}")
+                logger.error("Error processing WhatsApp message: %s", e)
                 
                 # Send error message back to user
                 error_message = "Sorry, I'm having technical difficulties. Please try again later."
                 try:
-                    send_whatsapp_text_message(
+                    outbound_scheduler.submit(
                         phone_number_id=PHONENUMBER_ID,
                         recipient_phone_number=from_number,
                         message_text=error_message
                     )
                 except Exception as send_error:
-                    logger.error(f"Failed to send error message: {send_error}")
+                    logger.error("Failed to send error message: %s", send_error)
         else:
-            logger.warn("Received empty text message")
+            logger.warning("Received empty text message")
     else:
         # Handle non-text messages
-        logger.log(f"Received non-text message of type: {message_type}")
+        logger.info("Received non-text message of type: %s", message_type)
         
         # Send a response asking for text input
         unsupported_message = "I can only handle text messages right now. Please send me a text message! 😊"
         
         try:
-            send_whatsapp_text_message(
+            outbound_scheduler.submit(
                 phone_number_id=PHONENUMBER_ID,
                 recipient_phone_number=from_number,
                 message_text=unsupported_message
             )
         except Exception as send_error:
-            logger.error(f"Failed to send unsupported message response: {send_error}")
+            logger.error("Failed to send unsupported message response: %s", send_error)
     
-    logger.log("-" * 50)
 
-# Simulate a basic logger
-class SimpleLogger:
-    def log(self, message):
-        print(f"[INFO] {message}")
 
-    def warn(self, message):
-        print(f"[WARN] {message}")
+def summarize_durations(samples):
+    """Count, mean, p50, p95 and max in milliseconds of a window of durations in seconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'avg_ms': round(sum(ordered) / len(ordered) * 1000, 1),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        'max_ms': round(ordered[-1] * 1000, 1)
+    }
+
+
+class MessageQueue:
+    """Bounded in-process queue of WhatsApp messages, answered by a fixed pool of worker threads.
+
+    The webhook only enqueues, so Meta gets its 200 in milliseconds however slow
+    Dialogflow or the Graph API are. Threads start on the first message, which keeps
+    them out of the gunicorn master.
+    """
+
+    def __init__(self, handler, workers=WHATSAPP_WORKERS, max_size=WHATSAPP_QUEUE_SIZE, window=1000):
+        self.handler = handler
+        self.worker_count = workers
+        self.max_size = max_size
+        self.window = window
+        self.after_fork()
+
+    def after_fork(self):
+        """Start from an empty queue with no threads, as in a fresh process"""
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wait_times = deque(maxlen=self.window)
+        self._processing_times = deque(maxlen=self.window)
+        self.stats = {'enqueued': 0, 'processed': 0, 'failed': 0, 'rejected': 0}
+
+    def submit(self, *args):
+        """Queue a call to the handler, returning False if the queue is full"""
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((time.monotonic(), args))
+        except queue.Full:
+            with self._lock:
+                self.stats['rejected'] += 1
+            return False
+
+        with self._lock:
+            self.stats['enqueued'] += 1
+        return True
+
+    def _ensure_workers(self):
+        if len(self._workers) == self.worker_count:
+            return
+        with self._lock:
+            while len(self._workers) < self.worker_count:
+                worker = threading.Thread(
+                    target=self._work,
+                    name=f"whatsapp-worker-{len(self._workers)}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            enqueued_at, args = self._queue.get()
+            started = time.monotonic()
+            failed = False
+            try:
+                self.handler(*args)
+            except Exception as e:
+                failed = True
+                logger.error("Error processing queued WhatsApp message: %s", e)
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self.stats['failed' if failed else 'processed'] += 1
+                    self._wait_times.append(started - enqueued_at)
+                    self._processing_times.append(finished - started)
+                self._queue.task_done()
+
+    def drain(self, timeout=WHATSAPP_DRAIN_SECONDS):
+        """Wait up to `timeout` seconds for queued messages to be answered"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._queue.unfinished_tasks
+
+    def get_stats(self):
+        with self._lock:
+            wait_times = list(self._wait_times)
+            processing_times = list(self._processing_times)
+            stats = dict(self.stats)
+        return {
+            'depth': self._queue.qsize(),
+            'in_flight': self._queue.unfinished_tasks - self._queue.qsize(),
+            'capacity': self.max_size,
+            'workers': self.worker_count,
+            **stats,
+            'wait_time': summarize_durations(wait_times),
+            'processing_time': summarize_durations(processing_times)
+        }
+
+def process_queued_message(message, contact=None, profile=False):
+    """Queue handler: process_message, profiled when the webhook request that queued it was"""
+    if not profile:
+        return process_message(message, contact)
+    profiler = StackProfiler('whatsapp_message')
+    profiler.start()
+    try:
+        return process_message(message, contact)
+    finally:
+        profiler.stop()
+        labels = _metric_labels.get()
+        profile_store.save(profiler, labels.endpoint, labels.intent)
+
+
+message_queue = MessageQueue(process_queued_message)
+atexit.register(message_queue.drain)
+
+
+class MessageDeduplicator:
+    """Remembers recently processed WhatsApp message ids so Meta's redeliveries are skipped.
+
+    Ids live in a bounded in-memory LRU with a TTL. With `db_path` set they are also
+    written to a local SQLite file, so dedupe survives restarts and is shared by the
+    worker processes of a container.
+    """
+
+    def __init__(self, max_ids=WHATSAPP_DEDUPE_MAX_IDS, ttl=WHATSAPP_DEDUPE_TTL_SECONDS, db_path=WHATSAPP_DEDUPE_DB):
+        self.max_ids = max_ids
+        self.ttl = ttl
+        self.db_path = db_path
+        self.after_fork()
+
+    def after_fork(self):
+        """Open this process's own database connection; SQLite connections must not cross a fork"""
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._db = None
+        self._db_writes = 0
+        self.stats = {'checked': 0, 'duplicates': 0}
+        if self.db_path:
+            try:
+                self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False, isolation_level=None)
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS processed_messages (id TEXT PRIMARY KEY, seen_at REAL NOT NULL)'
+                )
+            except sqlite3.Error as e:
+                logger.error("WhatsApp dedupe store %s unavailable, deduping in memory only: %s", self.db_path, e)
+                self._db = None
+
+    def check_and_add(self, message_id):
+        """Return True if the message was already seen, otherwise remember it and return False"""
+        if not message_id:
+            return False
+
+        now = time.time()
+        with self._lock:
+            self.stats['checked'] += 1
+            seen_at = self._seen.get(message_id)
+            if seen_at is not None and now - seen_at < self.ttl:
+                duplicate = True
+            else:
+                # Another worker process, or this one before a restart, may have seen it
+                seen_at = now
+                duplicate = self._db is not None and not self._db_insert(message_id, now)
+
+            if duplicate:
+                self.stats['duplicates'] += 1
+            self._seen[message_id] = seen_at
+            self._seen.move_to_end(message_id)
+            while len(self._seen) > self.max_ids:
+                self._seen.popitem(last=False)
+            return duplicate
+
+    def forget(self, message_id):
+        """Drop a message id, e.g. when it could not be queued and Meta should redeliver it"""
+        with self._lock:
+            self._seen.pop(message_id, None)
+            if self._db is not None:
+                try:
+                    self._db.execute('DELETE FROM processed_messages WHERE id = ?', (message_id,))
+                except sqlite3.Error as e:
+                    logger.error("Failed to remove %s from WhatsApp dedupe store: %s", message_id, e)
+
+    def _db_insert(self, message_id, now):
+        """Record the id in the database, returning False if it was already there and still fresh"""
+        try:
+            inserted = self._db.execute(
+                'INSERT INTO processed_messages (id, seen_at) VALUES (?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET seen_at = excluded.seen_at WHERE seen_at < ?',
+                (message_id, now, now - self.ttl)
+            ).rowcount
+            self._db_writes += 1
+            if self._db_writes % 1000 == 0:
+                self._db.execute('DELETE FROM processed_messages WHERE seen_at < ?', (now - self.ttl,))
+            return inserted > 0
+        except sqlite3.Error as e:
+            # Never hold up a reply because the dedupe store is unhappy
+            logger.error("WhatsApp dedupe store error, deduping in memory only for %s: %s", message_id, e)
+            return True
 
-    def error(self, message, stack=None):
-        print(f"[ERROR] {message}")
-        if stack:
-            print(f"Stack: {stack}")
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'tracked_ids': len(self._seen),
+                'max_ids': self.max_ids,
+                'ttl_seconds': self.ttl,
+                'persistent': self._db is not None
+            }
 
-    def debug(self, message):
-        print(f"[DEBUG] {message}")
 
-logger = SimpleLogger()
+message_deduplicator = MessageDeduplicator()
 
 # --- Webhook GET Endpoint (Verification) ---
 @app.route('/whatsapp/webhook', methods=['GET'])
@@ -1255,16 +4076,13 @@ def verify_webhook():
     token = request.args.get('hub.verify_token')
     challenge = request.args.get('hub.challenge')
 
-    logger.debug(
-        f"Verifying webhook: mode={mode}, token={token}, expected={VERIFY_TOKEN},"
-        f" challenge={challenge}"
-    )
+    logger.debug("Verifying webhook: mode=%s, token=%s, expected=%s, challenge=%s", mode, token, VERIFY_TOKEN, challenge)
 
     if mode == 'subscribe' and token == VERIFY_TOKEN:
-        logger.log('Webhook verification successful')
+        logger.info("Webhook verification successful")
         return challenge, 200 # Return challenge with 200 OK
     else:
-        logger.warn('Webhook verification failed')
+        logger.warning("Webhook verification failed")
         return 'Verification failed', 403 # Return 403 Forbidden for failure
 
 # --- Webhook POST Endpoint (Incoming Messages) ---
@@ -1274,14 +4092,14 @@ def handle_webhook():
     Handles POST requests from Meta when new messages or events occur.
     """
     payload = request.get_json()
-    logger.log('Received webhook payload:')
-    logger.log(json.dumps(payload, indent=2)) # Pretty print the payload for debugging
+    log_payload("Received WhatsApp webhook payload", payload)
 
     try:
         if payload.get('object') != 'whatsapp_business_account':
-            logger.warn(f"Received unexpected payload object: {payload.get('object')}")
+            logger.warning("Received unexpected payload object: %s", payload.get('object'))
             return jsonify({"status": "ignored", "reason": "unexpected object"}), 200
 
+        rejected = 0
         for entry in payload.get('entry', []):
             for change in entry.get('changes', []):
                 if change.get('field') != 'messages':
@@ -1297,15 +4115,24 @@ def handle_webhook():
                     if value.get('contacts') and len(value['contacts']) > 0:
                         contact = value['contacts'][0]
 
-                    # Process the message (this is where you'd add your main logic)
-                    process_message(message, contact)
+                    # Meta redelivers payloads; answer each message only once
+                    if message_deduplicator.check_and_add(message.get('id')):
+                        logger.info("Skipping duplicate WhatsApp message %s", message.get('id'))
+                        continue
+
+                    # Answered by a queue worker, so Meta gets its 200 straight away
+                    if not message_queue.submit(message, contact, 'profiler' in g):
+                        message_deduplicator.forget(message.get('id'))
+                        rejected += 1
 
-        return jsonify({"status": "success"}), 200 # Always return 200 OK to Meta
+        if rejected:
+            # Anything but a 200 makes Meta redeliver the payload later
+            logger.warning("WhatsApp queue is full, refused %s message(s)", rejected)
+            return jsonify({"status": "busy", "rejected": rejected}), 503
+
+        return jsonify({"status": "success"}), 200 # A 200 tells Meta the messages were received
     except Exception as e:
-        logger.error(
-            f"Error handling webhook: {e}",
-            getattr(e, 'args', None) # Get stack if available (basic attempt)
-        )
+        logger.exception("Error handling webhook: %s", e)
         # Even on error, return 200 to Meta to prevent retries (handle errors internally)
         return jsonify({"status": "error", "message": str(e)}), 200
 
@@ -1362,7 +4189,8 @@ def debug_outfits():
         
         return jsonify({
             'all_outfits_count': len(all_outfits),
-            'all_outfits': all_outfits,
+            # A MappedSheet once the snapshot file is mapped, which jsonify cannot serialize
+            'all_outfits': list(all_outfits),
             'test_results': test_results
         })
         
@@ -1650,5 +4478,79 @@ def debug_data():
         }), 500
 
 
+def _warm_up():
+    """Create the Google clients and load sheet data before the first request needs them"""
+    started = time.perf_counter()
+    data_store.warm_up()
+    if data_store.is_ready():
+        STARTUP_TIMINGS.setdefault('ready_ms', round((time.perf_counter() - _MODULE_STARTED) * 1000, 1))
+
+    try:
+        get_session_client()
+    except Exception as e:
+        logger.error("Failed to initialize Dialogflow CX client: %s", e)
+
+    record_startup_timing('warmup_ms', started)
+    ready_ms = STARTUP_TIMINGS.get('ready_ms')
+    logger.info("Startup report: %s", STARTUP_TIMINGS)
+    if ready_ms is None:
+        logger.warning("Startup warmup finished without data for every sheet, not ready yet")
+    elif ready_ms > STARTUP_BUDGET_MS:
+        logger.warning("Startup took %s ms to become ready, over the %.0f ms budget", ready_ms, STARTUP_BUDGET_MS)
+
+
+_warmup_thread = None
+
+
+def start_background_warmup():
+    """Run the warmup, once per process, on a daemon thread so the server can answer health checks straight away"""
+    global _warmup_thread
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=_warm_up, name='startup-warmup', daemon=True)
+        _warmup_thread.start()
+
+
+def preload_for_workers():
+    """Load sheet data in the gunicorn master so forked workers share it copy-on-write"""
+    started = time.perf_counter()
+    data_store.preload()
+    data_store.prepare_fork()
+    # Keep the loaded objects out of the workers' garbage collections, which would
+    # otherwise write to every one of them and un-share their copy-on-write pages
+    gc.freeze()
+    record_startup_timing('preload_ms', started)
+    if data_store.is_ready():
+        STARTUP_TIMINGS.setdefault('ready_ms', round((time.perf_counter() - _MODULE_STARTED) * 1000, 1))
+    logger.info("Preloaded sheet data for workers in %s ms", STARTUP_TIMINGS['preload_ms'])
+
+
+def after_worker_fork(workers=1):
+    """Reset fork-unsafe state in one of `workers` gunicorn workers and start its warmup"""
+    global _session_client_lock, _trip_plan_stats_lock, lookup_executor
+    if log_handler is not None:
+        log_handler.after_fork()
+    metrics.after_fork()
+    _session_client_lock = threading.Lock()
+    _trip_plan_stats_lock = threading.Lock()
+    lookup_executor = new_lookup_executor()
+    data_store.after_fork()
+    message_queue.after_fork()
+    message_deduplicator.after_fork()
+    graph_api.after_fork()
+    outbound_scheduler.after_fork(processes=workers)
+    if STARTUP_WARMUP:
+        # Dialogflow's gRPC channel is not fork-safe, so each worker creates its own here
+        start_background_warmup()
+
+
+record_startup_timing('module_ms', _MODULE_STARTED)
+if data_store.is_ready():
+    # Served from the local snapshot file, so ready as soon as the module has loaded
+    STARTUP_TIMINGS['ready_ms'] = STARTUP_TIMINGS['module_ms']
+
+
 if __name__ == '__main__':
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if STARTUP_WARMUP and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_warmup()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
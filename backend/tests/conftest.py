@@ -0,0 +1,7 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Keep the module-level data store from loading a snapshot file left by a local run
+os.environ['SHEET_SNAPSHOT_PATH'] = ''
@@ -0,0 +1,30 @@
+"""PriceRankedGroup budget queries against a plain filter and sort"""
+import random
+
+import pytest
+
+from main import AccommodationRecord, PriceRankedGroup
+
+
+def make_records(count, rng):
+    prices = [None] + [rng.randint(1, 50) * 1000 for _ in range(5)]
+    return [AccommodationRecord({}, position, None, None, rng.choice(prices), rng.choice([0.0, 3.5, 4.5, rng.uniform(0, 5)]))
+            for position in range(count)]
+
+
+def expected(records, min_price, max_price, limit):
+    matches = [record for record in records if record.price is None or (
+        (min_price is None or record.price >= min_price) and (max_price is None or record.price <= max_price))]
+    return sorted(matches, key=lambda record: (-record.rating, record.position))[:limit]
+
+
+@pytest.mark.parametrize('count', [0, 1, 15, 16, 17, 33, 100, 257, 1000])
+def test_top_rated_matches_filter_and_sort(count):
+    rng = random.Random(count)
+    records = make_records(count, rng)
+    group = PriceRankedGroup(records)
+    for _ in range(200):
+        low, high = sorted(rng.randint(0, 52000) for _ in range(2))
+        min_price, max_price = rng.choice([None, low]), rng.choice([None, high])
+        limit = rng.choice([1, 5, PriceRankedGroup.RANKED_BLOCK_SIZE, 20])
+        assert group.top_rated(min_price, max_price, limit) == expected(records, min_price, max_price, limit)
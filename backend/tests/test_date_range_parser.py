@@ -0,0 +1,101 @@
+"""DateRangeParser.parse_date_query against a fixed clock"""
+from datetime import datetime
+
+import pytest
+
+import main
+from main import DateRangeParser
+
+
+class FrozenClock(datetime):
+    """datetime whose now() is set by the test, as parse_date_query reads main.datetime.now()"""
+    current = datetime(2025, 12, 17, 12, 0)  # A Wednesday
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(main, 'datetime', FrozenClock)
+    monkeypatch.setattr(FrozenClock, 'current', FrozenClock.current)
+    DateRangeParser._parse_normalized.cache_clear()
+    return FrozenClock
+
+
+def day(month, day_of_month, year=2025):
+    return datetime(year, month, day_of_month)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('events this weekend', (day(12, 20), day(12, 21))),
+    ('weekend', (day(12, 20), day(12, 21))),
+    ('Whats on NEXT  week', (day(12, 22), day(12, 28))),
+    ('this week', (day(12, 15), day(12, 21))),
+    ('today', (day(12, 17), day(12, 17))),
+    ('tomorrow night', (day(12, 18), day(12, 18))),
+    ('next 3 days', (day(12, 17), day(12, 19))),
+    ('next 1 day', (day(12, 17), day(12, 17))),
+    ('next 2 weeks', (day(12, 17), day(12, 30))),
+    ('this month', (day(12, 1), day(12, 31))),
+    ('december 20th', (day(12, 20), day(12, 20))),
+    ('20th of december', (day(12, 20), day(12, 20))),
+    ('dec. 20', (day(12, 20), day(12, 20))),
+    ('2026-01-15', (day(1, 15, 2026), day(1, 15, 2026))),
+    ('dec 30 - jan 2', (day(12, 30), day(1, 2, 2026))),
+    ('5-7 jan', (day(1, 5, 2026), day(1, 7, 2026))),
+    # Months already past this year mean next year's
+    ('parties in march', (day(3, 1, 2026), day(3, 31, 2026))),
+    ('sept 5th', (day(9, 5, 2026), day(9, 5, 2026))),
+    ('DEC', (day(12, 1), day(12, 31))),
+    # An impossible day still gives the month
+    ('feb 30', (day(2, 1, 2026), day(2, 28, 2026))),
+    # The most specific expression wins
+    ('this weekend in december', (day(12, 1), day(12, 31))),
+    ('december 20th this weekend', (day(12, 20), day(12, 20))),
+    # Numeric day/month dates are not understood and fall back to the whole year
+    ('anything on 20/12', (day(1, 1), day(12, 31))),
+    ('show me events', (day(1, 1), day(12, 31))),
+    ('mayfair market', (day(1, 1), day(12, 31))),
+    # "may" is a month only with a day, after "in" or "of", or on its own
+    ('may i see events this week', (day(12, 15), day(12, 21))),
+    ('may i get a table tomorrow', (day(12, 18), day(12, 18))),
+    ('may i see some events', (day(1, 1), day(12, 31))),
+    ('events in may', (day(5, 1, 2026), day(5, 31, 2026))),
+    ('first week of may', (day(5, 1, 2026), day(5, 31, 2026))),
+    ('May', (day(5, 1, 2026), day(5, 31, 2026))),
+    ('may 5th', (day(5, 5, 2026), day(5, 5, 2026))),
+    ('5th of may', (day(5, 5, 2026), day(5, 5, 2026))),
+    ('', (None, None)),
+    (None, (None, None)),
+])
+def test_parse_date_query(clock, query, expected):
+    assert DateRangeParser.parse_date_query(query) == expected
+
+
+def test_cached_results_follow_the_date(clock):
+    clock.current = datetime(2025, 12, 19, 23, 59)  # Friday night
+    assert DateRangeParser.parse_date_query('today') == (day(12, 19), day(12, 19))
+    assert DateRangeParser.parse_date_query('tomorrow') == (day(12, 20), day(12, 20))
+    clock.current = datetime(2025, 12, 20, 0, 1)
+    assert DateRangeParser.parse_date_query('today') == (day(12, 20), day(12, 20))
+    assert DateRangeParser.parse_date_query('tomorrow') == (day(12, 21), day(12, 21))
+
+    clock.current = datetime(2025, 12, 21, 23, 59)  # Sunday night
+    assert DateRangeParser.parse_date_query('next week') == (day(12, 22), day(12, 28))
+    clock.current = datetime(2025, 12, 22, 0, 1)
+    assert DateRangeParser.parse_date_query('next week') == (day(12, 29), day(1, 4, 2026))
+
+    clock.current = datetime(2025, 12, 31, 23, 59)
+    assert DateRangeParser.parse_date_query('december 20th') == (day(12, 20), day(12, 20))
+    clock.current = datetime(2026, 1, 1, 0, 1)
+    assert DateRangeParser.parse_date_query('december 20th') == (day(12, 20, 2026), day(12, 20, 2026))
+    assert DateRangeParser.parse_date_query('show me events') == (day(1, 1, 2026), day(12, 31, 2026))
+
+
+def test_queries_are_normalized_before_caching(clock):
+    DateRangeParser.parse_date_query('Events  THIS weekend')
+    DateRangeParser.parse_date_query('events this   weekend')
+    info = DateRangeParser._parse_normalized.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
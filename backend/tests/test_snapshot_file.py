@@ -0,0 +1,105 @@
+"""Round trips through the memory-mapped snapshot file, against the list-backed store it replaces"""
+import struct
+
+import pytest
+
+import main
+from benchmarks.bench_queries import (
+    ACCOMMODATION_QUERIES, EVENT_QUERIES, OUTFIT_QUERIES, FakeSheetsClient, make_sheets,
+)
+
+
+@pytest.fixture(scope='module')
+def list_store():
+    store = main.GoogleSheetsDataStore(client=FakeSheetsClient(make_sheets(300)), snapshot_path=None)
+    assert store.refresh_all()
+    return store
+
+
+@pytest.fixture(scope='module')
+def snapshot_path(list_store, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('snapshot') / 'sheets.bin')
+    assert list_store.save_snapshot_file(path)
+    return path
+
+
+@pytest.fixture(scope='module')
+def mapped_store(snapshot_path):
+    store = main.GoogleSheetsDataStore(client=FakeSheetsClient({}), snapshot_path=None)
+    store._store_mapped_snapshots(main.read_snapshot_file(snapshot_path))
+    return store
+
+
+def test_mapped_rows_match_fetched_rows(list_store, mapped_store):
+    for sheet_type in main.SHEET_CONFIG:
+        fetched = list_store._get_sheet_data(sheet_type)
+        mapped = mapped_store._get_sheet_data(sheet_type)
+        assert isinstance(mapped, main.MappedSheet)
+        assert len(mapped) == len(fetched)
+        assert list(mapped) == fetched
+        assert mapped[-1] == fetched[-1]
+        assert mapped[10:20] == fetched[10:20]
+
+
+@pytest.mark.parametrize('filters', EVENT_QUERIES + [{'area': 'ikoyi', 'event_type': 'party'}])
+def test_events_match(list_store, mapped_store, filters):
+    assert mapped_store.get_events(dict(filters)) == list_store.get_events(dict(filters))
+
+
+@pytest.mark.parametrize('filters', ACCOMMODATION_QUERIES + [{'accommodation_type': 'shortlet', 'area': 'ikeja'}])
+def test_accommodations_match(list_store, mapped_store, filters):
+    assert mapped_store.get_accommodations(dict(filters)) == list_store.get_accommodations(dict(filters))
+
+
+@pytest.mark.parametrize('event_type, gender', OUTFIT_QUERIES + [('club_night', 'male')])
+def test_outfits_match(list_store, mapped_store, event_type, gender):
+    assert mapped_store.get_outfit_suggestions(event_type, gender) == list_store.get_outfit_suggestions(event_type, gender)
+
+
+def test_date_parse_stats_survive_the_file(list_store, mapped_store):
+    assert mapped_store.date_parse_stats == list_store.date_parse_stats
+
+
+def test_debug_outfits_serializes_mapped_rows(mapped_store, monkeypatch):
+    monkeypatch.setattr(main, 'data_store', mapped_store)
+    response = main.app.test_client().get('/debug-outfits')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['all_outfits'] == list(mapped_store._get_sheet_data('outfits'))
+
+
+def test_refresh_serves_the_file_it_wrote(tmp_path):
+    store = main.GoogleSheetsDataStore(client=FakeSheetsClient(make_sheets(50)), snapshot_path=str(tmp_path / 'shared.bin'))
+    notified = []
+    store.add_snapshot_listener(notified.append)
+    store.preload()
+    assert notified == [list(main.SHEET_CONFIG)]
+    assert all(isinstance(store._get_sheet_data(sheet_type), main.MappedSheet) for sheet_type in main.SHEET_CONFIG)
+
+
+@pytest.mark.parametrize('keep', [0, 4, 40, 0.5])
+def test_truncated_file_is_ignored(snapshot_path, tmp_path, keep):
+    with open(snapshot_path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    truncated = tmp_path / 'truncated.bin'
+    truncated.write_bytes(data[:int(len(data) * keep) if isinstance(keep, float) else keep])
+
+    with pytest.raises(ValueError):
+        main.read_snapshot_file(str(truncated))
+    store = main.GoogleSheetsDataStore(client=FakeSheetsClient({}), snapshot_path=str(truncated))
+    assert store._snapshots == {}
+
+
+def test_old_format_version_is_ignored(snapshot_path, tmp_path):
+    with open(snapshot_path, 'rb') as snapshot_file:
+        data = bytearray(snapshot_file.read())
+    struct.pack_into('<H', data, len(main.SNAPSHOT_FILE_MAGIC), main.SNAPSHOT_FORMAT_VERSION - 1)
+    old = tmp_path / 'old.bin'
+    old.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match='version'):
+        main.read_snapshot_header(str(old))
+    with pytest.raises(ValueError, match='version'):
+        main.read_snapshot_file(str(old))
+    store = main.GoogleSheetsDataStore(client=FakeSheetsClient({}), snapshot_path=str(old))
+    assert store._snapshots == {}
@@ -0,0 +1,48 @@
+"""StageMetrics shards across threads that come and go"""
+import gc
+import threading
+import time
+
+import main
+
+
+def record(metrics, intent, spans):
+    main.set_metric_labels('chat_with_agent', intent)
+    for _ in range(spans):
+        metrics.observe('normalize', time.perf_counter())
+        metrics.count('reply')
+
+
+def test_exited_threads_keep_their_numbers():
+    metrics = main.StageMetrics()
+    threads = [threading.Thread(target=record, args=(metrics, f"intent.{i % 2}", 5)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+
+    assert metrics._shards == {}
+    histograms, counters = metrics._totals()
+    for intent in ('intent.0', 'intent.1'):
+        assert sum(histograms[('normalize', 'chat_with_agent', intent)][:-1]) == 50
+        assert counters[('reply', 'chat_with_agent', intent)] == 50
+
+
+def test_labels_switch_within_a_thread():
+    metrics = main.StageMetrics()
+    record(metrics, 'a', 2)
+    record(metrics, 'b', 3)
+    record(metrics, 'a', 1)
+    _, counters = metrics._totals()
+    assert counters == {('reply', 'chat_with_agent', 'a'): 3, ('reply', 'chat_with_agent', 'b'): 3}
+
+
+def test_after_fork_drops_the_parents_numbers():
+    metrics = main.StageMetrics()
+    record(metrics, 'a', 2)
+    metrics.after_fork()
+    gc.collect()
+    assert metrics._totals() == ({}, {})
+    record(metrics, 'a', 1)
+    assert metrics._totals()[1] == {('reply', 'chat_with_agent', 'a'): 1}